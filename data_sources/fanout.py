@@ -0,0 +1,78 @@
+"""Bounded, order-preserving concurrent calls against data source backends."""
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+
+from .models import db_connector
+
+_backend_semaphores = {}
+_backend_lock = threading.Lock()
+
+
+def backend_semaphore(source):
+    """Process-wide semaphore that caps concurrent calls to one kind of backend."""
+    name = type(source).__name__
+    with _backend_lock:
+        semaphore = _backend_semaphores.get(name)
+        if semaphore is None:
+            limit = settings.DATA_SOURCE_CONCURRENCY.get(name, settings.DATA_SOURCE_DEFAULT_CONCURRENCY)
+            semaphore = threading.BoundedSemaphore(max(1, limit))
+            _backend_semaphores[name] = semaphore
+    return semaphore
+
+
+def _call(func, item, source):
+    with backend_semaphore(source):
+        try:
+            with db_connector.reuse_connection():
+                return func(item)
+        finally:
+            # Worker threads get their own Django connections; close them even
+            # when func fails, so pool threads never hold one between calls
+            connections.close_all()
+
+
+def fan_out(func, items, source_of=lambda item: item, max_workers=None):
+    """Yield func(item) for each item, in the order of `items`.
+
+    Calls run on a thread pool with at most `max_workers` in flight (default
+    settings.DATA_FETCH_MAX_WORKERS). Each call also holds the semaphore of
+    its backend, found with `source_of(item)`, so a single backend such as
+    the AWARE database never sees more than its configured share.
+
+    `func` may use the Django ORM (e.g. get_data_types() stores its cache,
+    the mirror and rollup read their state). A worker thread has its own
+    database connection, outside any transaction of the caller, and closes
+    it after every call.
+    """
+    items = list(items)
+    if max_workers is None:
+        max_workers = settings.DATA_FETCH_MAX_WORKERS
+    max_workers = min(max_workers, len(items))
+    if max_workers <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        remaining = iter(items)
+        try:
+            # Keep a bounded window of submitted calls so that results are not
+            # buffered faster than the caller consumes them.
+            for item in remaining:
+                pending.append(executor.submit(_call, func, item, source_of(item)))
+                if len(pending) >= max_workers * 2:
+                    break
+            while pending:
+                result = pending.popleft().result()
+                item = next(remaining, None)
+                if item is not None:
+                    pending.append(executor.submit(_call, func, item, source_of(item)))
+                yield result
+        finally:
+            for future in pending:
+                future.cancel()
@@ -0,0 +1,201 @@
+"""Build a synthetic SQLite stand-in for the AWARE database.
+
+Creates aware_device, device_lookup and *_transformed tables filled with
+plausible sensor rows for a number of devices, so db_connector can be
+exercised locally with AWARE_DB_ENGINE=sqlite. With --link-study, every
+device also gets a participant, an active AwareDataSource and a consent in
+the deployment's study.
+"""
+import math
+import os
+import random
+import sqlite3
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from data_sources.models import AwareDataSource
+from studies.models import Consent, Study, StudyParticipant
+from users.models import Profile
+
+# Columns of each transformed table besides _id, timestamp and device_uid,
+# and how to make one plausible value for them
+TABLES = {
+    'battery': {
+        'columns': ['battery_level INTEGER', 'battery_status INTEGER', 'battery_scale INTEGER',
+                    'battery_voltage INTEGER', 'battery_temperature INTEGER'],
+        'row': lambda rng, t: (int(50 + 50 * math.sin(t / 3.6e7)), rng.choice((2, 3, 5)), 100,
+                               rng.randint(3600, 4300), rng.randint(200, 400)),
+    },
+    'screen': {
+        'columns': ['screen_status INTEGER'],
+        'row': lambda rng, t: (rng.randint(0, 3),),
+    },
+    'accelerometer': {
+        'columns': ['double_values_0 REAL', 'double_values_1 REAL', 'double_values_2 REAL', 'accuracy INTEGER'],
+        'row': lambda rng, t: (rng.gauss(0, 1), rng.gauss(0, 1), rng.gauss(9.81, 1), 3),
+    },
+    'locations': {
+        'columns': ['double_latitude REAL', 'double_longitude REAL', 'double_altitude REAL',
+                    'accuracy REAL', 'provider TEXT'],
+        'row': lambda rng, t: (60.17 + rng.gauss(0, 0.01), 24.94 + rng.gauss(0, 0.01),
+                               rng.uniform(0, 50), rng.uniform(5, 50), rng.choice(('gps', 'network', 'fused'))),
+    },
+}
+# Samples per minute and device
+DEFAULT_RATES = {'battery': 1, 'screen': 2, 'accelerometer': 60, 'locations': 1}
+INSERT_BATCH = 50000
+
+
+def parse_rates(value):
+    """'battery=1,accelerometer=60' -> {'battery': 1.0, 'accelerometer': 60.0}"""
+    rates = {}
+    for item in filter(None, value.split(',')):
+        name, _, rate = item.partition('=')
+        if name not in TABLES:
+            raise CommandError(f"Unknown table '{name}'; choose from {', '.join(sorted(TABLES))}")
+        try:
+            rates[name] = float(rate)
+        except ValueError:
+            raise CommandError(f"Invalid rate for '{name}': '{rate}'")
+    return rates
+
+
+def _rows(rng, table, device_uid, start_ms, end_ms, rate):
+    """Rows of one device, sampled `rate` times per minute with some jitter."""
+    make_row = TABLES[table]['row']
+    step = 60000 / rate
+    timestamp = start_ms + rng.uniform(0, step)
+    while timestamp < end_ms:
+        t = int(timestamp)
+        yield (t, device_uid, *make_row(rng, t))
+        timestamp += step * rng.uniform(0.5, 1.5)
+
+
+def build(path, devices, days, rates, label_prefix='standin', seed=0, end_ms=None, log=None):
+    """Write a fresh stand-in database to `path`. Returns {device_label: device_id}."""
+    rng = random.Random(seed)
+    end_ms = end_ms or int(time.time() * 1000)
+    start_ms = end_ms - int(days * 86400000)
+    if os.path.exists(path):
+        os.remove(path)
+    db = sqlite3.connect(path)
+    # A throwaway build: trade durability for speed
+    db.execute("PRAGMA journal_mode = OFF")
+    db.execute("PRAGMA synchronous = OFF")
+    db.execute("CREATE TABLE aware_device (_id INTEGER PRIMARY KEY AUTOINCREMENT, device_id TEXT, label TEXT)")
+    db.execute("CREATE INDEX aware_device_label ON aware_device (label)")
+    db.execute("CREATE TABLE device_lookup (id INTEGER PRIMARY KEY AUTOINCREMENT, device_uuid TEXT UNIQUE)")
+    for table in rates:
+        columns = ', '.join(TABLES[table]['columns'])
+        db.execute(
+            f"CREATE TABLE {table}_transformed (_id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            f"timestamp INTEGER NOT NULL, device_uid INTEGER NOT NULL, {columns})"
+        )
+
+    labels = {}
+    for n in range(devices):
+        device_label = f"{label_prefix}-{n}"
+        device_id = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        db.execute("INSERT INTO aware_device (device_id, label) VALUES (?, ?)", (device_id, device_label))
+        device_uid = db.execute("INSERT INTO device_lookup (device_uuid) VALUES (?)", (device_id,)).lastrowid
+        labels[device_label] = device_id
+        for table, rate in rates.items():
+            if rate <= 0:
+                continue
+            names = ['timestamp', 'device_uid'] + [c.split()[0] for c in TABLES[table]['columns']]
+            insert = (
+                f"INSERT INTO {table}_transformed ({', '.join(names)}) "
+                f"VALUES ({', '.join('?' * len(names))})"
+            )
+            batch = []
+            for row in _rows(rng, table, device_uid, start_ms, end_ms, rate):
+                batch.append(row)
+                if len(batch) >= INSERT_BATCH:
+                    db.executemany(insert, batch)
+                    batch = []
+            if batch:
+                db.executemany(insert, batch)
+        db.commit()
+        if log:
+            log(f"Device {n + 1}/{devices} ({device_label}) written")
+
+    # Same access paths as the production indexes
+    for table in rates:
+        db.execute(f"CREATE INDEX {table}_device_time ON {table}_transformed (device_uid, timestamp, _id)")
+    db.commit()
+    db.close()
+    return labels
+
+
+def link_study(study, labels, password):
+    """Give each stand-in device a participant, an active source and a complete consent."""
+    for device_label, device_id in labels.items():
+        user, _ = User.objects.get_or_create(username=device_label, defaults={'email': f'{device_label}@example.com'})
+        user.set_password(password)
+        user.save()
+        profile, _ = Profile.objects.get_or_create(user=user, defaults={'user_type': 'participant'})
+        AwareDataSource.objects.filter(device_label=device_label).delete()
+        source = AwareDataSource.objects.create(
+            profile=profile, name='Stand-in phone', device_label=device_label,
+            device_id=device_id, status='active',
+        )
+        study_participant, _ = StudyParticipant.objects.get_or_create(participant=profile, study=study)
+        Consent.objects.create(
+            participant=profile, study=study, study_participant=study_participant, data_source=source,
+            source_type='AwareDataSource', is_complete=True, consent_text_accepted=True,
+            consent_date=timezone.now(), data_start=timezone.now() - timedelta(days=365),
+        )
+
+
+class Command(BaseCommand):
+    help = 'Build a synthetic SQLite stand-in for the AWARE database (use with AWARE_DB_ENGINE=sqlite).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default=settings.AWARE_DB_SQLITE_PATH,
+                            help='Database file to (re)create. Defaults to AWARE_DB_SQLITE_PATH.')
+        parser.add_argument('--devices', type=int, default=10, help='Number of devices.')
+        parser.add_argument('--days', type=float, default=7, help='Time span of the data, ending now.')
+        parser.add_argument('--rates', default=','.join(f'{k}={v}' for k, v in DEFAULT_RATES.items()),
+                            help='Samples per minute per table, e.g. "battery=1,accelerometer=60".')
+        parser.add_argument('--label-prefix', default='standin', help='Device labels are <prefix>-<n>.')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, for reproducible databases.')
+        parser.add_argument('--link-study', action='store_true',
+                            help='Create a participant, source and consent per device in the study.')
+        parser.add_argument('--password', default='standin',
+                            help='Password of the participants created with --link-study.')
+
+    def handle(self, *args, **options):
+        rates = parse_rates(options['rates'])
+        if options['devices'] < 1 or options['days'] <= 0:
+            raise CommandError('--devices and --days must be positive.')
+        study = None
+        if options['link_study']:
+            study = Study.objects.first()
+            if study is None:
+                raise CommandError('No study exists; run create_study first.')
+
+        expected = int(options['devices'] * options['days'] * 1440 * sum(rates.values()))
+        self.stdout.write(f"Writing about {expected:,} rows to {options['path']}...")
+        started = time.monotonic()
+        labels = build(
+            options['path'], options['devices'], options['days'], rates,
+            label_prefix=options['label_prefix'], seed=options['seed'],
+            log=lambda message: self.stdout.write(message) if options['verbosity'] > 1 else None,
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Built {len(labels)} devices in {time.monotonic() - started:.1f}s."
+        ))
+
+        if study is not None:
+            link_study(study, labels, options['password'])
+            self.stdout.write(f"Linked {len(labels)} participants to '{study.title}'.")
+        if settings.AWARE_DB_ENGINE != 'sqlite':
+            self.stdout.write(
+                f"Set AWARE_DB_ENGINE=sqlite and AWARE_DB_SQLITE_PATH={options['path']} to use it."
+            )
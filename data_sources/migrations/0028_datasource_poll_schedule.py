@@ -0,0 +1,24 @@
+# Generated by Django 4.2 on 2026-10-17 21:35
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_sources', '0027_remove_googleportabilitydatasource_data_end_date_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datasource',
+            name='next_poll_at',
+            field=models.DateTimeField(blank=True, db_index=True, default=django.utils.timezone.now, null=True),
+        ),
+        migrations.AddField(
+            model_name='datasource',
+            name='poll_attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-17 21:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_sources', '0028_datasource_poll_schedule'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tiktokportabilitydatasource',
+            name='data_type_status',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 4.2 on 2026-10-17 21:56
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_sources', '0029_tiktokportabilitydatasource_data_type_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AwareMirrorRow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data_type', models.CharField(max_length=100)),
+                ('day', models.DateField()),
+                ('device_uid', models.BigIntegerField()),
+                ('timestamp', models.BigIntegerField(help_text='AWARE timestamp in milliseconds')),
+                ('aware_id', models.BigIntegerField(help_text='_id of the row in the AWARE table')),
+                ('data', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AwareMirrorState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device_label', models.CharField(db_index=True, max_length=150)),
+                ('device_id', models.CharField(max_length=100)),
+                ('device_uid', models.BigIntegerField()),
+                ('data_type', models.CharField(max_length=100)),
+                ('last_timestamp', models.BigIntegerField(default=-1)),
+                ('last_id', models.BigIntegerField(default=-1)),
+                ('synced_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='awaremirrorstate',
+            constraint=models.UniqueConstraint(fields=('device_uid', 'data_type'), name='unique_aware_mirror_state'),
+        ),
+        migrations.AddIndex(
+            model_name='awaremirrorrow',
+            index=models.Index(fields=['data_type', 'device_uid', 'timestamp', 'aware_id'], name='data_source_data_ty_651812_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='awaremirrorrow',
+            index=models.Index(fields=['data_type', 'day'], name='data_source_data_ty_cea187_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='awaremirrorrow',
+            constraint=models.UniqueConstraint(fields=('data_type', 'device_uid', 'aware_id'), name='unique_aware_mirror_row'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2 on 2026-10-17 22:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_sources', '0030_aware_mirror'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AwareDailyCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device_uid', models.BigIntegerField()),
+                ('data_type', models.CharField(max_length=100)),
+                ('day', models.DateField(help_text="UTC day of the rows' timestamp")),
+                ('row_count', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='AwareRollupState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('device_label', models.CharField(db_index=True, max_length=150)),
+                ('device_uid', models.BigIntegerField()),
+                ('data_type', models.CharField(max_length=100)),
+                ('last_id', models.BigIntegerField(default=-1)),
+                ('refreshed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='awarerollupstate',
+            constraint=models.UniqueConstraint(fields=('device_uid', 'data_type'), name='unique_aware_rollup_state'),
+        ),
+        migrations.AddConstraint(
+            model_name='awaredailycount',
+            constraint=models.UniqueConstraint(fields=('device_uid', 'data_type', 'day'), name='unique_aware_daily_count'),
+        ),
+    ]
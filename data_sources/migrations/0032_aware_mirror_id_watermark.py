@@ -0,0 +1,24 @@
+# Generated by Django 4.2 on 2026-10-17 23:15
+
+from django.db import migrations
+
+
+def reset_watermarks(apps, schema_editor):
+    # The old (timestamp, _id) watermarks may have skipped late uploads;
+    # re-read every table, the unique constraint drops rows already mirrored.
+    apps.get_model('data_sources', 'AwareMirrorState').objects.update(last_id=-1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_sources', '0031_aware_daily_counts'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='awaremirrorstate',
+            name='last_timestamp',
+        ),
+        migrations.RunPython(reset_watermarks, migrations.RunPython.noop),
+    ]
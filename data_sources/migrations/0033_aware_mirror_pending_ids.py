@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-17 23:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('data_sources', '0032_aware_mirror_id_watermark'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='awaremirrorstate',
+            name='pending_ids',
+            field=models.JSONField(blank=True, default=list, help_text='_ids missing below last_id'),
+        ),
+    ]
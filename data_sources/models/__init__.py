@@ -3,4 +3,6 @@ from .jsonurl import JsonUrlDataSource
 from .aware import AwareDataSource
 from .google_portability import GooglePortabilityDataSource
 from .tiktok_portability import TikTokPortabilityDataSource
+from .aware_mirror import AwareMirrorRow, AwareMirrorState
+from .aware_rollup import AwareDailyCount, AwareRollupState
 from .utils import get_display_type_from_source_type
@@ -0,0 +1,126 @@
+"""Time-bucketed aggregates of data source rows.
+
+Buckets are aligned to the Unix epoch in UTC; a row belongs to bucket
+FLOOR(timestamp / bucket_ms). Each result row has the bucket start as
+`timestamp` (milliseconds, like AWARE rows), the number of rows in the
+bucket as `count`, and `<column>_<aggregate>` for every numeric column.
+
+AWARE pushes the grouping down into SQL (db_connector.aggregate_aware_data).
+Other sources go through aggregate_rows(), which reduces one page of rows
+at a time with pandas and merges the partial results, so only a page is
+held in memory.
+"""
+import re
+from decimal import Decimal
+
+import pandas as pd
+
+AGGREGATES = ('count', 'mean', 'min', 'max', 'sum')
+DEFAULT_AGGREGATES = ('count', 'mean', 'min', 'max')
+BUCKET_UNITS = {'s': 1000, 'm': 60 * 1000, 'h': 3600 * 1000, 'd': 86400 * 1000}
+# Identifiers and the time axis are never aggregated
+SKIP_COLUMNS = {'_id', 'timestamp', 'device_uid'}
+
+
+def parse_bucket(value):
+    """'15m' -> 900000 (milliseconds). Raises ValueError."""
+    match = re.fullmatch(r'(\d+)([smhd])', value or '')
+    if not match or int(match.group(1)) <= 0:
+        raise ValueError(f"Invalid bucket '{value}'; use e.g. 30s, 15m, 1h or 1d")
+    return int(match.group(1)) * BUCKET_UNITS[match.group(2)]
+
+
+def parse_aggregates(value):
+    """'count,mean' -> ['count', 'mean']; empty means DEFAULT_AGGREGATES. Raises ValueError."""
+    aggregates = [name.strip() for name in (value or '').split(',') if name.strip()]
+    unknown = [name for name in aggregates if name not in AGGREGATES]
+    if unknown:
+        raise ValueError(f"Unknown aggregate '{unknown[0]}'; choose from {', '.join(AGGREGATES)}")
+    return list(dict.fromkeys(aggregates)) or list(DEFAULT_AGGREGATES)
+
+
+def numeric_columns(rows):
+    """Columns whose non-null values are all numbers, in first-seen order."""
+    columns = {}
+    for row in rows:
+        for name, value in row.items():
+            if name in SKIP_COLUMNS or value is None:
+                continue
+            is_number = isinstance(value, (int, float, Decimal)) and not isinstance(value, bool)
+            columns[name] = columns.get(name, True) and is_number
+    return [name for name, is_number in columns.items() if is_number]
+
+
+def plain(value):
+    """JSON-friendly scalar: Decimal -> float, NaN -> None."""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+
+def _timestamps_ms(series):
+    """Epoch milliseconds from numeric or ISO 8601 timestamps; NaN where unparseable."""
+    numeric = pd.to_numeric(series, errors='coerce')
+    text = series[numeric.isna() & series.notna()]
+    if len(text):
+        parsed = pd.to_datetime(text.astype(str), utc=True, errors='coerce', format='ISO8601')
+        numeric[text.index] = (parsed - pd.Timestamp(0, tz='UTC')) // pd.Timedelta(milliseconds=1)
+    return numeric
+
+
+def _reduce_page(rows, bucket_ms):
+    """(rows per bucket, per bucket and column count/sum/min/max) of one page."""
+    frame = pd.DataFrame.from_records(rows)
+    if 'timestamp' not in frame:
+        return None, None
+    buckets = _timestamps_ms(frame['timestamp']) // bucket_ms
+    frame = frame[numeric_columns(rows)].apply(pd.to_numeric, errors='coerce')
+    frame['bucket'] = buckets
+    frame = frame[buckets.notna()]
+    counts = frame.groupby('bucket').size()
+    values = frame.melt(id_vars='bucket', var_name='column').dropna(subset=['value'])
+    stats = values.groupby(['bucket', 'column'])['value'].agg(['count', 'sum', 'min', 'max'])
+    return counts, stats
+
+
+def aggregate_rows(rows, bucket_ms, aggregates, page_size=5000):
+    """Aggregate an iterable of row dicts into time buckets; see the module docstring."""
+    counts, stats = [], []
+    page = []
+
+    def reduce():
+        page_counts, page_stats = _reduce_page(page, bucket_ms)
+        if page_counts is not None:
+            counts.append(page_counts)
+            stats.append(page_stats)
+        page.clear()
+
+    for row in rows:
+        page.append(row)
+        if len(page) >= page_size:
+            reduce()
+    if page:
+        reduce()
+    if not counts:
+        return []
+
+    counts = pd.concat(counts).groupby(level=0).sum()
+    stats = pd.concat(stats).groupby(level=[0, 1]).agg({'count': 'sum', 'sum': 'sum', 'min': 'min', 'max': 'max'})
+    stats['mean'] = stats['sum'] / stats['count']
+    value_aggregates = [name for name in aggregates if name != 'count']
+    columns = list(dict.fromkeys(stats.index.get_level_values('column')))
+    stats = stats[value_aggregates].to_dict('index') if value_aggregates else {}
+
+    result = []
+    for bucket, row_count in counts.items():
+        row = {'timestamp': int(bucket) * bucket_ms}
+        if 'count' in aggregates:
+            row['count'] = int(row_count)
+        for column in columns:
+            column_stats = stats.get((bucket, column))
+            for aggregate in value_aggregates:
+                row[f'{column}_{aggregate}'] = plain(column_stats[aggregate]) if column_stats else None
+        result.append(row)
+    return result
@@ -2,19 +2,28 @@ from django.shortcuts import render, redirect
 from django.conf import settings
 from django.db import models
 from django.urls import reverse
+from django.utils import timezone
 from django.http import JsonResponse
 from django.contrib import messages
 import qrcode
 from .base import DataSource
 from studies.models import Consent
-from . import db_connector
+from . import aware_mirror, aware_rollup, db_connector
 import uuid
 import qrcode
 import io
+from datetime import datetime, timedelta, timezone as dt_timezone
 import base64
 import requests
 
 
+def _split_mark(mark):
+    """(highest _id, missing _ids) of a sync mark; older marks are a bare _id."""
+    if isinstance(mark, list):
+        return mark[0], mark[1]
+    return mark, []
+
+
 class AwareDataSource(DataSource):
     
     device_label = models.CharField(max_length=150, unique=True, default=uuid.uuid4)
@@ -60,7 +69,8 @@ class AwareDataSource(DataSource):
         if self.status == 'active':
             return (True, "This device is already active.")
 
-        retrieved_device_ids = db_connector.get_device_ids_for_label(self.device_label)
+        # Bypass the cache: a device that just started uploading must be found right away
+        retrieved_device_ids = db_connector.get_device_ids_for_label(self.device_label, use_cache=False)
 
         if not retrieved_device_ids:
             return (False, "No data with that device label. It may take a few hours for data to appear. Please ensure AWARE is running on your device.") 
@@ -72,6 +82,7 @@ class AwareDataSource(DataSource):
         self.device_id = retrieved_device_ids[0]
         self.status = 'active'
         self.save()
+        db_connector.invalidate_device(self.device_label)
         return (True, "AWARE device confirmed and linked successfully!")
     
     def _process_data(self):
@@ -195,6 +206,17 @@ class AwareDataSource(DataSource):
             
 
     
+    @classmethod
+    def prefetch_data_types(cls, sources):
+        """Discover the tables of all active devices in a single batched pass."""
+        labels = [source.device_label for source in sources if source.status == 'active' and source.device_id]
+        if labels:
+            try:
+                db_connector.discover_devices(labels)
+            except db_connector.mysql.connector.Error as e:
+                # Only warms the cache; get_data_types reports the error per source
+                print(f"Error prefetching AWARE devices: {e}")
+
     def get_data_types(self):
         """  Returns a list of available data type names for this source. """
         print("Getting AWARE data types...", self.device_label)
@@ -204,17 +226,136 @@ class AwareDataSource(DataSource):
         return []
 
     
-    def fetch_data(self, data_type='battery', limit=None, start_date=None, end_date=None, offset=0):
+    def fetch_data(self, data_type='battery', limit=None, start_date=None, end_date=None, offset=0, after=None):
         """Get's the users data from the AWARE server"""
         print("Getting AWARE data...", self.device_label)
         if self.status == 'active' and self.device_id:
+            if settings.AWARE_MIRROR_ENABLED:
+                rows = aware_mirror.get_data(
+                    self.device_label, data_type, limit, start_date, end_date, offset, after
+                )
+                if rows is not None:
+                    return rows
             return db_connector.get_aware_data(
-                self.device_label, data_type, limit, start_date, end_date, offset
+                self.device_label, data_type, limit, start_date, end_date, offset, after
             )
         return []
 
+    def fetch_page(self, data_type='battery', limit=None, start_date=None, end_date=None, cursor=None):
+        """Pages by (timestamp, _id) so that every page costs the same."""
+        limit = limit or settings.DATA_PAGE_SIZE
+        after = (cursor['timestamp'], cursor['id']) if cursor else None
+        rows = self.fetch_data(
+            data_type=data_type,
+            limit=limit,
+            start_date=start_date,
+            end_date=end_date,
+            after=after,
+        )
+        if len(rows) < limit:
+            return rows, None
+        last = rows[-1]
+        return rows, {'timestamp': last['timestamp'], 'id': last['_id']}
+
+    def aggregate(self, data_type, bucket_ms, aggregates, start_date=None, end_date=None):
+        """Grouped with one GROUP BY query on the AWARE database."""
+        if not (self.status == 'active' and self.device_id):
+            return []
+        return db_connector.aggregate_aware_data(
+            self.device_label, data_type, bucket_ms, aggregates, start_date, end_date,
+        )
+
+    @classmethod
+    def sync_watermarks(cls, sources, data_type):
+        """[highest _id, missing _ids] (see db_connector.get_aware_id_mark), shared by all devices of the table."""
+        if not any(source.status == 'active' and source.device_id for source in sources):
+            return [None] * len(sources)
+        max_id, missing = db_connector.get_aware_id_mark(data_type)
+        if max_id is None:
+            return [None] * len(sources)
+        return [[max_id, missing]] * len(sources)
+
+    def iter_changes(self, data_type, since, until, start_date=None, end_date=None, page_size=None):
+        """Rows ingested between two sync_watermarks() marks, read from the AWARE database.
+
+        First the rows that filled a gap of `since`, then those with
+        since < _id <= until in _id order. Gaps still open at `until` are left
+        for the next sync, so no row is returned twice.
+        """
+        if not (self.status == 'active' and self.device_id) or until is None:
+            return
+        until_id, pending = _split_mark(until)
+        since_id, gaps = _split_mark(since) if since is not None else (-1, [])
+        filled = sorted(set(gaps) - set(pending))
+        if filled:
+            yield from self._iter_id_range(
+                data_type, -1, since_id, page_size, start_date, end_date, ids=filled,
+            )
+        yield from self._iter_id_range(
+            data_type, since_id, until_id, page_size, start_date, end_date, exclude_ids=pending,
+        )
+
+    def _iter_id_range(self, data_type, after_id, until_id, page_size, start_date, end_date, **filters):
+        limit = page_size or settings.DATA_PAGE_SIZE
+        while True:
+            rows = db_connector.get_aware_rows_between(
+                self.device_label, data_type, after_id, until_id, limit, start_date, end_date, **filters,
+            )
+            yield from rows
+            if len(rows) < limit:
+                return
+            after_id = rows[-1]['_id']
+
+    def daily_coverage(self, data_type, first_day, last_day):
+        """Rows per UTC day, from the rollup while it is fresh.
+
+        The current day, and every day if the rollup is not fresh, is counted
+        with one grouped query over all of the label's devices.
+        """
+        if not (self.status == 'active' and self.device_id):
+            return {}
+        if settings.AWARE_ROLLUP_ENABLED:
+            today = timezone.now().astimezone(dt_timezone.utc).date()
+            counts = aware_rollup.get_daily_counts(
+                self.device_label, data_type, first_day, min(last_day, today - timedelta(days=1)),
+            )
+            if counts is not None:
+                coverage = {day: (row_count, None) for day, row_count in counts.items()}
+                if last_day >= today:
+                    coverage.update(self._count_days(data_type, max(first_day, today), last_day))
+                return coverage
+        return self._count_days(data_type, first_day, last_day)
+
+    def _count_days(self, data_type, first_day, last_day):
+        device = db_connector.discover_devices([self.device_label]).get(self.device_label)
+        if not device or data_type not in device['tables']:
+            return {}
+        start_ms = (first_day - aware_rollup.EPOCH).days * aware_rollup.DAY_MS
+        end_ms = (last_day - aware_rollup.EPOCH).days * aware_rollup.DAY_MS + aware_rollup.DAY_MS
+        days = db_connector.count_rows_by_day(data_type, list(device['devices']), start_ms, end_ms)
+        return {
+            aware_rollup.EPOCH + timedelta(days=day): (
+                row_count, datetime.fromtimestamp(last_timestamp / 1000, tz=dt_timezone.utc),
+            )
+            for day, (row_count, last_timestamp) in days.items()
+        }
+
     def count_rows(self, data_type='battery', start_date=None, end_date=None):
         """Return the number of rows available for the given AWARE data_type."""
         if self.status == 'active' and self.device_id:
-            return db_connector.get_aware_count(self.device_label, data_type, start_date, end_date)
+            if settings.AWARE_ROLLUP_ENABLED:
+                count = aware_rollup.get_count(
+                    self.device_label, data_type, start_date, end_date,
+                    count_live=lambda start, end: self._count_live(data_type, start, end),
+                )
+                if count is not None:
+                    return count
+            return self._count_live(data_type, start_date, end_date)
         return 0
+
+    def _count_live(self, data_type, start_date=None, end_date=None):
+        if settings.AWARE_MIRROR_ENABLED:
+            count = aware_mirror.get_count(self.device_label, data_type, start_date, end_date)
+            if count is not None:
+                return count
+        return db_connector.get_aware_count(self.device_label, data_type, start_date, end_date)
@@ -0,0 +1,114 @@
+"""Shared cache for AWARE device lookups.
+
+Built on Django's cache framework, so with a Redis cache (CACHE_URL) every
+gunicorn and Celery process shares the same entries. Empty results are
+cached for a shorter time (negative caching), and only one process loads a
+missing key while the others wait for its result (stampede protection).
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+KEY_PREFIX = 'aware'
+LOCK_TIMEOUT = 10
+LOCK_POLL_INTERVAL = 0.05
+
+_MISSING = object()
+_EMPTY = '__empty__'
+
+
+def _cache():
+    return caches[settings.AWARE_CACHE_ALIAS]
+
+
+def _key(kind, key):
+    return f"{KEY_PREFIX}:{kind}:{key}"
+
+
+def _lock_key(kind, key):
+    return _key(kind, key) + ':lock'
+
+
+def _decode(value):
+    return None if value == _EMPTY else value
+
+
+def _get_many(kind, keys):
+    cache_keys = {_key(kind, key): key for key in keys}
+    found = _cache().get_many(list(cache_keys))
+    return {cache_keys[cache_key]: _decode(value) for cache_key, value in found.items()}
+
+
+def _set_many(kind, values, keys):
+    """Store loaded values; keys the loader had no value for are cached as empty."""
+    ttl = settings.AWARE_CACHE_TTLS[kind]
+    negative_ttl = settings.AWARE_CACHE_NEGATIVE_TTL
+    positive = {}
+    negative = {}
+    for key in keys:
+        value = values.get(key)
+        if value:
+            positive[_key(kind, key)] = value
+        else:
+            negative[_key(kind, key)] = _EMPTY
+    if positive:
+        _cache().set_many(positive, ttl)
+    if negative:
+        _cache().set_many(negative, negative_ttl)
+
+
+def _wait_for(kind, keys):
+    """Wait until other processes have loaded `keys`, or the lock expires."""
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    found = {}
+    pending = list(keys)
+    while pending and time.monotonic() < deadline:
+        time.sleep(LOCK_POLL_INTERVAL)
+        found.update(_get_many(kind, pending))
+        pending = [key for key in pending if key not in found]
+    return found
+
+
+def get_many_or_load(kind, keys, loader):
+    """Return {key: value} for `keys`, loading the missing ones with `loader`.
+
+    `loader(keys)` returns a dict of the values it found and should raise if
+    the backend fails, so that errors are never cached. Keys missing from its
+    result are cached as empty (None) for AWARE_CACHE_NEGATIVE_TTL seconds.
+    """
+    keys = list(dict.fromkeys(keys))
+    found = _get_many(kind, keys)
+    missing = [key for key in keys if key not in found]
+    if not missing:
+        return found
+
+    cache = _cache()
+    mine = [key for key in missing if cache.add(_lock_key(kind, key), 1, LOCK_TIMEOUT)]
+    try:
+        if mine:
+            loaded = loader(mine)
+            _set_many(kind, loaded, mine)
+            found.update({key: loaded.get(key) or None for key in mine})
+    finally:
+        if mine:
+            cache.delete_many([_lock_key(kind, key) for key in mine])
+
+    others = [key for key in missing if key not in mine]
+    if others:
+        found.update(_wait_for(kind, others))
+        leftover = [key for key in others if key not in found]
+        if leftover:
+            loaded = loader(leftover)
+            _set_many(kind, loaded, leftover)
+            found.update({key: loaded.get(key) or None for key in leftover})
+    return found
+
+
+def get_cached(kind, key, default=None):
+    value = _cache().get(_key(kind, key), _MISSING)
+    return default if value is _MISSING else _decode(value)
+
+
+def delete(kind, keys):
+    _cache().delete_many([_key(kind, key) for key in keys])
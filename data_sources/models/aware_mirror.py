@@ -0,0 +1,226 @@
+"""Local mirror of the AWARE *_transformed tables.
+
+A background task copies new rows of every study device into
+AwareMirrorRow, using a per-device, per-table _id watermark so each run
+only reads what arrived since the previous one, including rows that phones
+uploaded late with old timestamps. _ids still missing below the watermark
+(uncommitted transactions, see db_connector.get_aware_id_mark) are kept and
+copied once they appear. Reads are served in (timestamp, _id)
+order. While a device's mirror is fresh (synced within
+AWARE_MIRROR_MAX_AGE), AwareDataSource reads from it instead of the shared
+AWARE server. Devices that leave every study are purged.
+"""
+import base64
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import models, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import db_connector
+
+
+class AwareMirrorRow(models.Model):
+    """One row of an AWARE transformed table.
+
+    `data` holds the row as AWARE returns it, minus device_uid, with binary
+    values stored as text the way studies.rows.clean_row serves them. Rows are
+    grouped by data type and day; on PostgreSQL the table can be partitioned
+    on those columns.
+    """
+    data_type = models.CharField(max_length=100)
+    day = models.DateField()
+    device_uid = models.BigIntegerField()
+    timestamp = models.BigIntegerField(help_text="AWARE timestamp in milliseconds")
+    aware_id = models.BigIntegerField(help_text="_id of the row in the AWARE table")
+    data = models.JSONField(encoder=DjangoJSONEncoder)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['data_type', 'device_uid', 'aware_id'], name='unique_aware_mirror_row'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['data_type', 'device_uid', 'timestamp', 'aware_id']),
+            models.Index(fields=['data_type', 'day']),
+        ]
+
+    def __str__(self):
+        return f"{self.data_type} {self.device_uid}/{self.aware_id}"
+
+
+class AwareMirrorState(models.Model):
+    """How far the mirror of one device's table has been copied."""
+    device_label = models.CharField(max_length=150, db_index=True)
+    device_id = models.CharField(max_length=100)
+    device_uid = models.BigIntegerField()
+    data_type = models.CharField(max_length=100)
+    last_id = models.BigIntegerField(default=-1)
+    pending_ids = models.JSONField(default=list, blank=True, help_text="_ids missing below last_id")
+    synced_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['device_uid', 'data_type'], name='unique_aware_mirror_state'),
+        ]
+
+    def __str__(self):
+        return f"{self.device_label} {self.data_type}"
+
+    def is_fresh(self, now=None):
+        now = now or timezone.now()
+        return (
+            self.synced_at is not None
+            and now - self.synced_at <= timedelta(seconds=settings.AWARE_MIRROR_MAX_AGE)
+        )
+
+
+def _day(timestamp_ms):
+    return datetime.fromtimestamp(timestamp_ms / 1000, tz=dt_timezone.utc).date()
+
+
+def _json_value(value):
+    if isinstance(value, bytes):
+        try:
+            return value.decode('utf-8')
+        except UnicodeDecodeError:
+            return base64.b64encode(value).decode('ascii')
+    return value
+
+
+def _copy_rows(state, rows):
+    mirrored = []
+    for row in rows:
+        data = {name: _json_value(value) for name, value in row.items() if name != 'device_uid'}
+        mirrored.append(AwareMirrorRow(
+            data_type=state.data_type,
+            day=_day(row['timestamp']),
+            device_uid=state.device_uid,
+            timestamp=row['timestamp'],
+            aware_id=row['_id'],
+            data=data,
+        ))
+    AwareMirrorRow.objects.bulk_create(mirrored, ignore_conflicts=True)
+
+
+def sync_table(state):
+    """Copy the rows added to one device's table since the last sync.
+
+    Reads up to the table's current mark: first the pending _ids that have
+    appeared since, then the new range without the _ids still missing,
+    which become the new pending_ids. Returns the number of rows copied. The
+    watermark only moves forward together with the rows it covers, and
+    synced_at is only set once the table has been read to the mark.
+    """
+    batch_size = settings.AWARE_MIRROR_BATCH_SIZE
+    until_id, missing = db_connector.get_aware_id_mark(state.data_type)
+    copied = 0
+    if until_id is not None:
+        filled = sorted(set(state.pending_ids) - set(missing))
+        for start in range(0, len(filled), batch_size):
+            rows = db_connector.fetch_new_rows(
+                state.data_type, state.device_uid, ids=filled[start:start + batch_size], limit=batch_size,
+            )
+            _copy_rows(state, rows)
+            copied += len(rows)
+        # Copying a row twice is harmless (unique constraint), so the
+        # pending set only needs to be a superset while the range is read
+        state.pending_ids = missing
+        while state.last_id < until_id:
+            rows = db_connector.fetch_new_rows(
+                state.data_type, state.device_uid, after_id=state.last_id, until_id=until_id,
+                exclude_ids=missing, limit=batch_size,
+            )
+            state.last_id = rows[-1]['_id'] if len(rows) == batch_size else until_id
+            with transaction.atomic():
+                _copy_rows(state, rows)
+                state.save(update_fields=['last_id', 'pending_ids'])
+            copied += len(rows)
+    state.synced_at = timezone.now()
+    state.save(update_fields=['pending_ids', 'synced_at'])
+    return copied
+
+
+def sync_device(device_label):
+    """Bring the mirror of every table of a device label up to date."""
+    device = db_connector.discover_devices([device_label]).get(device_label)
+    if not device:
+        return 0
+    copied = 0
+    for device_uid, device_id in device['devices'].items():
+        for data_type in device['tables']:
+            state, _ = AwareMirrorState.objects.get_or_create(
+                device_uid=device_uid,
+                data_type=data_type,
+                defaults={'device_label': device_label, 'device_id': device_id},
+            )
+            if (state.device_label, state.device_id) != (device_label, device_id):
+                # The device was relinked to another label since the last sync
+                state.device_label, state.device_id = device_label, device_id
+                state.save(update_fields=['device_label', 'device_id'])
+            copied += sync_table(state)
+    return copied
+
+
+def purge(keep_labels):
+    """Delete the mirror of every device label not in keep_labels.
+
+    Returns the number of rows deleted.
+    """
+    states = AwareMirrorState.objects.exclude(device_label__in=list(keep_labels))
+    device_uids = list(states.values_list('device_uid', flat=True).distinct())
+    if not device_uids:
+        return 0
+    with transaction.atomic():
+        deleted, _ = AwareMirrorRow.objects.filter(device_uid__in=device_uids).delete()
+        AwareMirrorState.objects.filter(device_uid__in=device_uids).delete()
+    return deleted
+
+
+def _fresh_devices(device_label, data_type):
+    """{device_uid: device_id} if the label's mirror of data_type is fresh, else None."""
+    states = list(AwareMirrorState.objects.filter(device_label=device_label, data_type=data_type))
+    now = timezone.now()
+    if not states or not all(state.is_fresh(now) for state in states):
+        return None
+    return {state.device_uid: state.device_id for state in states}
+
+
+def _mirrored_rows(devices, data_type, start_date=None, end_date=None):
+    rows = AwareMirrorRow.objects.filter(data_type=data_type, device_uid__in=list(devices))
+    if start_date:
+        rows = rows.filter(timestamp__gte=int(start_date.timestamp() * 1000))
+    if end_date:
+        rows = rows.filter(timestamp__lte=int(end_date.timestamp() * 1000))
+    return rows
+
+
+def get_data(device_label, data_type, limit=None, start_date=None, end_date=None, offset=0, after=None):
+    """Same rows and order as db_connector.get_aware_data, or None if the mirror is not fresh."""
+    devices = _fresh_devices(device_label, data_type)
+    if devices is None:
+        return None
+    rows = _mirrored_rows(devices, data_type, start_date, end_date)
+    if after is not None:
+        after_timestamp, after_id = after
+        rows = rows.filter(
+            Q(timestamp__lt=after_timestamp) | Q(timestamp=after_timestamp, aware_id__lt=after_id)
+        )
+    rows = rows.order_by('-timestamp', '-aware_id').values_list('device_uid', 'data')
+    offset = int(offset or 0)
+    if limit:
+        rows = rows[offset:offset + int(limit)]
+    elif offset:
+        rows = rows[offset:]
+    return [dict(data, device_id=devices.get(device_uid)) for device_uid, data in rows]
+
+
+def get_count(device_label, data_type, start_date=None, end_date=None):
+    """Same as db_connector.get_aware_count, or None if the mirror is not fresh."""
+    devices = _fresh_devices(device_label, data_type)
+    if devices is None:
+        return None
+    return _mirrored_rows(devices, data_type, start_date, end_date).count()
@@ -0,0 +1,198 @@
+"""Per-device daily row counts of the AWARE transformed tables.
+
+A background task adds the rows that arrived since its last run (tracked by
+the AUTO_INCREMENT _id, so late uploads for past days are counted too, and
+_ids still missing below it are counted once committed) to AwareDailyCount. count_rows then adds up whole UTC days from the rollup and
+only counts the partial days at the ends of the range live.
+"""
+from datetime import date, datetime, time, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from . import db_connector
+
+EPOCH = date(1970, 1, 1)
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+class AwareDailyCount(models.Model):
+    device_uid = models.BigIntegerField()
+    data_type = models.CharField(max_length=100)
+    day = models.DateField(help_text="UTC day of the rows' timestamp")
+    row_count = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['device_uid', 'data_type', 'day'], name='unique_aware_daily_count'),
+        ]
+
+    def __str__(self):
+        return f"{self.device_uid} {self.data_type} {self.day}: {self.row_count}"
+
+
+class AwareRollupState(models.Model):
+    """The last AWARE _id counted for one device's table."""
+    device_label = models.CharField(max_length=150, db_index=True)
+    device_uid = models.BigIntegerField()
+    data_type = models.CharField(max_length=100)
+    last_id = models.BigIntegerField(default=-1)
+    pending_ids = models.JSONField(default=list, blank=True, help_text="_ids missing below last_id")
+    refreshed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['device_uid', 'data_type'], name='unique_aware_rollup_state'),
+        ]
+
+    def __str__(self):
+        return f"{self.device_label} {self.data_type}"
+
+    def is_fresh(self, now=None):
+        now = now or timezone.now()
+        return (
+            self.refreshed_at is not None
+            and now - self.refreshed_at <= timedelta(seconds=settings.AWARE_ROLLUP_MAX_AGE)
+        )
+
+
+def refresh_table(state):
+    """Add the rows that arrived since the last refresh to the daily counts.
+
+    The state row is locked while counting, so overlapping refreshes of the
+    same table count each row once. Returns the number of rows added.
+    """
+    with transaction.atomic():
+        state = AwareRollupState.objects.select_for_update().get(pk=state.pk)
+        until_id, missing = db_connector.get_aware_id_mark(state.data_type)
+        counts = {}
+        if until_id is not None:
+            filled = sorted(set(state.pending_ids) - set(missing))
+            counts = db_connector.count_new_rows_by_day(
+                state.data_type, state.device_uid, until_id=state.last_id, ids=filled,
+            )
+            if until_id > state.last_id:
+                new_counts = db_connector.count_new_rows_by_day(
+                    state.data_type, state.device_uid, after_id=state.last_id, until_id=until_id,
+                    exclude_ids=missing,
+                )
+                for day_number, row_count in new_counts.items():
+                    counts[day_number] = counts.get(day_number, 0) + row_count
+                state.last_id = until_id
+            state.pending_ids = missing
+        for day_number, row_count in counts.items():
+            day = EPOCH + timedelta(days=day_number)
+            updated = AwareDailyCount.objects.filter(
+                device_uid=state.device_uid, data_type=state.data_type, day=day,
+            ).update(row_count=F('row_count') + row_count)
+            if not updated:
+                AwareDailyCount.objects.create(
+                    device_uid=state.device_uid, data_type=state.data_type, day=day, row_count=row_count,
+                )
+        state.refreshed_at = timezone.now()
+        state.save(update_fields=['last_id', 'pending_ids', 'refreshed_at'])
+    return sum(counts.values())
+
+
+def refresh_device(device_label):
+    """Bring the daily counts of every table of a device label up to date."""
+    device = db_connector.discover_devices([device_label]).get(device_label)
+    if not device:
+        return 0
+    counted = 0
+    for device_uid in device['devices']:
+        for data_type in device['tables']:
+            state, _ = AwareRollupState.objects.get_or_create(
+                device_uid=device_uid, data_type=data_type, defaults={'device_label': device_label},
+            )
+            if state.device_label != device_label:
+                state.device_label = device_label
+                state.save(update_fields=['device_label'])
+            counted += refresh_table(state)
+    return counted
+
+
+def _day_start(day):
+    return datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+
+
+def split_range(start_date, end_date, today):
+    """Split [start_date, end_date] into whole UTC days before `today` and the rest.
+
+    Returns (first_day, last_day, partial_ranges). The whole days can be
+    answered from the rollup (first_day > last_day when there are none);
+    each (start, end) in partial_ranges must be counted live. None means
+    unbounded.
+    """
+    first_day = EPOCH
+    if start_date is not None:
+        first_day = start_date.astimezone(dt_timezone.utc).date()
+        if _day_start(first_day) < start_date:
+            first_day += timedelta(days=1)
+    last_day = today - timedelta(days=1)
+    if end_date is not None:
+        # end_date is inclusive; a day is whole if the range reaches its last millisecond
+        end_day = end_date.astimezone(dt_timezone.utc).date()
+        if end_date < _day_start(end_day + timedelta(days=1)) - timedelta(milliseconds=1):
+            end_day -= timedelta(days=1)
+        last_day = min(last_day, end_day)
+
+    if first_day > last_day:
+        return first_day, last_day, [(start_date, end_date)]
+    partial = []
+    if start_date is not None and start_date < _day_start(first_day):
+        partial.append((start_date, _day_start(first_day) - timedelta(milliseconds=1)))
+    after_rollup = _day_start(last_day + timedelta(days=1))
+    if end_date is None or end_date >= after_rollup:
+        partial.append((after_rollup, end_date))
+    return first_day, last_day, partial
+
+
+def _fresh_states(device_label, data_type, now):
+    states = list(AwareRollupState.objects.filter(device_label=device_label, data_type=data_type))
+    if not states or not all(state.is_fresh(now) for state in states):
+        return None
+    return states
+
+
+def get_daily_counts(device_label, data_type, first_day, last_day):
+    """{day: rows} of a label's data_type from first_day to last_day, or None if the rollup is not fresh.
+
+    Days without rows are left out. Only whole days before today are up to date.
+    """
+    states = _fresh_states(device_label, data_type, timezone.now())
+    if states is None:
+        return None
+    days = AwareDailyCount.objects.filter(
+        device_uid__in=[state.device_uid for state in states],
+        data_type=data_type,
+        day__gte=first_day,
+        day__lte=last_day,
+    ).values('day').annotate(total=Sum('row_count')).values_list('day', 'total')
+    return {day: total for day, total in days if total}
+
+
+def get_count(device_label, data_type, start_date=None, end_date=None, count_live=None):
+    """Rows of a label's data_type in the range, or None if the rollup is not fresh.
+
+    `count_live(start, end)` counts the partial days that the rollup cannot
+    answer, typically the current day.
+    """
+    now = timezone.now()
+    states = _fresh_states(device_label, data_type, now)
+    if states is None:
+        return None
+    first_day, last_day, partial = split_range(start_date, end_date, now.astimezone(dt_timezone.utc).date())
+    total = 0
+    if first_day <= last_day:
+        total = AwareDailyCount.objects.filter(
+            device_uid__in=[state.device_uid for state in states],
+            data_type=data_type,
+            day__gte=first_day,
+            day__lte=last_day,
+        ).aggregate(total=Sum('row_count'))['total'] or 0
+    for start, end in partial:
+        total += count_live(start, end)
+    return total
@@ -0,0 +1,84 @@
+"""SQLite stand-in for the AWARE MySQL database.
+
+With AWARE_DB_ENGINE = 'sqlite', db_connector opens AWARE_DB_SQLITE_PATH
+through connect() below instead of mysql.connector. The connection and
+cursor objects implement just the part of the mysql.connector API that
+db_connector uses, and translate its MySQL-isms (%s placeholders, SHOW
+TABLES, FLOOR) so the same queries run unchanged. Build a database with the
+build_aware_standin management command.
+"""
+import math
+import sqlite3
+
+import mysql.connector
+
+SHOW_TABLES = "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+
+
+def _translate(query):
+    if query.strip().upper() == "SHOW TABLES":
+        return SHOW_TABLES
+    return query.replace("%s", "?")
+
+
+def connect(path, read_only=True):
+    """Open the stand-in database. Raises mysql.connector.Error like the real driver."""
+    uri = f"file:{path}?mode=ro" if read_only else f"file:{path}?mode=rwc"
+    try:
+        # Pooled connections are handed between threads, one at a time
+        db = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    except sqlite3.Error as e:
+        raise mysql.connector.Error(f"Cannot open AWARE stand-in {path}: {e}")
+    db.create_function('FLOOR', 1, math.floor, deterministic=True)
+    return Connection(db)
+
+
+class Connection:
+    def __init__(self, db):
+        self.db = db
+
+    def cursor(self, dictionary=False):
+        return Cursor(self.db.cursor(), dictionary)
+
+    def ping(self, reconnect=False):
+        try:
+            self.db.execute("SELECT 1")
+        except sqlite3.Error as e:
+            raise mysql.connector.Error(str(e))
+
+    def close(self):
+        self.db.close()
+
+
+class Cursor:
+    def __init__(self, cursor, dictionary):
+        self._cursor = cursor
+        self._dictionary = dictionary
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def execute(self, query, params=()):
+        try:
+            self._cursor.execute(_translate(query), tuple(params or ()))
+        except sqlite3.Error as e:
+            raise mysql.connector.Error(str(e))
+
+    def _convert(self, rows):
+        if not self._dictionary:
+            return rows
+        names = [column[0] for column in self._cursor.description]
+        return [dict(zip(names, row)) for row in rows]
+
+    def fetchall(self):
+        return self._convert(self._cursor.fetchall())
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is None:
+            return None
+        return self._convert([row])[0]
+
+    def close(self):
+        self._cursor.close()
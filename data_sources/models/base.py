@@ -1,9 +1,14 @@
+import random
 import uuid
+from datetime import datetime, time, timedelta, timezone as dt_timezone
 from django.apps import apps
+from django.conf import settings
 from django.db import models
+from django.utils import timezone
 from django.core.exceptions import ValidationError
 from polymorphic.models import PolymorphicModel
 from users.models import Profile
+from . import aggregation
 
 
 class DataSource(PolymorphicModel):
@@ -23,6 +28,10 @@ class DataSource(PolymorphicModel):
     
     config_token = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
     oauth_state = models.CharField(max_length=100, blank=True, null=True)
+
+    # Poll scheduling; next_poll_at is None once the source needs no more polling
+    next_poll_at = models.DateTimeField(default=timezone.now, null=True, blank=True, db_index=True)
+    poll_attempts = models.PositiveIntegerField(default=0)
     
     requires_confirmation = False
     requires_setup = False
@@ -88,9 +97,75 @@ class DataSource(PolymorphicModel):
         """Override this in subclasses for actual processing logic."""
         pass
 
+    def poll_state(self):
+        """Fields whose change means a poll made progress."""
+        return (self.status,)
+
+    def is_poll_finished(self):
+        """True once polling can no longer change anything for this source."""
+        return self.status == 'active'
+
+    def poll_min_interval(self):
+        """Shortest time in seconds between two polls of this source."""
+        return settings.DATA_SOURCE_POLL_MIN_INTERVAL
+
+    def schedule_next_poll(self, progressed, save=True):
+        """Set next_poll_at after a poll.
+
+        Progress resets to poll_min_interval(); otherwise the interval
+        doubles (DATA_SOURCE_POLL_BACKOFF) up to DATA_SOURCE_POLL_MAX_INTERVAL.
+        Finished sources are not polled again. With save=False the caller
+        writes next_poll_at and poll_attempts, e.g. with bulk_update.
+        """
+        if self.is_poll_finished():
+            self.next_poll_at = None
+            self.poll_attempts = 0
+        else:
+            self.poll_attempts = 0 if progressed else self.poll_attempts + 1
+            interval = min(
+                self.poll_min_interval() * settings.DATA_SOURCE_POLL_BACKOFF ** self.poll_attempts,
+                settings.DATA_SOURCE_POLL_MAX_INTERVAL,
+            )
+            # Jitter keeps sources created together from polling in lockstep
+            interval *= random.uniform(1, 1 + settings.DATA_SOURCE_POLL_JITTER)
+            self.next_poll_at = timezone.now() + timedelta(seconds=interval)
+        if not save:
+            return
+        DataSource.objects.filter(pk=self.pk).update(
+            next_poll_at=self.next_poll_at,
+            poll_attempts=self.poll_attempts,
+        )
+
+    @classmethod
+    def poll_many(cls, sources):
+        """Poll several sources of this type and schedule their next polls.
+
+        Subclasses whose backend can report on many sources in one request
+        should override it.
+        """
+        for source in sources:
+            before = source.poll_state()
+            source.process()
+            source.schedule_next_poll(progressed=source.poll_state() != before)
+
+    def poll_now(self):
+        """Poll this source at the next dispatch, e.g. after the user authorized it."""
+        self.next_poll_at = timezone.now()
+        self.poll_attempts = 0
+        DataSource.objects.filter(pk=self.pk).update(next_poll_at=self.next_poll_at, poll_attempts=0)
+
     def get_data_types(self):
         """Returns a list of available data type names for this source."""
         raise NotImplementedError("Subclasses must implement this method.")
+
+    @classmethod
+    def prefetch_data_types(cls, sources):
+        """Warm up get_data_types() for many sources of this type at once.
+
+        Called before get_data_types() is used on a whole study. Subclasses
+        whose backend can answer for many sources in one go should override it.
+        """
+        pass
     
     def fetch_data(self, data_type='battery', limit=None, start_date=None, end_date=None, offset=0):
         """Fetches and returns data from the source.
@@ -103,6 +178,93 @@ class DataSource(PolymorphicModel):
         """
         raise NotImplementedError("Subclasses must implement this method.")
 
+    def fetch_page(self, data_type='battery', limit=None, start_date=None, end_date=None, cursor=None):
+        """Fetches one page of rows and returns (rows, next_cursor).
+
+        `cursor` is the value returned for the previous page, or None for the
+        first one. `next_cursor` is None when there are no more rows. Cursors
+        are JSON-serializable so they can be handed out to API clients.
+
+        The default implementation pages by offset; subclasses that can seek
+        directly to the next page should override it.
+        """
+        limit = limit or settings.DATA_PAGE_SIZE
+        offset = cursor.get('offset', 0) if cursor else 0
+        rows = self.fetch_data(
+            data_type=data_type,
+            limit=limit,
+            start_date=start_date,
+            end_date=end_date,
+            offset=offset,
+        )
+        if not isinstance(rows, list):
+            return [], None
+        next_cursor = {'offset': offset + len(rows)} if len(rows) >= limit else None
+        return rows, next_cursor
+
+    def iter_data(self, data_type='battery', start_date=None, end_date=None, page_size=None):
+        """Yields rows one page at a time, so only a single page is held in memory."""
+        cursor = None
+        while True:
+            rows, cursor = self.fetch_page(
+                data_type=data_type,
+                limit=page_size or settings.DATA_PAGE_SIZE,
+                start_date=start_date,
+                end_date=end_date,
+                cursor=cursor,
+            )
+            yield from rows
+            if cursor is None or not rows:
+                return
+
+    def aggregate(self, data_type, bucket_ms, aggregates, start_date=None, end_date=None):
+        """Rows per time bucket with `aggregates` of every numeric column.
+
+        See data_sources.models.aggregation for the result shape. The default
+        reduces iter_data() page by page with pandas; backends that can group
+        server-side should override it.
+        """
+        return aggregation.aggregate_rows(
+            self.iter_data(data_type=data_type, start_date=start_date, end_date=end_date),
+            bucket_ms, aggregates, page_size=settings.DATA_PAGE_SIZE,
+        )
+
+    @classmethod
+    def sync_watermarks(cls, sources, data_type):
+        """High-water marks of `data_type` for incremental syncs, one per source.
+
+        A mark is a JSON value that iter_changes() understands. None means
+        the backend cannot tell what changed, so every sync returns all rows.
+        """
+        return [None] * len(sources)
+
+    def iter_changes(self, data_type, since, until, start_date=None, end_date=None, page_size=None):
+        """Yields the rows that arrived after the `since` mark, up to the `until` mark.
+
+        `since` is None on a first sync. The default cannot track changes and
+        yields every row, like iter_data().
+        """
+        return self.iter_data(data_type=data_type, start_date=start_date, end_date=end_date, page_size=page_size)
+
+    def daily_coverage(self, data_type, first_day, last_day):
+        """Rows per UTC day from first_day to last_day (inclusive).
+
+        Returns {day: (row_count, last_timestamp)}, leaving out days without
+        rows; last_timestamp is None when the backend can't tell. The default
+        counts each day separately; subclasses that can group by day in one
+        query should override it.
+        """
+        coverage = {}
+        day = first_day
+        while day <= last_day:
+            start = datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+            end = start + timedelta(days=1) - timedelta(milliseconds=1)
+            row_count = self.count_rows(data_type=data_type, start_date=start, end_date=end)
+            if row_count:
+                coverage[day] = (row_count, None)
+            day += timedelta(days=1)
+        return coverage
+
     def count_rows(self, data_type='battery', start_date=None, end_date=None):
         """Return the number of rows available for the given data_type and filters.
 
@@ -1,117 +1,360 @@
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
 import mysql.connector
 from django.conf import settings
-import time
 
-# Simple in-memory cache for get_aware_tables: { device_label: (timestamp, tables_list) }
-_aware_tables_cache = {}
+from . import aggregation, aware_cache, aware_sqlite
 
+# Number of device_uids probed per UNION ALL query in discover_devices
+DISCOVERY_BATCH_SIZE = 500
 
-def get_device_ids_for_label(device_label):
-    """Gets a list of device_ids associated with the given device_label."""
-    if not device_label:
-        print("Invalid AWARE device label provided.", device_label)
-        return []
 
-    device_ids = []
-    try:
-        database = mysql.connector.connect(
-            host=settings.AWARE_DB_HOST,
-            port=settings.AWARE_DB_PORT,
-            user=settings.AWARE_DB_RO_USER,
-            password=settings.AWARE_DB_RO_PASSWORD,
-            database=settings.AWARE_DB_NAME
-        )
-        cursor = database.cursor()
+class PoolTimeout(Exception):
+    """Raised when no AWARE connection could be checked out in time.
 
-        query = "SELECT device_id FROM aware_device WHERE label = %s"
-        cursor.execute(query, (device_label,))
-        rows = cursor.fetchall()
-        device_ids = [row[0] for row in rows]
+    Deliberately not a mysql.connector.Error: the device lookups used for
+    listing turn those into empty results, while an exhausted pool must fail
+    the request (or export) instead of silently dropping a consent's rows.
+    """
 
-        cursor.close()
-        database.close()
-        return device_ids
 
-    except mysql.connector.Error as e:
-        print(f"Error in get_device_ids_for_label: {e}")
-        return []
+class AwareConnectionPool:
+    """A small thread-safe pool of read-only connections to the AWARE database.
 
+    At most `size` connections exist at any time. Idle connections are pinged
+    before being handed out and replaced if the ping fails or they are older
+    than `recycle` seconds.
+    """
+
+    def __init__(self, size, timeout, recycle):
+        self.size = size
+        self.timeout = timeout
+        self.recycle = recycle
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = queue.LifoQueue()
+
+    def _connect(self):
+        if settings.AWARE_DB_ENGINE == 'sqlite':
+            # Local stand-in for development and load testing (see build_aware_standin)
+            connection = aware_sqlite.connect(settings.AWARE_DB_SQLITE_PATH)
+        else:
+            connection = mysql.connector.connect(
+                host=settings.AWARE_DB_HOST,
+                port=settings.AWARE_DB_PORT,
+                user=settings.AWARE_DB_RO_USER,
+                password=settings.AWARE_DB_RO_PASSWORD,
+                database=settings.AWARE_DB_NAME,
+                # Without autocommit a pooled connection would keep the REPEATABLE READ
+                # snapshot of its first query until it is recycled, and hold back purge
+                autocommit=True,
+            )
+        return connection, time.monotonic()
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _is_usable(self, connection, created):
+        if self.recycle and time.monotonic() - created > self.recycle:
+            return False
+        try:
+            connection.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def acquire(self):
+        """Check out a connection, waiting at most `timeout` seconds for a free slot."""
+        if not self._slots.acquire(timeout=self.timeout):
+            raise PoolTimeout(f"No AWARE connection available within {self.timeout}s")
+        try:
+            while True:
+                try:
+                    connection, created = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._connect()
+                if self._is_usable(connection, created):
+                    return connection, created
+                self._close(connection)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, entry, discard=False):
+        """Return a checked out connection. Broken connections should be discarded."""
+        connection, _ = entry
+        try:
+            if discard:
+                self._close(connection)
+            else:
+                self._idle.put(entry)
+        finally:
+            self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                connection, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._close(connection)
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_local = threading.local()
+
+
+def get_pool():
+    """Return the process-wide AWARE connection pool.
+
+    A new pool is created after a fork so that Celery and gunicorn workers
+    never share sockets with their parent process.
+    """
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is None or _pool_pid != pid:
+        with _pool_lock:
+            if _pool is None or _pool_pid != pid:
+                _pool = AwareConnectionPool(
+                    size=settings.AWARE_DB_POOL_SIZE,
+                    timeout=settings.AWARE_DB_POOL_TIMEOUT,
+                    recycle=settings.AWARE_DB_POOL_RECYCLE,
+                )
+                _pool_pid = pid
+    return _pool
+
+
+def close_pool():
+    """Close all idle connections and drop the pool."""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.close()
+        _pool = None
+        _pool_pid = None
+
+
+@contextmanager
+def connection():
+    """Check out an AWARE database connection.
+
+    Inside a `reuse_connection()` block the first checkout is kept and shared
+    by every later query on the same thread.
+    """
+    held = getattr(_local, 'held', None)
+    if held is not None:
+        try:
+            yield held[0]
+        except mysql.connector.Error:
+            _local.held = None
+            get_pool().release(held, discard=True)
+            raise
+        return
+
+    pool = get_pool()
+    entry = pool.acquire()
+    if getattr(_local, 'scoped', False):
+        _local.held = entry
+        try:
+            yield entry[0]
+        except mysql.connector.Error:
+            _local.held = None
+            pool.release(entry, discard=True)
+            raise
+        return
+
+    discard = False
+    try:
+        yield entry[0]
+    except mysql.connector.Error:
+        discard = True
+        raise
+    finally:
+        pool.release(entry, discard=discard)
 
-def get_aware_tables(device_label):
-    """ Gets a list of available tables that have data for the given device_label. """
-    if not device_label:
-        print("Invalid AWARE device label provided.", device_label)
-        return []
-    device_ids = get_device_ids_for_label(device_label)
-    if not device_ids:
-        return []
 
-    # Return cached result when available and fresh (60s)
-    cached = _aware_tables_cache.get(device_label)
-    if cached:
-        ts, tables = cached
-        if time.time() - ts < 60:
-            return tables
+@contextmanager
+def reuse_connection():
+    """Share a single pooled connection between all AWARE queries in this block.
 
-    tables_with_data = []
+    The connection is only checked out when the first query runs, so wrapping
+    a request that never touches AWARE costs nothing.
+    """
+    if getattr(_local, 'scoped', False):
+        yield
+        return
+    _local.scoped = True
     try:
-        database = mysql.connector.connect(
-            host=settings.AWARE_DB_HOST,
-            port=settings.AWARE_DB_PORT,
-            user=settings.AWARE_DB_RO_USER,
-            password=settings.AWARE_DB_RO_PASSWORD,
-            database=settings.AWARE_DB_NAME
+        yield
+    finally:
+        _local.scoped = False
+        held = getattr(_local, 'held', None)
+        _local.held = None
+        if held is not None:
+            get_pool().release(held)
+
+
+def _placeholders(values):
+    return ",".join(["%s"] * len(values))
+
+
+def _load_device_ids(device_labels):
+    """{label: [device_id, ...]} straight from aware_device. Raises on database errors."""
+    with connection() as database:
+        cursor = database.cursor()
+        cursor.execute(
+            f"SELECT label, device_id FROM aware_device WHERE label IN ({_placeholders(device_labels)})",
+            tuple(device_labels)
         )
+        rows = cursor.fetchall()
+        cursor.close()
+    device_ids = {}
+    for label, device_id in rows:
+        device_ids.setdefault(label, []).append(device_id)
+    return device_ids
+
+
+def _load_device_uids(device_ids):
+    """{device_id: device_uid} from device_lookup. Raises on database errors."""
+    with connection() as database:
         cursor = database.cursor()
+        cursor.execute(
+            f"SELECT id, device_uuid FROM device_lookup WHERE device_uuid IN ({_placeholders(device_ids)})",
+            tuple(device_ids)
+        )
+        rows = cursor.fetchall()
+        cursor.close()
+    return {device_id: device_uid for device_uid, device_id in rows}
+
 
+def _load_device_tables(device_uids):
+    """{device_uid: [data_type, ...]} for the transformed tables holding data of each device.
+
+    Probes every table for a whole batch of devices with one UNION ALL query.
+    Raises on database errors.
+    """
+    tables_by_uid = {}
+    with connection() as database:
+        cursor = database.cursor()
         cursor.execute("SHOW TABLES")
-        all_tables = [table[0] for table in cursor.fetchall()]
         # Only consider transformed tables; researchers must see processed data only
-        for table_name in all_tables:
-            if not table_name.endswith("_transformed"):
-                continue
-            try:
-                table_name_without_suffix = table_name.replace("_transformed", "")
-                # Find the device_lookup ids that correspond to the device_ids
-                device_id_format = ",".join(["%s"] * len(device_ids))
-                query_string = f"SELECT id FROM device_lookup WHERE device_uuid IN ({device_id_format})"
-                cursor.execute(query_string, tuple(device_ids))
+        tables = [row[0] for row in cursor.fetchall() if row[0].endswith("_transformed")]
+        if not tables:
+            cursor.close()
+            return {}
+        for start in range(0, len(device_uids), DISCOVERY_BATCH_SIZE):
+            batch = device_uids[start:start + DISCOVERY_BATCH_SIZE]
+            selects = []
+            params = []
+            for table_name in tables:
+                selects.append(
+                    f"SELECT %s AS table_name, device_uid FROM `{table_name}` "
+                    f"WHERE device_uid IN ({_placeholders(batch)}) GROUP BY device_uid"
+                )
+                params.append(table_name)
+                params.extend(batch)
+            cursor.execute(" UNION ALL ".join(selects), tuple(params))
+            for table_name, device_uid in cursor.fetchall():
+                tables_by_uid.setdefault(device_uid, []).append(table_name[:-len("_transformed")])
+        cursor.close()
+    return {device_uid: sorted(found) for device_uid, found in tables_by_uid.items()}
+
 
-                rows = cursor.fetchall()
-                device_uids = [row[0] for row in rows if isinstance(row, tuple) and len(row) > 0]
-                if not device_uids:
-                    continue
+def get_device_ids_for_label(device_label, use_cache=True):
+    """Gets a list of device_ids associated with the given device_label."""
+    if not device_label:
+        print("Invalid AWARE device label provided.", device_label)
+        return []
 
-                device_uid_format = ",".join(["%s"] * len(device_uids))
-                query = f"SELECT 1 FROM `{table_name}` WHERE device_uid IN ({device_uid_format}) LIMIT 1"
-                cursor.execute(query, tuple(device_uids))
+    try:
+        if not use_cache:
+            return _load_device_ids([device_label]).get(device_label, [])
+        device_ids = aware_cache.get_many_or_load('device_ids', [device_label], _load_device_ids)
+        return device_ids.get(device_label) or []
+
+    except mysql.connector.Error as e:
+        print(f"Error in get_device_ids_for_label: {e}")
+        return []
 
-                if cursor.fetchone():
-                    tables_with_data.append(table_name_without_suffix)
 
-            except mysql.connector.Error:
+def discover_devices(device_labels):
+    """Resolve device labels to their devices and the tables that hold their data.
+
+    Returns {label: {'devices': {device_uid: device_id}, 'tables': [data_type, ...]}}
+    for every label. Each step (label -> device ids, device id -> device_uid,
+    device_uid -> tables) is cached and, on a miss, answered for all labels at
+    once, so the number of queries does not grow with the number of labels.
+    Raises on database errors.
+    """
+    labels = sorted({label for label in device_labels if label})
+    result = {label: {'devices': {}, 'tables': []} for label in labels}
+    if not labels:
+        return result
+    device_ids = aware_cache.get_many_or_load('device_ids', labels, _load_device_ids)
+    all_device_ids = sorted({device_id for ids in device_ids.values() if ids for device_id in ids})
+    if not all_device_ids:
+        return result
+    device_uids = aware_cache.get_many_or_load('device_uid', all_device_ids, _load_device_uids)
+    all_device_uids = sorted({uid for uid in device_uids.values() if uid is not None})
+    if not all_device_uids:
+        return result
+    tables = aware_cache.get_many_or_load('tables', all_device_uids, _load_device_tables)
+
+    for label in labels:
+        label_tables = set()
+        for device_id in device_ids.get(label) or []:
+            device_uid = device_uids.get(device_id)
+            if device_uid is None:
                 continue
+            result[label]['devices'][device_uid] = device_id
+            label_tables.update(tables.get(device_uid) or [])
+        result[label]['tables'] = sorted(label_tables)
+    return result
+
+
+def invalidate_device(device_label):
+    """Drop every cached lookup for a device label, e.g. after a device is (re)linked."""
+    device_ids = aware_cache.get_cached('device_ids', device_label) or []
+    device_uids = [
+        uid for uid in (aware_cache.get_cached('device_uid', device_id) for device_id in device_ids)
+        if uid is not None
+    ]
+    aware_cache.delete('tables', device_uids)
+    aware_cache.delete('device_uid', device_ids)
+    aware_cache.delete('device_ids', [device_label])
 
-        cursor.close()
-        database.close()
-        # Cache the result for a short period to avoid repeated introspection
-        try:
-            _aware_tables_cache[device_label] = (time.time(), tables_with_data)
-        except Exception:
-            pass
-        return tables_with_data
 
+def get_aware_tables(device_label):
+    """ Gets a list of available tables that have data for the given device_label. """
+    if not device_label:
+        print("Invalid AWARE device label provided.", device_label)
+        return []
+    try:
+        device = discover_devices([device_label]).get(device_label)
     except mysql.connector.Error as e:
         print(f"Error in get_aware_tables: {e}")
         return []
+    return list(device['tables']) if device else []
 
 
-def _run_aware_table_query(cursor, base_select, table_name, id_column, id_values, start_date=None, end_date=None, limit=None, offset=0):
+def _run_aware_table_query(cursor, base_select, table_name, id_column, id_values, start_date=None, end_date=None, limit=None, offset=0, after=None):
     """Build and run a parametrized query against an AWARE table.
 
     - `base_select` should be the SELECT prefix (e.g. "SELECT *" or "SELECT COUNT(*) as row_count").
     - `id_column` is the column to filter on (device_id or device_uid).
     - `id_values` is a non-empty list of parameter values to use in the IN(...) clause.
+    - `after` is an optional (timestamp, _id) pair. Only rows that sort after it
+      in (timestamp DESC, _id DESC) order are returned, which pages through the
+      table at constant cost instead of skipping `offset` rows.
     Returns the fetched rows (list).
     """
     if not id_values:
@@ -131,9 +374,13 @@ def _run_aware_table_query(cursor, base_select, table_name, id_column, id_values
     if end_date:
         query_str += " AND timestamp <= %s"
         params.append(int(end_date.timestamp() * 1000))
+    if after is not None and not is_count:
+        after_timestamp, after_id = after
+        query_str += " AND (timestamp < %s OR (timestamp = %s AND _id < %s))"
+        params.extend([after_timestamp, after_timestamp, after_id])
 
     if not is_count:
-        query_str += " ORDER BY timestamp DESC"
+        query_str += " ORDER BY timestamp DESC, _id DESC"
         if limit is not None:
             try:
                 limit_val = int(limit)
@@ -151,73 +398,48 @@ def _run_aware_table_query(cursor, base_select, table_name, id_column, id_values
     return cursor.fetchall()
 
 
-def query_aware_data(base_query, device_label, table_name, limit=None, start_date=None, end_date=None, offset=0):
+def query_aware_data(base_query, device_label, table_name, limit=None, start_date=None, end_date=None, offset=0, after=None):
     """
     Runs a data query against the AWARE database. The query parameter should be either "SELECT COUNT(*)" or "SELECT *".
+    Raises on database errors, so that a failed read is never taken for the end of the data.
     """
     if not device_label:
         print("Invalid AWARE device label provided.", device_label)
         return []
 
-    device_ids = get_device_ids_for_label(device_label)
-    if not device_ids:
+    # Devices and their tables come from the (cached) discovery pass, so a data
+    # query is a single round-trip.
+    device = discover_devices([device_label]).get(device_label)
+    if not device or table_name not in device['tables']:
         return []
-    results = []
-
-    try:
-        database = mysql.connector.connect(
-            host=settings.AWARE_DB_HOST,
-            port=settings.AWARE_DB_PORT,
-            user=settings.AWARE_DB_RO_USER,
-            password=settings.AWARE_DB_RO_PASSWORD,
-            database=settings.AWARE_DB_NAME
-        )
-        cursor = database.cursor()
-
-        cursor.execute("SHOW TABLES")
-        all_tables = [table[0] for table in cursor.fetchall()]
-        transformed_table_name = f"{table_name}_transformed"
-        if transformed_table_name not in all_tables:
-            print(f"Transformed table {transformed_table_name} does not exist in AWARE database.")
-            return []
-        cursor.close()
+    device_uid_to_device_id = device['devices']
+    device_uids = list(device_uid_to_device_id)
+    transformed_table_name = f"{table_name}_transformed"
 
+    with connection() as database:
         cursor = database.cursor(dictionary=True)
-        # Map device_lookup.id (device_uid) -> device_uuid (the original device id)
-        device_id_format = ",".join(["%s"] * len(device_ids))
-        query_string = f"SELECT id, device_uuid FROM device_lookup WHERE device_uuid IN ({device_id_format})"
-        cursor.execute(query_string, tuple(device_ids))
-        rows = cursor.fetchall()
-        device_uids = [row['id'] for row in rows if isinstance(row, dict) and len(row) > 0]
-        device_uid_to_device_id = {row['id']: row['device_uuid'] for row in rows if isinstance(row, dict)}
-
-        if device_uids:
-            # Query only the transformed table (processed data only)
-            results_transformed = _run_aware_table_query(cursor, base_query, transformed_table_name, 'device_uid', device_uids, start_date, end_date, limit, offset)
-            for row in results_transformed:
-                if isinstance(row, dict):
-                    row['device_id'] = device_uid_to_device_id.get(row.get('device_uid'), None)
-                    row.pop('device_uid', None)
-            results.extend(results_transformed)
-
+        # Query only the transformed table (processed data only)
+        results = _run_aware_table_query(cursor, base_query, transformed_table_name, 'device_uid', device_uids, start_date, end_date, limit, offset, after)
+        for row in results:
+            if isinstance(row, dict):
+                row['device_id'] = device_uid_to_device_id.get(row.get('device_uid'), None)
+                row.pop('device_uid', None)
         cursor.close()
-        database.close()
 
-        return results
-    
-    except mysql.connector.Error as e:
-        print(f"Error querying Aware data: {e}")
-        return results
+    return list(results)
 
 
 
-def get_aware_data(device_label, table_name='battery', limit=1000, start_date=None, end_date=None, offset=0):
+def get_aware_data(device_label, table_name='battery', limit=1000, start_date=None, end_date=None, offset=0, after=None):
     """
     Connects to the AWARE DB and fetches the latest records for a specific
     AWARE device ID. Returns a list of dictionaries.
+
+    Pass the (timestamp, _id) of the last row of the previous page as `after`
+    to fetch the next page.
     """
     return query_aware_data(
-        "SELECT *", device_label, table_name, limit, start_date, end_date, offset
+        "SELECT *", device_label, table_name, limit, start_date, end_date, offset, after
     )
 
 
@@ -234,3 +456,227 @@ def get_aware_count(device_label, table_name='battery', start_date=None, end_dat
         return 0
     return rows[0].get('row_count', 0)
 
+
+
+def get_aware_max_id(table_name):
+    """Highest _id of an AWARE transformed table, or None if it is empty.
+
+    AWARE assigns _id in insertion order, so this marks everything ingested
+    so far. Raises on database errors.
+    """
+    with connection() as database:
+        cursor = database.cursor()
+        cursor.execute(f"SELECT MAX(_id) FROM `{table_name}_transformed`")
+        row = cursor.fetchone()
+        cursor.close()
+    return int(row[0]) if row and row[0] is not None else None
+
+
+def get_aware_missing_ids(table_name, after_id, until_id):
+    """_ids with after_id < _id <= until_id that no row of the table has.
+
+    Below MAX(_id) such a gap is a rolled-back insert or a transaction that
+    has not committed yet. Raises on database errors.
+    """
+    with connection() as database:
+        cursor = database.cursor()
+        cursor.execute(
+            f"SELECT _id FROM `{table_name}_transformed` WHERE _id > %s AND _id <= %s",
+            (after_id, until_id)
+        )
+        present = {int(row[0]) for row in cursor.fetchall()}
+        cursor.close()
+    return [_id for _id in range(after_id + 1, until_id + 1) if _id not in present]
+
+
+def get_aware_id_mark(table_name):
+    """(highest _id, _ids missing from the AWARE_SYNC_GAP_WINDOW below it) of a table.
+
+    _id grows in insertion order, but a transaction that has not committed
+    yet leaves a gap below MAX(_id) that it fills later. Incremental readers
+    read up to the highest _id without the missing ones, keep those, and
+    read the ones that have appeared on their next run. A row that commits
+    after more than AWARE_SYNC_GAP_WINDOW newer ones is still missed.
+    (None, []) for an empty table. Raises on database errors.
+    """
+    max_id = get_aware_max_id(table_name)
+    if max_id is None:
+        return None, []
+    return max_id, get_aware_missing_ids(table_name, max(max_id - settings.AWARE_SYNC_GAP_WINDOW, 0), max_id)
+
+
+def _id_filter(after_id, until_id=None, ids=None, exclude_ids=()):
+    """SQL condition and params for after_id < _id <= until_id, limited to `ids`, without `exclude_ids`."""
+    condition = "_id > %s"
+    params = [after_id]
+    if until_id is not None:
+        condition += " AND _id <= %s"
+        params.append(until_id)
+    if ids is not None:
+        condition += f" AND _id IN ({_placeholders(ids)})"
+        params.extend(ids)
+    if exclude_ids:
+        condition += f" AND _id NOT IN ({_placeholders(exclude_ids)})"
+        params.extend(exclude_ids)
+    return condition, params
+
+
+def get_aware_rows_between(device_label, table_name, after_id, until_id, limit, start_date=None, end_date=None,
+                           ids=None, exclude_ids=()):
+    """Rows of a device label with after_id < _id <= until_id, in _id order.
+
+    Used for incremental syncs: the rows between two get_aware_max_id()
+    readings are the ones ingested in between. `ids` restricts the read to
+    those _ids and `exclude_ids` leaves some out. Like get_aware_data this
+    raises on database errors, so that a failed read never advances a sync.
+    """
+    device = discover_devices([device_label]).get(device_label)
+    if not device or table_name not in device['tables'] or ids == []:
+        return []
+    device_uids = list(device['devices'])
+    id_condition, id_params = _id_filter(after_id, until_id, ids, exclude_ids)
+    query_str = (
+        f"SELECT * FROM `{table_name}_transformed` WHERE device_uid IN ({_placeholders(device_uids)}) "
+        f"AND {id_condition}"
+    )
+    params = [*device_uids, *id_params]
+    if start_date:
+        query_str += " AND timestamp >= %s"
+        params.append(int(start_date.timestamp() * 1000))
+    if end_date:
+        query_str += " AND timestamp <= %s"
+        params.append(int(end_date.timestamp() * 1000))
+    query_str += " ORDER BY _id ASC LIMIT %s"
+    params.append(int(limit))
+
+    with connection() as database:
+        cursor = database.cursor(dictionary=True)
+        cursor.execute(query_str, tuple(params))
+        rows = cursor.fetchall()
+        cursor.close()
+    for row in rows:
+        row['device_id'] = device['devices'].get(row.pop('device_uid', None))
+    return rows
+
+
+AGGREGATE_SQL = {'mean': 'AVG', 'min': 'MIN', 'max': 'MAX', 'sum': 'SUM'}
+# Rows sampled to tell numeric columns apart, since the schema differs per table
+AGGREGATE_SAMPLE_ROWS = 100
+
+
+def aggregate_aware_data(device_label, table_name, bucket_ms, aggregates, start_date=None, end_date=None):
+    """Per-bucket aggregates of a device label's rows, grouped in the database.
+
+    Returns rows in the shape of aggregation.aggregate_rows(). Numeric
+    columns are picked from a sample of the device's rows, which works the
+    same on MySQL and on the SQLite stand-in. Raises on database errors.
+    """
+    device = discover_devices([device_label]).get(device_label)
+    if not device or table_name not in device['tables']:
+        return []
+    device_uids = list(device['devices'])
+    where = f"WHERE device_uid IN ({_placeholders(device_uids)})"
+    params = list(device_uids)
+    if start_date:
+        where += " AND timestamp >= %s"
+        params.append(int(start_date.timestamp() * 1000))
+    if end_date:
+        where += " AND timestamp <= %s"
+        params.append(int(end_date.timestamp() * 1000))
+
+    with connection() as database:
+        cursor = database.cursor(dictionary=True)
+        cursor.execute(
+            f"SELECT * FROM `{table_name}_transformed` {where} LIMIT {AGGREGATE_SAMPLE_ROWS}", tuple(params)
+        )
+        columns = aggregation.numeric_columns(cursor.fetchall())
+        value_aggregates = [name for name in aggregates if name != 'count']
+        selects = ["FLOOR(timestamp / %s) AS bucket", "COUNT(*) AS `count`"]
+        selects += [
+            f"{AGGREGATE_SQL[aggregate]}(`{column}`) AS `{column}_{aggregate}`"
+            for column in columns for aggregate in value_aggregates
+        ]
+        cursor.execute(
+            f"SELECT {', '.join(selects)} FROM `{table_name}_transformed` {where} "
+            "GROUP BY bucket ORDER BY bucket",
+            (bucket_ms, *params)
+        )
+        rows = cursor.fetchall()
+        cursor.close()
+
+    result = []
+    for row in rows:
+        bucket = row.pop('bucket')
+        row_count = row.pop('count')
+        aggregated = {'timestamp': int(bucket) * bucket_ms}
+        if 'count' in aggregates:
+            aggregated['count'] = int(row_count)
+        aggregated.update((name, aggregation.plain(value)) for name, value in row.items())
+        result.append(aggregated)
+    return result
+
+
+def fetch_new_rows(table_name, device_uid, after_id=-1, limit=5000, until_id=None, ids=None, exclude_ids=()):
+    """Rows of one device with after_id < _id <= until_id, in _id order.
+
+    Used to copy a device's data incrementally; `after_id` is the highest _id
+    already copied. The watermark follows _id rather than timestamp because
+    phones upload late: a row stored today can carry last week's timestamp.
+    `ids` and `exclude_ids` narrow the read as in get_aware_rows_between.
+    Raises on database errors so that a failed pull never looks like "no new
+    rows".
+    """
+    if ids == []:
+        return []
+    id_condition, id_params = _id_filter(after_id, until_id, ids, exclude_ids)
+    with connection() as database:
+        cursor = database.cursor(dictionary=True)
+        cursor.execute(
+            f"SELECT * FROM `{table_name}_transformed` WHERE device_uid = %s AND {id_condition} "
+            "ORDER BY _id ASC LIMIT %s",
+            (device_uid, *id_params, int(limit))
+        )
+        rows = cursor.fetchall()
+        cursor.close()
+    return rows
+
+
+def count_new_rows_by_day(table_name, device_uid, after_id=-1, until_id=None, ids=None, exclude_ids=()):
+    """Count one device's rows with after_id < _id <= until_id per UTC day.
+
+    `ids` and `exclude_ids` narrow the count as in get_aware_rows_between.
+    Returns {days since epoch: count}. Raises on database errors.
+    """
+    if ids == []:
+        return {}
+    id_condition, id_params = _id_filter(after_id, until_id, ids, exclude_ids)
+    with connection() as database:
+        cursor = database.cursor()
+        cursor.execute(
+            f"SELECT FLOOR(timestamp / 86400000) AS day, COUNT(*) "
+            f"FROM `{table_name}_transformed` WHERE device_uid = %s AND {id_condition} GROUP BY day",
+            (device_uid, *id_params)
+        )
+        rows = cursor.fetchall()
+        cursor.close()
+    return {int(day): int(row_count) for day, row_count in rows}
+
+
+def count_rows_by_day(table_name, device_uids, start_ms, end_ms):
+    """Rows and newest timestamp per UTC day for a set of devices, start_ms <= timestamp < end_ms.
+
+    Returns {days since epoch: (count, max timestamp)}. Raises on database errors.
+    """
+    if not device_uids:
+        return {}
+    with connection() as database:
+        cursor = database.cursor()
+        cursor.execute(
+            f"SELECT FLOOR(timestamp / 86400000) AS day, COUNT(*), MAX(timestamp) "
+            f"FROM `{table_name}_transformed` WHERE device_uid IN ({_placeholders(device_uids)}) "
+            f"AND timestamp >= %s AND timestamp < %s GROUP BY day",
+            (*device_uids, start_ms, end_ms)
+        )
+        rows = cursor.fetchall()
+        cursor.close()
+    return {int(day): (int(row_count), max_timestamp) for day, row_count, max_timestamp in rows}
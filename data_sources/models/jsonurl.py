@@ -14,6 +14,20 @@ class JsonUrlDataSource(DataSource):
     def get_data_types(self):
         return ["raw_json"]
 
+    def _load_rows(self):
+        """Download the JSON document once per instance; count and page reuse it."""
+        cached = getattr(self, '_rows_cache', None)
+        if cached is not None:
+            return cached
+        response = requests.get(self.url, timeout=10)
+        response.raise_for_status()
+        result = response.json()
+        if not isinstance(result, list):
+            # Response must be a list. Assuming this is a single object, wrap in a list.
+            result = [result]
+        self._rows_cache = result
+        return result
+
     def fetch_data(self, data_type, limit=10000, start_date=None, end_date=None, offset=0):
         """Fetches and returns the JSON data from the source URL.
         
@@ -24,24 +38,20 @@ class JsonUrlDataSource(DataSource):
         if data_type != 'raw_json':
             return {"error": "Invalid data type requested."}
         try:
-            response = requests.get(self.url, timeout=10)
-            response.raise_for_status()
-            result = response.json()
-            if not isinstance(result, list):
-                # Response must be a list. Assuming this is a single object, wrap in a list.
-                result = [result]
-            
+            result = self._load_rows()
+
+            # Apply offset and limit slicing
+            start = int(offset) if offset else 0
+            end = start + int(limit) if limit is not None else None
+
             enriched_data = []
-            for row in result:
+            for row in result[start:end]:
+                row = dict(row)
                 if 'device_id' in row:
                     row['json_device_id'] = row['device_id']
                 row['device_id'] = str(self.device_id)
                 enriched_data.append(row)
-
-            # Apply offset and limit slicing
-            start = int(offset) if offset else 0
-            end = start + int(limit) if limit is not None else None
-            return enriched_data[start:end]
+            return enriched_data
         except requests.exceptions.RequestException as e:
             return {"error": f"Could not fetch data from URL: {e}"}
 
@@ -51,12 +61,6 @@ class JsonUrlDataSource(DataSource):
             return 0
 
         try:
-            response = requests.get(self.url, timeout=10)
-            response.raise_for_status()
-            result = response.json()
-            if not isinstance(result, list):
-                result = [result]
-            return len(result)
+            return len(self._load_rows())
         except requests.exceptions.RequestException:
             return 0
-        
\ No newline at end of file
@@ -1,12 +1,93 @@
 """Client for the portability-server REST API."""
+import hashlib
+import hmac
 import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 logger = logging.getLogger(__name__)
 
-REQUEST_TIMEOUT = 30
+# Only these are retried; a retried POST could create a second donation
+IDEMPOTENT_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS', 'DELETE'})
+RETRY_STATUSES = (502, 503, 504)
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+
+def _build_session():
+    retry = Retry(
+        total=settings.PORTABILITY_RETRIES,
+        backoff_factor=settings.PORTABILITY_RETRY_BACKOFF,
+        backoff_jitter=settings.PORTABILITY_RETRY_BACKOFF,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=IDEMPOTENT_METHODS,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=settings.PORTABILITY_POOL_SIZE,
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_session():
+    """The process-wide session; keeps connections to the server alive.
+
+    Rebuilt after a fork so that Celery/gunicorn children don't share sockets.
+    """
+    global _session, _session_pid
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            _session = _build_session()
+            _session_pid = os.getpid()
+        return _session
+
+
+def close_session():
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+        _session = None
+
+
+def pool_stats():
+    """Connections opened and requests sent per host since the session was built.
+
+    A requests/connections ratio well above 1 means connections are reused.
+    """
+    session = _session
+    if session is None:
+        return {}
+    stats = {}
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            stats[f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+                'connections': pool.num_connections,
+                'requests': pool.num_requests,
+            }
+    return stats
+
+
+def _timeout():
+    return (settings.PORTABILITY_CONNECT_TIMEOUT, settings.PORTABILITY_READ_TIMEOUT)
 
 
 def _base_url():
@@ -27,8 +108,8 @@ def create_donation(source_type, data_start_date=None, data_end_date=None,
         payload["data_end_date"] = str(data_end_date)
     if requested_data_types:
         payload["requested_data_types"] = requested_data_types
-    response = requests.post(
-        f"{_base_url()}/", json=payload, headers=_headers(), timeout=REQUEST_TIMEOUT
+    response = get_session().post(
+        f"{_base_url()}/", json=payload, headers=_headers(), timeout=_timeout()
     )
     response.raise_for_status()
     return response.json()
@@ -36,13 +117,43 @@ def create_donation(source_type, data_start_date=None, data_end_date=None,
 
 def get_donation(donation_id):
     """Get donation status by PK. Returns the response dict."""
-    response = requests.get(
-        f"{_base_url()}/{donation_id}/", headers=_headers(), timeout=REQUEST_TIMEOUT
+    response = get_session().get(
+        f"{_base_url()}/{donation_id}/", headers=_headers(), timeout=_timeout()
     )
     response.raise_for_status()
     return response.json()
 
 
+def get_donation_statuses(donation_ids):
+    """Get the status of many donations in one request. Returns {id: status}.
+
+    If the server answers the bulk request with an HTTP error (e.g. a server
+    without the status endpoint), falls back to one get_donation() per id and
+    leaves out the donations whose status could not be read. Connection
+    errors are raised: the per-id requests would fail the same way.
+    """
+    donation_ids = list(donation_ids)
+    try:
+        response = get_session().get(
+            f"{_base_url()}/status/",
+            params={"ids": ",".join(str(donation_id) for donation_id in donation_ids)},
+            headers=_headers(), timeout=_timeout(),
+        )
+        response.raise_for_status()
+        statuses = {donation['id']: donation.get('status', '') for donation in response.json()}
+    except requests.HTTPError as e:
+        logger.warning("Bulk status request failed, polling donations one by one: %s", e)
+        statuses = {}
+        for donation_id in donation_ids:
+            try:
+                statuses[donation_id] = get_donation(donation_id).get('status', '')
+            except requests.HTTPError as e:
+                logger.warning("Failed to poll donation %s: %s", donation_id, e)
+    # Once per poll batch, to see whether connections to the server are reused
+    logger.debug("Portability connection pool: %s", pool_stats())
+    return statuses
+
+
 def get_data(donation_id, data_type=None, start_date=None, end_date=None,
              limit=1000, offset=0):
     """Fetch processed data from a donation. Returns the response dict."""
@@ -53,21 +164,81 @@ def get_data(donation_id, data_type=None, start_date=None, end_date=None,
         params["start_date"] = str(start_date)
     if end_date:
         params["end_date"] = str(end_date)
-    if limit:
+    if limit is not None:
         params["limit"] = limit
     if offset:
         params["offset"] = offset
-    response = requests.get(
+    response = get_session().get(
         f"{_base_url()}/{donation_id}/data/",
-        params=params, headers=_headers(), timeout=REQUEST_TIMEOUT,
+        params=params, headers=_headers(), timeout=_timeout(),
     )
     response.raise_for_status()
     return response.json()
 
 
+def get_data_types(donation_id):
+    """List a donation's data types without downloading any rows."""
+    return get_data(donation_id, limit=0).get('data_types', [])
+
+
+def iter_data(donation_id, data_type=None, start_date=None, end_date=None,
+              page_size=1000):
+    """Yield every row of a donation's data, page by page.
+
+    The next page is requested in the background while the rows of the
+    current one are consumed, so network latency overlaps with whatever the
+    caller does with the rows.
+    """
+    def fetch(offset):
+        return get_data(
+            donation_id, data_type=data_type, start_date=start_date,
+            end_date=end_date, limit=page_size, offset=offset,
+        ).get('data', [])
+
+    executor = ThreadPoolExecutor(max_workers=1)
+    offset = 0
+    pending = executor.submit(fetch, offset)
+    try:
+        while pending is not None:
+            rows = pending.result()
+            offset += len(rows)
+            pending = executor.submit(fetch, offset) if len(rows) >= page_size else None
+            yield from rows
+    finally:
+        # Don't wait for a prefetch the caller no longer needs
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
 def delete_donation(donation_id):
     """Delete (revoke) a donation on the portability server."""
-    response = requests.delete(
-        f"{_base_url()}/{donation_id}/", headers=_headers(), timeout=REQUEST_TIMEOUT
+    response = get_session().delete(
+        f"{_base_url()}/{donation_id}/", headers=_headers(), timeout=_timeout()
     )
     response.raise_for_status()
+
+
+WEBHOOK_SIGNATURE_HEADER = 'X-Portability-Signature'
+WEBHOOK_TIMESTAMP_HEADER = 'X-Portability-Timestamp'
+
+
+def sign_webhook(body, timestamp, secret=None):
+    """Signature portability-server sends with a donation status callback.
+
+    HMAC-SHA256 over "<timestamp>.<body>" with PORTABILITY_WEBHOOK_SECRET.
+    """
+    secret = secret or settings.PORTABILITY_WEBHOOK_SECRET
+    message = str(timestamp).encode() + b'.' + body
+    return 'sha256=' + hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+
+
+def verify_webhook(body, timestamp, signature):
+    """True if the callback is signed with our secret and recent enough."""
+    if not settings.PORTABILITY_WEBHOOK_SECRET or not timestamp or not signature:
+        return False
+    try:
+        age = abs(time.time() - int(timestamp))
+    except ValueError:
+        return False
+    if age > settings.PORTABILITY_WEBHOOK_TOLERANCE:
+        return False
+    return hmac.compare_digest(sign_webhook(body, timestamp), signature)
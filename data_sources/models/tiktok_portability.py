@@ -27,6 +27,7 @@ class TikTokPortabilityDataSource(DataSource):
         default='pending',
     )
     processing_log = models.TextField(blank=True, default='')
+    data_type_status = models.JSONField(default=dict, blank=True)
 
     requires_setup = True
     requires_confirmation = False
@@ -64,6 +65,8 @@ class TikTokPortabilityDataSource(DataSource):
         self.donation_id = donation['id']
         self.donation_token = donation['token']
         self.save()
+        # The participant is about to donate; don't wait out a backed-off poll
+        self.poll_now()
 
     def get_setup_url(self):
         if not self.donation_id:
@@ -75,12 +78,21 @@ class TikTokPortabilityDataSource(DataSource):
     def get_data_types(self):
         if not self.donation_id:
             return []
+        # Cached once the donation is processed; cleared when its status changes
+        if self.data_type_status:
+            return list(self.data_type_status)
         try:
-            result = portability_client.get_data(self.donation_id)
-            return result.get('data_types', [])
+            data_types = portability_client.get_data_types(self.donation_id)
         except Exception as e:
             logger.warning("Failed to get data types from portability server: %s", e)
             return []
+        if self.processing_status == 'processed' and data_types:
+            self._cache_data_types(data_types)
+        return data_types
+
+    def _cache_data_types(self, data_types):
+        self.data_type_status = {data_type: 'available' for data_type in data_types}
+        type(self).objects.filter(pk=self.pk).update(data_type_status=self.data_type_status)
 
     def fetch_data(self, data_type, limit=1000, start_date=None, end_date=None, offset=0):
         if not self.donation_id:
@@ -99,6 +111,38 @@ class TikTokPortabilityDataSource(DataSource):
             logger.warning("Failed to fetch data from portability server: %s", e)
             return []
 
+    def iter_data(self, data_type, start_date=None, end_date=None, page_size=None):
+        if not self.donation_id:
+            return
+        # Errors propagate, so that a failed page never looks like the end of the data
+        yield from portability_client.iter_data(
+            self.donation_id,
+            data_type=data_type,
+            start_date=start_date,
+            end_date=end_date,
+            page_size=page_size or settings.DATA_PAGE_SIZE,
+        )
+
+    @classmethod
+    def sync_watermarks(cls, sources, data_type):
+        """A processed donation does not change; a new donation gets a new ID."""
+        return [
+            source.donation_id if source.donation_id and source.processing_status == 'processed' else None
+            for source in sources
+        ]
+
+    def iter_changes(self, data_type, since, until, start_date=None, end_date=None, page_size=None):
+        if not self.donation_id or (until is not None and since == until):
+            return
+        # Errors propagate, so that a failed read never advances a sync
+        yield from portability_client.iter_data(
+            self.donation_id,
+            data_type=data_type,
+            start_date=start_date,
+            end_date=end_date,
+            page_size=page_size or settings.DATA_PAGE_SIZE,
+        )
+
     def count_rows(self, data_type, start_date=None, end_date=None):
         if not self.donation_id:
             return 0
@@ -122,21 +166,82 @@ class TikTokPortabilityDataSource(DataSource):
             except Exception as e:
                 logger.warning("Failed to delete donation on portability server: %s", e)
 
+    def poll_state(self):
+        return (self.status, self.processing_status)
+
+    def is_poll_finished(self):
+        return self.processing_status in ('processed', 'error')
+
+    def poll_min_interval(self):
+        # With webhooks the poll is only a slow reconciliation fallback
+        if settings.PORTABILITY_WEBHOOK_SECRET:
+            return settings.PORTABILITY_WEBHOOK_POLL_INTERVAL
+        return super().poll_min_interval()
+
+    def _set_remote_status(self, remote_status):
+        previous_status = self.processing_status
+        if remote_status == 'processed':
+            self.processing_status = 'processed'
+            self.status = 'active'
+        elif remote_status == 'error':
+            self.processing_status = 'error'
+        elif remote_status in ('authorized', 'processing'):
+            self.processing_status = remote_status
+            self.status = 'processing'
+        if self.processing_status != previous_status:
+            self.data_type_status = {}
+
+    def _refresh_data_types(self):
+        if self.processing_status == 'processed' and not self.data_type_status:
+            self._cache_data_types(portability_client.get_data_types(self.donation_id))
+
+    def apply_remote_status(self, remote_status):
+        """Update from the donation status reported by portability-server."""
+        self._set_remote_status(remote_status)
+        self.save()
+        self._refresh_data_types()
+
+    @classmethod
+    def poll_many(cls, sources):
+        """Refresh all donations with one status request and one bulk update.
+
+        Only sources whose status the server returned get their status
+        written; the others just have their next poll rescheduled, so a
+        stale in-memory status never overwrites a newer one.
+        """
+        sources = list(sources)
+        donation_ids = [source.donation_id for source in sources if source.donation_id]
+        statuses = {}
+        if donation_ids:
+            try:
+                statuses = portability_client.get_donation_statuses(donation_ids)
+            except Exception as e:
+                logger.warning("Failed to poll portability server: %s", e)
+        reported = [source for source in sources if source.donation_id in statuses]
+        for source in sources:
+            before = source.poll_state()
+            if source.donation_id in statuses:
+                source._set_remote_status(statuses[source.donation_id])
+            source.schedule_next_poll(progressed=source.poll_state() != before, save=False)
+        cls.objects.bulk_update(reported, [
+            'status', 'processing_status', 'data_type_status', 'next_poll_at', 'poll_attempts',
+        ])
+        cls.objects.bulk_update(
+            [source for source in sources if source.donation_id not in statuses],
+            ['next_poll_at', 'poll_attempts'],
+        )
+        for source in sources:
+            try:
+                source._refresh_data_types()
+            except Exception as e:
+                logger.warning("Failed to get data types from portability server: %s", e)
+
     def _process_data(self):
         """Poll portability-server for status updates."""
         if not self.donation_id:
             return
         try:
             donation = portability_client.get_donation(self.donation_id)
-            remote_status = donation.get('status', '')
-            if remote_status == 'processed':
-                self.processing_status = 'processed'
-                self.status = 'active'
-            elif remote_status == 'error':
-                self.processing_status = 'error'
-            elif remote_status in ('authorized', 'processing'):
-                self.processing_status = remote_status
-                self.status = 'processing'
-            self.save()
+            self.apply_remote_status(donation.get('status', ''))
         except Exception as e:
             logger.warning("Failed to poll portability server: %s", e)
@@ -1,13 +1,256 @@
+import time
+from datetime import timedelta
+
 from celery import shared_task
-from .models import DataSource
+from django.apps import apps
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+from .models import AwareDataSource, DataSource
+from .models import aware_mirror, aware_rollup, db_connector
+
+DISPATCH_LOCK_KEY = 'data_sources:dispatch'
+SOURCE_LOCK_KEY = 'data_sources:process:{}'
+MIRROR_DISPATCH_LOCK_KEY = 'data_sources:mirror'
+MIRROR_LOCK_KEY = 'data_sources:mirror:{}'
+ROLLUP_DISPATCH_LOCK_KEY = 'data_sources:rollup'
+ROLLUP_LOCK_KEY = 'data_sources:rollup:{}'
+RATE_KEY = 'data_sources:rate:{}:{}'
+
+_RATE_PERIODS = {'s': 1, 'm': 60, 'h': 3600}
+
+
+def _parse_rate(rate):
+    """Parse a Celery-style rate such as '30/m' into (calls, seconds)."""
+    calls, _, period = rate.partition('/')
+    return int(calls), _RATE_PERIODS[period or 's']
+
+
+def _take_rate_slot(source_type):
+    """Count a call against the type's rate limit.
+
+    Returns 0 when the call may proceed, otherwise the number of seconds until
+    the current window ends. The counter lives in the shared cache, so the
+    limit holds across all workers.
+    """
+    rate = settings.DATA_SOURCE_RATE_LIMITS.get(source_type)
+    if not rate:
+        return 0
+    calls, seconds = _parse_rate(rate)
+    now = time.time()
+    window = int(now // seconds)
+    key = RATE_KEY.format(source_type, window)
+    cache.add(key, 0, seconds * 2)
+    try:
+        used = cache.incr(key)
+    except ValueError:
+        # Expired between add and incr; start the window again
+        cache.set(key, 1, seconds * 2)
+        used = 1
+    if used <= calls:
+        return 0
+    return max(1, int((window + 1) * seconds - now) + 1)
+
+
+def queue_for(source_type):
+    return settings.DATA_SOURCE_QUEUES.get(source_type, settings.CELERY_TASK_DEFAULT_QUEUE)
+
+
+def _has_active_consent():
+    Consent = apps.get_model('studies', 'Consent')
+    return Exists(Consent.objects.filter(
+        data_source=OuterRef('pk'),
+        revocation_date__isnull=True,
+        is_complete=True,
+    ))
+
+
+def sources_to_process(now=None):
+    """(id, class name) of sources with an active consent that are due for a poll.
+
+    Sources that are already active have nothing left to poll, and finished
+    sources have no next_poll_at. One query, no per-source consent checks.
+    """
+    now = now or timezone.now()
+    rows = (
+        DataSource.objects.non_polymorphic()
+        .filter(_has_active_consent(), next_poll_at__lte=now)
+        .exclude(status='active')
+        .order_by('next_poll_at', 'pk')
+        .values_list('pk', 'polymorphic_ctype_id')
+    )
+    return [
+        (pk, ContentType.objects.get_for_id(ctype_id).model_class().__name__)
+        for pk, ctype_id in rows
+    ]
 
 
 @shared_task
 def process_data_sources():
-    """ Run data source processing tasks
+    """ Dispatch one processing task per data source that needs it
+    """
+    # Skip this run if the previous dispatch is still going
+    if not cache.add(DISPATCH_LOCK_KEY, 1, settings.DATA_SOURCE_DISPATCH_LOCK_TIMEOUT):
+        return "Dispatch already running."
+    try:
+        now = timezone.now()
+        sources = sources_to_process(now)
+        # Lease the dispatched sources so the next beat does not enqueue them
+        # again while they wait in the queue; the task reschedules them.
+        DataSource.objects.filter(pk__in=[pk for pk, _ in sources]).update(
+            next_poll_at=now + timedelta(seconds=settings.DATA_SOURCE_POLL_LEASE)
+        )
+        batches = {}
+        for pk, source_type in sources:
+            if source_type in settings.DATA_SOURCE_POLL_BATCH_SIZES:
+                batches.setdefault(source_type, []).append(pk)
+            else:
+                process_data_source.apply_async(args=[pk], queue=queue_for(source_type))
+        for source_type, pks in batches.items():
+            size = settings.DATA_SOURCE_POLL_BATCH_SIZES[source_type]
+            for start in range(0, len(pks), size):
+                process_data_source_batch.apply_async(
+                    args=[source_type, pks[start:start + size]], queue=queue_for(source_type)
+                )
+    finally:
+        cache.delete(DISPATCH_LOCK_KEY)
+
+    return f"Dispatched {len(sources)} data sources."
+
+
+@shared_task(bind=True, max_retries=None)
+def process_data_source(self, source_id):
+    """ Process a single data source
     """
-    data_sources = DataSource.objects.all()
-    for source in data_sources:
-        source.process()
+    # A slow poll may still be running from the previous beat; don't overlap it
+    lock_key = SOURCE_LOCK_KEY.format(source_id)
+    if not cache.add(lock_key, 1, settings.CELERY_TASK_TIME_LIMIT):
+        return f"Data source {source_id} is already being processed."
+    try:
+        source = DataSource.objects.filter(pk=source_id).first()
+        if source is None:
+            return f"Data source {source_id} no longer exists."
+
+        wait = _take_rate_slot(type(source).__name__)
+        if wait:
+            raise self.retry(countdown=wait)
+
+        type(source).poll_many([source])
+    finally:
+        cache.delete(lock_key)
+
+    return f"Data source {source_id} processed."
+
+
+@shared_task(bind=True, max_retries=None)
+def process_data_source_batch(self, source_type, source_ids):
+    """ Process many data sources of one type with a single poll_many call
+    """
+    locked = [
+        pk for pk in source_ids
+        if cache.add(SOURCE_LOCK_KEY.format(pk), 1, settings.CELERY_TASK_TIME_LIMIT)
+    ]
+    try:
+        if not locked:
+            return "All data sources in the batch are already being processed."
+
+        # The batch is one request to the backend, so it takes one rate slot
+        wait = _take_rate_slot(source_type)
+        if wait:
+            raise self.retry(countdown=wait)
 
-    return "Data sources processed."
+        model = apps.get_model('data_sources', source_type)
+        model.poll_many(model.objects.filter(pk__in=locked).order_by('pk'))
+    finally:
+        cache.delete_many([SOURCE_LOCK_KEY.format(pk) for pk in locked])
+
+    return f"{len(locked)} data sources processed."
+
+
+def study_device_labels():
+    """Labels of the active AWARE devices of consented study participants."""
+    return list(
+        AwareDataSource.objects.filter(_has_active_consent(), status='active')
+        .order_by('pk')
+        .values_list('device_label', flat=True)
+    )
+
+
+def _dispatch_per_device(task, lock_key):
+    """Enqueue `task` for every study AWARE device, unless a dispatch is running."""
+    if not cache.add(lock_key, 1, settings.DATA_SOURCE_DISPATCH_LOCK_TIMEOUT):
+        return None
+    try:
+        labels = study_device_labels()
+        for device_label in labels:
+            task.apply_async(args=[device_label], queue=queue_for('AwareDataSource'))
+    finally:
+        cache.delete(lock_key)
+    return len(labels)
+
+
+def _run_per_device(func, lock_key):
+    """Run func() unless the same job is already running for this device."""
+    if not cache.add(lock_key, 1, settings.CELERY_TASK_TIME_LIMIT):
+        return None
+    try:
+        with db_connector.reuse_connection():
+            return func()
+    finally:
+        cache.delete(lock_key)
+
+
+@shared_task
+def purge_aware_mirror():
+    """ Delete the mirrored rows of devices without an active study consent
+    """
+    deleted = aware_mirror.purge(study_device_labels())
+    return f"Purged {deleted} mirrored rows."
+
+
+@shared_task
+def sync_aware_mirror():
+    """ Purge devices that left their studies, then dispatch one mirror sync
+    task per study AWARE device
+    """
+    purge_aware_mirror()
+    dispatched = _dispatch_per_device(sync_aware_device, MIRROR_DISPATCH_LOCK_KEY)
+    if dispatched is None:
+        return "Mirror dispatch already running."
+    return f"Dispatched mirror sync for {dispatched} devices."
+
+
+@shared_task
+def sync_aware_device(device_label):
+    """ Copy new AWARE rows of one device into the local mirror
+    """
+    copied = _run_per_device(
+        lambda: aware_mirror.sync_device(device_label), MIRROR_LOCK_KEY.format(device_label)
+    )
+    if copied is None:
+        return f"Mirror of {device_label} is already being synced."
+    return f"Copied {copied} rows for {device_label}."
+
+
+@shared_task
+def refresh_aware_counts():
+    """ Dispatch one daily count refresh per study AWARE device
+    """
+    dispatched = _dispatch_per_device(refresh_aware_device_counts, ROLLUP_DISPATCH_LOCK_KEY)
+    if dispatched is None:
+        return "Count refresh already running."
+    return f"Dispatched count refresh for {dispatched} devices."
+
+
+@shared_task
+def refresh_aware_device_counts(device_label):
+    """ Add the AWARE rows that arrived since the last refresh to the daily counts
+    """
+    counted = _run_per_device(
+        lambda: aware_rollup.refresh_device(device_label), ROLLUP_LOCK_KEY.format(device_label)
+    )
+    if counted is None:
+        return f"Counts of {device_label} are already being refreshed."
+    return f"Counted {counted} new rows for {device_label}."
@@ -1,9 +1,10 @@
-from unittest.mock import patch, MagicMock
+from unittest.mock import call, patch, MagicMock
 from django.test import TestCase
 from django.urls import reverse
 from django.contrib.auth.models import User
 from .models import AwareDataSource, JsonUrlDataSource, GooglePortabilityDataSource, TikTokPortabilityDataSource
 from .models.base import DataSource
+from .views import link_consent_to_source
 from django.core.exceptions import ValidationError
 from studies.models import Study, Consent
 from django.utils import timezone
@@ -13,13 +14,108 @@ import uuid
 import tempfile
 import os
 from django.test import override_settings
+from django.core.cache import cache
 import requests
 from data_sources.models import portability_client
 
 import pandas as pd
 import io
-from data_sources.models import db_connector
-
+import json
+import math
+import sqlite3
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import time
+from data_sources.models import db_connector, aware_cache, aware_mirror
+from data_sources.models import AwareMirrorRow, AwareMirrorState, AwareDailyCount, AwareRollupState
+from data_sources.models import aware_rollup, aggregation
+import datetime
+from datetime import datetime as dt, timezone as dt_timezone
+from data_sources import fanout, tasks
+from data_sources.models import aware_sqlite
+from data_sources.management.commands import build_aware_standin
+from study_server.celery import check_shared_cache
+from django.core.management import call_command
+
+
+
+class FakeAwareDatabase:
+    """In-memory SQLite stand-in for the AWARE MySQL database.
+
+    Translates the MySQL-isms used by db_connector (%s placeholders,
+    SHOW TABLES, dictionary cursors) and records every query it runs.
+    """
+
+    def __init__(self):
+        self.db = sqlite3.connect(':memory:', check_same_thread=False)
+        self.db.create_function('FLOOR', 1, math.floor)
+        self.queries = []
+        self.execute("CREATE TABLE aware_device (device_id TEXT, label TEXT)")
+        self.execute("CREATE TABLE device_lookup (id INTEGER PRIMARY KEY, device_uuid TEXT)")
+
+    def execute(self, query, params=()):
+        return self.db.execute(query, params)
+
+    def add_device(self, label, device_id, device_uid):
+        self.execute("INSERT INTO aware_device VALUES (?, ?)", (device_id, label))
+        self.execute("INSERT INTO device_lookup VALUES (?, ?)", (device_uid, device_id))
+
+    def add_rows(self, data_type, rows):
+        table = f"{data_type}_transformed"
+        columns = list(rows[0].keys())
+        self.execute(f"CREATE TABLE IF NOT EXISTS {table} ({', '.join(columns)})")
+        for row in rows:
+            self.execute(
+                f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                tuple(row[c] for c in columns)
+            )
+
+    def connect(self, **kwargs):
+        return _FakeAwareConnection(self)
+
+
+class _FakeAwareConnection:
+    def __init__(self, database):
+        self.database = database
+
+    def cursor(self, dictionary=False):
+        return _FakeAwareCursor(self.database, dictionary)
+
+    def ping(self, reconnect=False):
+        pass
+
+    def close(self):
+        pass
+
+
+class _FakeAwareCursor:
+    def __init__(self, database, dictionary):
+        self.database = database
+        self.dictionary = dictionary
+        self._rows = []
+
+    def execute(self, query, params=()):
+        self.database.queries.append(query)
+        if query.strip().upper() == "SHOW TABLES":
+            query = "SELECT name FROM sqlite_master WHERE type = 'table' ORDER BY name"
+        try:
+            cursor = self.database.execute(query.replace("%s", "?"), tuple(params or ()))
+        except sqlite3.Error as e:
+            raise db_connector.mysql.connector.Error(str(e))
+        rows = cursor.fetchall()
+        if self.dictionary:
+            names = [d[0] for d in cursor.description]
+            rows = [dict(zip(names, row)) for row in rows]
+        self._rows = rows
+
+    def fetchall(self):
+        return self._rows
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def close(self):
+        pass
 
 
 class AddDataSourceViewTest(TestCase):
@@ -34,144 +130,104 @@ class DbConnectorTest(TestCase):
         self.user = User.objects.create_user(username='testuser', password='testpass')
         self.profile = Profile.objects.create(user=self.user)
         self.client.login(username='testuser', password='testpass')
+        db_connector.close_pool()
+        self.addCleanup(db_connector.close_pool)
 
     def test_get_device_ids_for_label_empty(self):
         self.assertEqual(db_connector.get_device_ids_for_label(''), [])
 
-    def test_query_aware_data_returns_transformed_rows(self):
-        # Prepare fake mysql connector behavior
-        class FakeCursor:
-            def __init__(self, rows=None, dictionary=False):
-                self._rows = rows or []
-                self.dictionary = dictionary
-                self.last_query = None
-
-            def execute(self, q, params=None):
-                self.last_query = (q, params)
-                # Heuristics to provide appropriate fake results depending on query
-                qstr = str(q).lower()
-                if 'select id, device_uuid from device_lookup' in qstr:
-                    # return device_lookup mapping as dicts when dictionary=True
-                    # If params provided, filter the available mappings to those device_uuid values
-                    if params and self._rows:
-                        # params may be tuple of device_uuid strings
-                        vals = set(params) if isinstance(params, (list, tuple)) else {params}
-                        if self.dictionary:
-                            self._rows = [r for r in self._rows if str(r.get('device_uuid')) in set(map(str, vals))]
-                        else:
-                            self._rows = [tuple([r.get('id'), r.get('device_uuid')]) for r in self._rows if str(r.get('device_uuid')) in set(map(str, vals))]
-                    else:
-                        self._rows = [{'id': 42, 'device_uuid': 'dev-uuid'}] if self.dictionary else [(42, 'dev-uuid')]
-                elif 'show tables' in qstr:
-                    # handled by separate cursor in FakeConnection
-                    pass
-                elif '_transformed' in qstr:
-                    # transformed table query -> return rows with device_uid
-                    # If the cursor has preloaded transformed rows, use them
-                    src_rows = getattr(self, '_transformed_rows', None)
-                    if src_rows:
-                        # If params are provided (e.g., device_uid filter), only return matching rows
-                        if params:
-                            def match_param(r, p):
-                                try:
-                                    return int(p) == int(r.get('device_uid'))
-                                except Exception:
-                                    return str(p) == str(r.get('device_uid'))
-
-                            # params may be a single value or sequence
-                            param_vals = params if isinstance(params, (list, tuple)) else (params,)
-                            filtered = [r for r in src_rows for p in param_vals if match_param(r, p)]
-                        else:
-                            filtered = list(src_rows)
-
-                        if self.dictionary:
-                            self._rows = filtered
-                        else:
-                            self._rows = [(r.get('device_uid'), r.get('val')) for r in filtered]
-                    else:
-                        if self.dictionary:
-                            self._rows = [{'device_uid': 42, 'val': 1}]
-                        else:
-                            self._rows = [(42, 1)]
-                elif 'select' in qstr and '_transformed' not in qstr and 'device_lookup' not in qstr and 'show tables' not in qstr:
-                    # non-transformed table -> device_id is a string (not device_uid)
-                    if self.dictionary:
-                        # return a distinct value to ensure these rows are distinguishable
-                        self._rows = [{'device_id': 'dev-uuid', 'val': 999}]
-                    else:
-                        self._rows = [('dev-uuid', 999)]
-                else:
-                    self._rows = []
-
-            def fetchall(self):
-                return self._rows
-
-            def fetchone(self):
-                return None
-
-            def close(self):
-                pass
-
-        class FakeConnection:
-            def __init__(self):
-                # first cursor used for SHOW TABLES: include both raw and transformed tables
-                self._first = FakeCursor(rows=[('battery',), ('battery_transformed',), ('other_table',)])
-                # device_lookup mapping and other dictionary cursor results
-                self._second = FakeCursor(rows=[{'id': 42, 'device_uuid': 'dev-uuid'}, {'id': 99, 'device_uuid': 'other-uuid'}], dictionary=True)
-                # transformed rows to be returned by _run_aware_table_query (contains two device_uids)
-                self._transformed_rows = [
-                    {'device_uid': 42, 'val': 1},
-                    {'device_uid': 99, 'val': 2}
-                ]
-
-            def cursor(self, dictionary=False):
-                if not dictionary:
-                    return self._first
-                # For dictionary cursor, we need a cursor that will return mappings
-                # when a dictionary cursor is requested, return a cursor capable of
-                # returning both the device_lookup mappings and transformed rows
-                cur = FakeCursor(rows=self._second._rows, dictionary=True)
-                # store transformed rows on the cursor for execute to pick up when needed
-                cur._transformed_rows = list(self._transformed_rows)
-                return cur
-
-            def close(self):
-                pass
+    def _install_fake_database(self):
+        database = FakeAwareDatabase()
+        database.add_device('label-1', 'dev-uuid', 42)
+        database.add_device('label-2', 'other-uuid', 99)
+        database.add_rows('battery', [
+            {'_id': 1, 'device_uid': 42, 'timestamp': 1000, 'val': 1},
+            {'_id': 2, 'device_uid': 99, 'timestamp': 1000, 'val': 2},
+        ])
+        database.add_rows('screen', [{'_id': 1, 'device_uid': 99, 'timestamp': 1000, 'val': 3}])
+        # Raw (untransformed) tables must never be exposed
+        database.execute("CREATE TABLE battery (device_id TEXT, val INTEGER)")
+        database.execute("INSERT INTO battery VALUES ('dev-uuid', 999)")
+        patcher = patch('data_sources.models.db_connector.mysql.connector.connect', side_effect=database.connect)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        cache.clear()
+        self.addCleanup(cache.clear)
+        return database
 
-        def fake_connect(*args, **kwargs):
-            return FakeConnection()
-
-        # Patch get_device_ids_for_label to return a device id
-        with patch('data_sources.models.db_connector.mysql.connector.connect', side_effect=fake_connect):
-            # Also patch get_device_ids_for_label to return a device uuid so query proceeds
-            with patch('data_sources.models.db_connector.get_device_ids_for_label', return_value=['dev-uuid']):
-                # Query for device 'dev-uuid' should return only transformed rows
-                rows = db_connector.query_aware_data('SELECT *', 'label-1', 'battery', limit=10)
-                self.assertIsInstance(rows, list)
-                # Should only return transformed-row for device_uid 42 -> dev-uuid
-                self.assertEqual(len(rows), 1)
-                first = rows[0]
-                self.assertIn('device_id', first)
-                self.assertEqual(first.get('device_id'), 'dev-uuid')
-                self.assertEqual(first.get('val'), 1)
-
-                # Query for a different device should return the other transformed row
-                with patch('data_sources.models.db_connector.get_device_ids_for_label', return_value=['other-uuid']):
-                    rows2 = db_connector.query_aware_data('SELECT *', 'label-1', 'battery', limit=10)
-                    self.assertIsInstance(rows2, list)
-                    self.assertEqual(len(rows2), 1)
-                    first2 = rows2[0]
-                    self.assertEqual(first2.get('device_id'), 'other-uuid')
-                    self.assertEqual(first2.get('val'), 2)
-
-                # Ensure non-transformed table rows (val 999) are not returned
-                vals = [r.get('val') for r in rows]
-                self.assertNotIn(999, vals)
-
-                # Test count function uses query_aware_data and returns 0 or number
-                with patch('data_sources.models.db_connector.query_aware_data', return_value=[{'row_count': 5}]):
-                    cnt = db_connector.get_aware_count('label-1', 'battery')
-                    self.assertEqual(cnt, 5)
+    def test_query_aware_data_returns_transformed_rows(self):
+        self._install_fake_database()
+        # Query for device 'dev-uuid' should return only transformed rows
+        rows = db_connector.query_aware_data('SELECT *', 'label-1', 'battery', limit=10)
+        self.assertIsInstance(rows, list)
+        # Should only return transformed-row for device_uid 42 -> dev-uuid
+        self.assertEqual(len(rows), 1)
+        first = rows[0]
+        self.assertEqual(first.get('device_id'), 'dev-uuid')
+        self.assertNotIn('device_uid', first)
+        self.assertEqual(first.get('val'), 1)
+
+        # Query for a different device should return the other transformed row
+        rows2 = db_connector.query_aware_data('SELECT *', 'label-2', 'battery', limit=10)
+        self.assertEqual(len(rows2), 1)
+        self.assertEqual(rows2[0].get('device_id'), 'other-uuid')
+        self.assertEqual(rows2[0].get('val'), 2)
+
+        # Ensure non-transformed table rows (val 999) are not returned
+        self.assertNotIn(999, [r.get('val') for r in rows])
+
+        # Tables without data for the device return nothing
+        self.assertEqual(db_connector.query_aware_data('SELECT *', 'label-1', 'screen'), [])
+
+        # Test count function uses query_aware_data and returns 0 or number
+        with patch('data_sources.models.db_connector.query_aware_data', return_value=[{'row_count': 5}]):
+            cnt = db_connector.get_aware_count('label-1', 'battery')
+            self.assertEqual(cnt, 5)
+
+    def test_database_errors_are_not_taken_for_missing_data(self):
+        database = self._install_fake_database()
+        self.assertEqual(db_connector.get_aware_tables('label-1'), ['battery'])
+        # The table disappears after discovery cached it
+        database.execute("DROP TABLE battery_transformed")
+        with self.assertRaises(db_connector.mysql.connector.Error):
+            db_connector.get_aware_data('label-1', 'battery')
+        with self.assertRaises(db_connector.mysql.connector.Error):
+            db_connector.get_aware_count('label-1', 'battery')
+        cache.clear()
+        database.execute("DROP TABLE device_lookup")
+        with self.assertRaises(db_connector.mysql.connector.Error):
+            db_connector.get_aware_data('label-1', 'battery')
+        # Listing the data types still degrades to an empty list
+        self.assertEqual(db_connector.get_aware_tables('label-1'), [])
+
+    def test_discover_devices_batches_all_labels(self):
+        database = self._install_fake_database()
+        devices = db_connector.discover_devices(['label-1', 'label-2', 'unknown'])
+        self.assertEqual(devices['label-1'], {'devices': {42: 'dev-uuid'}, 'tables': ['battery']})
+        self.assertEqual(devices['label-2']['tables'], ['battery', 'screen'])
+        self.assertEqual(devices['unknown'], {'devices': {}, 'tables': []})
+        # device ids, device uids, SHOW TABLES and one UNION ALL probe
+        self.assertEqual(len(database.queries), 4)
+        self.assertEqual(sum('UNION ALL' in q for q in database.queries), 1)
+
+        # Listing and fetching afterwards are served from the discovery result
+        database.queries.clear()
+        self.assertEqual(db_connector.get_aware_tables('label-2'), ['battery', 'screen'])
+        db_connector.get_aware_data('label-2', 'screen')
+        self.assertEqual(len(database.queries), 1)
+
+    def test_prefetch_data_types_runs_one_discovery(self):
+        self._install_fake_database()
+        sources = [
+            AwareDataSource.objects.create(profile=self.profile, name='A', device_label='label-1', status='active'),
+            AwareDataSource.objects.create(profile=self.profile, name='B', device_label='label-2', status='active'),
+        ]
+        with patch('data_sources.models.db_connector.discover_devices',
+                   wraps=db_connector.discover_devices) as mock_discover:
+            AwareDataSource.prefetch_data_types(sources)
+            self.assertEqual(sources[0].get_data_types(), ['battery'])
+            self.assertEqual(sources[1].get_data_types(), ['battery', 'screen'])
+        self.assertEqual(sorted(mock_discover.call_args_list[0][0][0]), ['label-1', 'label-2'])
         self.client.login(username='testuser', password='testpass')
 
     def test_auto_create_data_source_with_only_name_field(self):
@@ -219,6 +275,667 @@ class DbConnectorTest(TestCase):
 
 
 
+class AwareKeysetPaginationTest(TestCase):
+    def test_after_adds_keyset_condition(self):
+        cursor = MagicMock()
+        cursor.fetchall.return_value = []
+        db_connector._run_aware_table_query(
+            cursor, "SELECT *", "battery_transformed", "device_uid", [42],
+            limit=100, after=(1700000000000, 55)
+        )
+        query, params = cursor.execute.call_args[0]
+        self.assertIn("(timestamp < %s OR (timestamp = %s AND _id < %s))", query)
+        self.assertIn("ORDER BY timestamp DESC, _id DESC LIMIT %s", query)
+        self.assertNotIn("OFFSET", query)
+        self.assertEqual(params, (42, 1700000000000, 1700000000000, 55, 100))
+
+    def test_count_ignores_after(self):
+        cursor = MagicMock()
+        cursor.fetchall.return_value = [{'row_count': 3}]
+        db_connector._run_aware_table_query(
+            cursor, "SELECT COUNT(*) as row_count", "battery_transformed", "device_uid", [42],
+            after=(1, 2)
+        )
+        query, params = cursor.execute.call_args[0]
+        self.assertNotIn("_id", query)
+        self.assertEqual(params, (42,))
+
+    def test_aware_fetch_page_returns_cursor_from_last_row(self):
+        user = User.objects.create_user(username='pager', password='testpass')
+        profile = Profile.objects.create(user=user)
+        source = AwareDataSource.objects.create(profile=profile, name='Pager', status='active')
+        rows = [{'_id': 9, 'timestamp': 20}, {'_id': 8, 'timestamp': 10}]
+        with patch('data_sources.models.db_connector.get_aware_data', return_value=rows) as mock_get:
+            page, cursor = source.fetch_page('battery', limit=2)
+            self.assertEqual(page, rows)
+            self.assertEqual(cursor, {'timestamp': 10, 'id': 8})
+            source.fetch_page('battery', limit=2, cursor=cursor)
+        self.assertEqual(mock_get.call_args[0][-1], (10, 8))
+
+    def test_aware_fetch_page_short_page_ends(self):
+        user = User.objects.create_user(username='pager', password='testpass')
+        profile = Profile.objects.create(user=user)
+        source = AwareDataSource.objects.create(profile=profile, name='Pager', status='active')
+        with patch('data_sources.models.db_connector.get_aware_data', return_value=[{'_id': 1, 'timestamp': 1}]):
+            _, cursor = source.fetch_page('battery', limit=2)
+        self.assertIsNone(cursor)
+
+
+class AwareConnectionPoolTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        db_connector.close_pool()
+        self.addCleanup(db_connector.close_pool)
+
+    def _fake_connection(self, rows=None):
+        connection = MagicMock()
+        cursor = connection.cursor.return_value
+        cursor.fetchall.return_value = rows or [('label-1', 'dev-1')]
+        return connection
+
+    def test_connections_are_reused_between_calls(self):
+        with patch('data_sources.models.db_connector.mysql.connector.connect',
+                   side_effect=lambda **kw: self._fake_connection()) as mock_connect:
+            db_connector.get_device_ids_for_label('label-1', use_cache=False)
+            db_connector.get_device_ids_for_label('label-2', use_cache=False)
+        self.assertEqual(mock_connect.call_count, 1)
+
+    def test_connections_autocommit(self):
+        with patch('data_sources.models.db_connector.mysql.connector.connect',
+                   side_effect=lambda **kw: self._fake_connection()) as mock_connect:
+            db_connector.get_device_ids_for_label('label-1', use_cache=False)
+        self.assertIs(mock_connect.call_args.kwargs['autocommit'], True)
+
+    def test_reuse_connection_shares_one_checkout(self):
+        with patch('data_sources.models.db_connector.mysql.connector.connect',
+                   side_effect=lambda **kw: self._fake_connection()) as mock_connect:
+            with db_connector.reuse_connection():
+                db_connector.get_device_ids_for_label('label-1', use_cache=False)
+                with db_connector.connection() as first:
+                    with db_connector.connection() as second:
+                        self.assertIs(first, second)
+            self.assertEqual(db_connector.get_pool()._idle.qsize(), 1)
+        self.assertEqual(mock_connect.call_count, 1)
+
+    def test_reuse_connection_without_queries_does_not_connect(self):
+        with patch('data_sources.models.db_connector.mysql.connector.connect') as mock_connect:
+            with db_connector.reuse_connection():
+                pass
+        mock_connect.assert_not_called()
+
+    def test_failed_ping_replaces_connection(self):
+        stale = self._fake_connection()
+        stale.ping.side_effect = db_connector.mysql.connector.Error('gone away')
+        fresh = self._fake_connection()
+        with patch('data_sources.models.db_connector.mysql.connector.connect',
+                   side_effect=[stale, fresh]) as mock_connect:
+            db_connector.get_device_ids_for_label('label-1', use_cache=False)
+            db_connector.get_device_ids_for_label('label-1', use_cache=False)
+        self.assertEqual(mock_connect.call_count, 2)
+        stale.close.assert_called_once()
+
+    def test_connection_discarded_after_database_error(self):
+        broken = self._fake_connection()
+        broken.cursor.return_value.execute.side_effect = db_connector.mysql.connector.Error('boom')
+        with patch('data_sources.models.db_connector.mysql.connector.connect', return_value=broken):
+            self.assertEqual(db_connector.get_device_ids_for_label('label-1', use_cache=False), [])
+        broken.close.assert_called_once()
+        self.assertEqual(db_connector.get_pool()._idle.qsize(), 0)
+
+    @override_settings(AWARE_DB_POOL_SIZE=1, AWARE_DB_POOL_TIMEOUT=0.01)
+    def test_checkout_times_out_when_pool_exhausted(self):
+        with patch('data_sources.models.db_connector.mysql.connector.connect',
+                   side_effect=lambda **kw: self._fake_connection()):
+            with db_connector.connection():
+                with self.assertRaises(db_connector.PoolTimeout):
+                    db_connector.get_pool().acquire()
+                # Query helpers must not mistake an exhausted pool for "no rows"
+                with self.assertRaises(db_connector.PoolTimeout):
+                    db_connector.get_device_ids_for_label('label-1', use_cache=False)
+                with self.assertRaises(db_connector.PoolTimeout):
+                    db_connector.get_aware_data('label-1', 'battery')
+
+    def test_new_pool_after_fork(self):
+        pool = db_connector.get_pool()
+        with patch('data_sources.models.db_connector.os.getpid', return_value=-1):
+            self.assertIsNot(db_connector.get_pool(), pool)
+
+
+class AwareCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.loads = []
+
+    def loader(self, keys):
+        self.loads.append(list(keys))
+        return {key: [f'{key}-device'] for key in keys if key != 'missing'}
+
+    def test_values_are_loaded_once(self):
+        first = aware_cache.get_many_or_load('device_ids', ['a', 'b'], self.loader)
+        second = aware_cache.get_many_or_load('device_ids', ['a', 'b'], self.loader)
+        self.assertEqual(first, {'a': ['a-device'], 'b': ['b-device']})
+        self.assertEqual(second, first)
+        self.assertEqual(self.loads, [['a', 'b']])
+
+    def test_only_missing_keys_are_loaded(self):
+        aware_cache.get_many_or_load('device_ids', ['a'], self.loader)
+        aware_cache.get_many_or_load('device_ids', ['a', 'b'], self.loader)
+        self.assertEqual(self.loads, [['a'], ['b']])
+
+    @override_settings(AWARE_CACHE_NEGATIVE_TTL=1000)
+    def test_empty_results_are_cached(self):
+        self.assertEqual(aware_cache.get_many_or_load('device_ids', ['missing'], self.loader), {'missing': None})
+        self.assertEqual(aware_cache.get_many_or_load('device_ids', ['missing'], self.loader), {'missing': None})
+        self.assertEqual(self.loads, [['missing']])
+
+    def test_loader_errors_are_not_cached(self):
+        def failing(keys):
+            raise db_connector.mysql.connector.Error('down')
+
+        with self.assertRaises(db_connector.mysql.connector.Error):
+            aware_cache.get_many_or_load('device_ids', ['a'], failing)
+        aware_cache.get_many_or_load('device_ids', ['a'], self.loader)
+        self.assertEqual(self.loads, [['a']])
+
+    def test_waits_for_concurrent_loader(self):
+        # Another process holds the lock and publishes the value shortly after
+        cache.add(aware_cache._lock_key('device_ids', 'a'), 1, 10)
+
+        def publish():
+            time.sleep(0.1)
+            cache.set(aware_cache._key('device_ids', 'a'), ['from-other-worker'])
+
+        thread = threading.Thread(target=publish)
+        thread.start()
+        result = aware_cache.get_many_or_load('device_ids', ['a'], self.loader)
+        thread.join()
+        self.assertEqual(result, {'a': ['from-other-worker']})
+        self.assertEqual(self.loads, [])
+
+    def test_check_for_device_bypasses_and_invalidates_cache(self):
+        user = User.objects.create_user(username='cacheuser', password='testpass')
+        profile = Profile.objects.create(user=user)
+        source = AwareDataSource.objects.create(profile=profile, name='Phone', device_label='phone-1')
+        device_id = str(uuid.uuid4())
+        # Stale negative entry from before the phone started uploading
+        cache.set(aware_cache._key('device_ids', 'phone-1'), aware_cache._EMPTY)
+        cache.set(aware_cache._key('device_uid', device_id), 7)
+        cache.set(aware_cache._key('tables', 7), ['battery'])
+
+        def fresh(labels):
+            return {'phone-1': [device_id]}
+
+        with patch('data_sources.models.db_connector._load_device_ids', side_effect=fresh):
+            success, _ = source.check_for_device()
+            self.assertTrue(success)
+            # Prime the cache as a listing would, then confirm activation cleared it
+            db_connector.get_device_ids_for_label('phone-1')
+        db_connector.invalidate_device('phone-1')
+        self.assertIsNone(cache.get(aware_cache._key('device_ids', 'phone-1')))
+        self.assertIsNone(cache.get(aware_cache._key('device_uid', device_id)))
+        self.assertIsNone(cache.get(aware_cache._key('tables', 7)))
+        source.refresh_from_db()
+        self.assertEqual(source.status, 'active')
+
+
+@override_settings(AWARE_MIRROR_BATCH_SIZE=2, AWARE_MIRROR_MAX_AGE=600)
+class AwareMirrorTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        db_connector.close_pool()
+        self.addCleanup(db_connector.close_pool)
+        self.database = FakeAwareDatabase()
+        self.device_id = str(uuid.uuid4())
+        self.database.add_device('phone', self.device_id, 42)
+        self.database.add_device('other', 'other-uuid', 99)
+        self.database.add_rows('battery', [
+            {'_id': 1, 'device_uid': 42, 'timestamp': 1000, 'level': 90},
+            {'_id': 2, 'device_uid': 42, 'timestamp': 2000, 'level': 80},
+            {'_id': 3, 'device_uid': 42, 'timestamp': 2000, 'level': 79},
+            {'_id': 4, 'device_uid': 99, 'timestamp': 2500, 'level': 10},
+            {'_id': 5, 'device_uid': 42, 'timestamp': 3000, 'level': 70},
+        ])
+        patcher = patch('data_sources.models.db_connector.mysql.connector.connect',
+                        side_effect=self.database.connect)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_sync_copies_rows_incrementally(self):
+        self.assertEqual(aware_mirror.sync_device('phone'), 4)
+        state = AwareMirrorState.objects.get(device_uid=42, data_type='battery')
+        self.assertEqual(state.last_id, 5)
+        self.assertIsNotNone(state.synced_at)
+
+        self.database.add_rows('battery', [{'_id': 6, 'device_uid': 42, 'timestamp': 4000, 'level': 60}])
+        self.database.queries.clear()
+        self.assertEqual(aware_mirror.sync_device('phone'), 1)
+        pulls = [q for q in self.database.queries if 'ORDER BY _id ASC' in q]
+        self.assertEqual(len(pulls), 1)
+        self.assertEqual(AwareMirrorRow.objects.filter(device_uid=42).count(), 5)
+
+    def test_late_uploads_with_old_timestamps_are_copied(self):
+        aware_mirror.sync_device('phone')
+        self.database.add_rows('battery', [{'_id': 6, 'device_uid': 42, 'timestamp': 500, 'level': 95}])
+        self.assertEqual(aware_mirror.sync_device('phone'), 1)
+        self.assertEqual(
+            aware_mirror.get_data('phone', 'battery', limit=10),
+            db_connector.get_aware_data('phone', 'battery', limit=10),
+        )
+
+    def test_rows_committed_late_below_the_watermark_are_copied(self):
+        self.database.add_rows('battery', [{'_id': 7, 'device_uid': 42, 'timestamp': 5000, 'level': 50}])
+        self.assertEqual(aware_mirror.sync_device('phone'), 5)
+        state = AwareMirrorState.objects.get(device_uid=42, data_type='battery')
+        self.assertEqual((state.last_id, state.pending_ids), (7, [6]))
+
+        self.database.add_rows('battery', [{'_id': 6, 'device_uid': 42, 'timestamp': 4000, 'level': 60}])
+        self.assertEqual(aware_mirror.sync_device('phone'), 1)
+        state.refresh_from_db()
+        self.assertEqual((state.last_id, state.pending_ids), (7, []))
+        self.assertEqual(
+            aware_mirror.get_data('phone', 'battery', limit=10),
+            db_connector.get_aware_data('phone', 'battery', limit=10),
+        )
+
+    def test_binary_values_are_stored_as_text(self):
+        self.database.add_rows('blob', [
+            {'_id': 1, 'device_uid': 42, 'timestamp': 1000, 'payload': b'hello'},
+            {'_id': 2, 'device_uid': 42, 'timestamp': 2000, 'payload': b'\xff\x00'},
+        ])
+        aware_mirror.sync_device('phone')
+        payloads = [row['payload'] for row in aware_mirror.get_data('phone', 'blob')]
+        self.assertEqual(payloads, ['/wA=', 'hello'])
+        self.assertEqual(AwareMirrorState.objects.get(device_uid=42, data_type='blob').last_id, 2)
+
+    def test_purge_deletes_devices_that_left_their_studies(self):
+        aware_mirror.sync_device('phone')
+        aware_mirror.sync_device('other')
+        self.assertEqual(aware_mirror.purge(['other']), 4)
+        self.assertFalse(AwareMirrorState.objects.filter(device_label='phone').exists())
+        self.assertEqual(list(AwareMirrorRow.objects.values_list('device_uid', flat=True)), [99])
+
+    def test_mirror_matches_remote(self):
+        aware_mirror.sync_device('phone')
+        remote = db_connector.get_aware_data('phone', 'battery', limit=10)
+        self.assertEqual(aware_mirror.get_data('phone', 'battery', limit=10), remote)
+        self.assertEqual(
+            aware_mirror.get_data('phone', 'battery', limit=2, after=(2000, 3)),
+            db_connector.get_aware_data('phone', 'battery', limit=2, after=(2000, 3)),
+        )
+        start = timezone.datetime.fromtimestamp(1.5, tz=timezone.utc)
+        self.assertEqual(aware_mirror.get_count('phone', 'battery', start_date=start), 3)
+
+    def test_stale_or_missing_mirror_is_not_used(self):
+        self.assertIsNone(aware_mirror.get_data('phone', 'battery'))
+        aware_mirror.sync_device('phone')
+        AwareMirrorState.objects.update(synced_at=timezone.now() - timezone.timedelta(hours=1))
+        self.assertIsNone(aware_mirror.get_count('phone', 'battery'))
+
+    @override_settings(AWARE_MIRROR_ENABLED=True)
+    def test_source_reads_from_fresh_mirror(self):
+        user = User.objects.create_user(username='mirroruser', password='testpass')
+        profile = Profile.objects.create(user=user)
+        source = AwareDataSource.objects.create(profile=profile, name='Phone', device_label='phone',
+                                                device_id=self.device_id, status='active')
+        aware_mirror.sync_device('phone')
+        with patch('data_sources.models.db_connector.get_aware_data') as mock_remote, \
+                patch('data_sources.models.db_connector.get_aware_count') as mock_count:
+            rows = source.fetch_data('battery', limit=10)
+            self.assertEqual(source.count_rows('battery'), 4)
+        mock_remote.assert_not_called()
+        mock_count.assert_not_called()
+        self.assertEqual([row['_id'] for row in rows], [5, 3, 2, 1])
+        self.assertEqual(rows[0]['device_id'], self.device_id)
+
+    @patch('data_sources.tasks.sync_aware_device.apply_async')
+    def test_sync_task_dispatches_study_devices(self, mock_apply):
+        user = User.objects.create_user(username='mirroruser', password='testpass')
+        profile = Profile.objects.create(user=user)
+        study = Study.objects.create(title='S', description='d', config_url='http://example.com')
+        consented = AwareDataSource.objects.create(profile=profile, name='A', device_label='phone',
+                                                   device_id=self.device_id, status='active')
+        AwareDataSource.objects.create(profile=profile, name='B', device_label='other', status='active')
+        Consent.objects.create(participant=profile, study=study, data_source=consented,
+                               source_type='AwareDataSource', is_complete=True)
+        tasks.sync_aware_mirror()
+        mock_apply.assert_called_once_with(args=['phone'], queue='celery')
+        tasks.sync_aware_device('phone')
+        self.assertEqual(AwareMirrorRow.objects.count(), 4)
+
+        consent = Consent.objects.get(data_source=consented)
+        consent.revocation_date = timezone.now()
+        consent.save()
+        tasks.sync_aware_mirror()
+        self.assertFalse(AwareMirrorRow.objects.exists())
+
+
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+@override_settings(AWARE_ROLLUP_ENABLED=True, AWARE_ROLLUP_MAX_AGE=600, AWARE_MIRROR_ENABLED=False)
+class AwareRollupTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        db_connector.close_pool()
+        self.addCleanup(db_connector.close_pool)
+        self.database = FakeAwareDatabase()
+        self.device_id = str(uuid.uuid4())
+        self.database.add_device('phone', self.device_id, 42)
+        # Two rows on 1970-01-02, one on 1970-01-03
+        self.database.add_rows('battery', [
+            {'_id': 1, 'device_uid': 42, 'timestamp': DAY_MS + 1000},
+            {'_id': 2, 'device_uid': 42, 'timestamp': DAY_MS + 2000},
+            {'_id': 3, 'device_uid': 42, 'timestamp': 2 * DAY_MS + 5},
+            {'_id': 4, 'device_uid': 99, 'timestamp': 2 * DAY_MS + 5},
+        ])
+        patcher = patch('data_sources.models.db_connector.mysql.connector.connect',
+                        side_effect=self.database.connect)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _counts(self):
+        return dict(AwareDailyCount.objects.filter(device_uid=42).values_list('day', 'row_count'))
+
+    def test_refresh_counts_new_rows_by_day(self):
+        self.assertEqual(aware_rollup.refresh_device('phone'), 3)
+        self.assertEqual(self._counts(), {datetime.date(1970, 1, 2): 2, datetime.date(1970, 1, 3): 1})
+        # A late upload for an old day is picked up by its _id
+        self.database.add_rows('battery', [{'_id': 5, 'device_uid': 42, 'timestamp': DAY_MS + 3000}])
+        self.assertEqual(aware_rollup.refresh_device('phone'), 1)
+        self.assertEqual(self._counts()[datetime.date(1970, 1, 2)], 3)
+        self.assertEqual(aware_rollup.refresh_device('phone'), 0)
+
+    def test_refresh_counts_rows_committed_late_below_the_watermark_once(self):
+        self.database.add_rows('battery', [{'_id': 6, 'device_uid': 42, 'timestamp': 2 * DAY_MS + 10}])
+        self.assertEqual(aware_rollup.refresh_device('phone'), 4)
+        state = AwareRollupState.objects.get(device_uid=42, data_type='battery')
+        self.assertEqual((state.last_id, state.pending_ids), (6, [5]))
+
+        self.database.add_rows('battery', [{'_id': 5, 'device_uid': 42, 'timestamp': DAY_MS + 3000}])
+        # A refresh holding a stale state does not count anything twice
+        aware_rollup.refresh_table(state)
+        self.assertEqual(aware_rollup.refresh_table(state), 0)
+        state.refresh_from_db()
+        self.assertEqual((state.last_id, state.pending_ids), (6, []))
+        self.assertEqual(self._counts(), {datetime.date(1970, 1, 2): 3, datetime.date(1970, 1, 3): 2})
+
+    def test_split_range(self):
+        today = datetime.date(2024, 5, 10)
+        start = dt(2024, 5, 1, 12, tzinfo=dt_timezone.utc)
+        end = dt(2024, 5, 10, 8, tzinfo=dt_timezone.utc)
+        first, last, partial = aware_rollup.split_range(start, end, today)
+        self.assertEqual((first, last), (datetime.date(2024, 5, 2), datetime.date(2024, 5, 9)))
+        self.assertEqual(partial, [
+            (start, dt(2024, 5, 2, tzinfo=dt_timezone.utc) - timezone.timedelta(milliseconds=1)),
+            (dt(2024, 5, 10, tzinfo=dt_timezone.utc), end),
+        ])
+        # Today alone is counted live
+        first, last, partial = aware_rollup.split_range(end - timezone.timedelta(hours=1), end, today)
+        self.assertGreater(first, last)
+        self.assertEqual(len(partial), 1)
+
+    def test_count_rows_uses_rollup_for_whole_days(self):
+        user = User.objects.create_user(username='rollupuser', password='testpass')
+        profile = Profile.objects.create(user=user)
+        source = AwareDataSource.objects.create(profile=profile, name='Phone', device_label='phone',
+                                                device_id=self.device_id, status='active')
+        self.assertEqual(source.count_rows('battery'), 3)  # not refreshed yet: live
+        aware_rollup.refresh_device('phone')
+        with patch('data_sources.models.db_connector.get_aware_count', return_value=7) as mock_live:
+            self.assertEqual(source.count_rows('battery'), 3 + 7)
+        # Only the current day is counted live
+        (_, _, start, end), _ = mock_live.call_args
+        self.assertEqual(start.date(), timezone.now().astimezone(dt_timezone.utc).date())
+        self.assertIsNone(end)
+
+        start = dt(1970, 1, 2, 0, 0, 1, tzinfo=dt_timezone.utc)
+        end = dt(1970, 1, 3, 23, 59, 59, 999000, tzinfo=dt_timezone.utc)
+        with patch('data_sources.models.db_connector.get_aware_count', return_value=2) as mock_live:
+            self.assertEqual(source.count_rows('battery', start, end), 1 + 2)
+        mock_live.assert_called_once()
+
+    @patch('data_sources.tasks.refresh_aware_device_counts.apply_async')
+    def test_refresh_task_dispatches_study_devices(self, mock_apply):
+        user = User.objects.create_user(username='rollupuser', password='testpass')
+        profile = Profile.objects.create(user=user)
+        study = Study.objects.create(title='S', description='d', config_url='http://example.com')
+        source = AwareDataSource.objects.create(profile=profile, name='Phone', device_label='phone',
+                                                device_id=self.device_id, status='active')
+        Consent.objects.create(participant=profile, study=study, data_source=source,
+                               source_type='AwareDataSource', is_complete=True)
+        tasks.refresh_aware_counts()
+        mock_apply.assert_called_once_with(args=['phone'], queue='celery')
+        tasks.refresh_aware_device_counts('phone')
+        self.assertEqual(sum(self._counts().values()), 3)
+
+    def test_daily_coverage_reads_past_days_from_rollup(self):
+        user = User.objects.create_user(username='rollupuser', password='testpass')
+        profile = Profile.objects.create(user=user)
+        source = AwareDataSource.objects.create(profile=profile, name='Phone', device_label='phone',
+                                                device_id=self.device_id, status='active')
+        aware_rollup.refresh_device('phone')
+        self.database.queries.clear()
+        coverage = source.daily_coverage('battery', datetime.date(1970, 1, 1), datetime.date(1970, 1, 3))
+        self.assertEqual(coverage, {datetime.date(1970, 1, 2): (2, None), datetime.date(1970, 1, 3): (1, None)})
+        self.assertEqual(self.database.queries, [])
+
+    def test_daily_coverage_groups_by_day(self):
+        user = User.objects.create_user(username='rollupuser', password='testpass')
+        profile = Profile.objects.create(user=user)
+        source = AwareDataSource.objects.create(profile=profile, name='Phone', device_label='phone',
+                                                device_id=self.device_id, status='active')
+        coverage = source.daily_coverage('battery', datetime.date(1970, 1, 1), datetime.date(1970, 1, 2))
+        self.assertEqual(coverage, {
+            datetime.date(1970, 1, 2): (2, dt.fromtimestamp((DAY_MS + 2000) / 1000, tz=dt_timezone.utc)),
+        })
+        self.assertEqual(source.daily_coverage('screen', datetime.date(1970, 1, 1), datetime.date(1970, 1, 3)), {})
+
+
+class AwareStandinTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        db_connector.close_pool()
+        self.addCleanup(db_connector.close_pool)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'aware.sqlite3')
+        self.end_ms = 10 * 86400000
+        self.labels = build_aware_standin.build(
+            self.path, devices=2, days=2, rates={'battery': 1, 'screen': 0.5}, end_ms=self.end_ms,
+        )
+        settings_override = override_settings(AWARE_DB_ENGINE='sqlite', AWARE_DB_SQLITE_PATH=self.path)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def _direct_count(self, table, device_label):
+        db = sqlite3.connect(self.path)
+        self.addCleanup(db.close)
+        return db.execute(
+            f"SELECT COUNT(*) FROM {table}_transformed t JOIN device_lookup l ON t.device_uid = l.id "
+            f"JOIN aware_device d ON d.device_id = l.device_uuid WHERE d.label = ?", (device_label,)
+        ).fetchone()[0]
+
+    def test_build_writes_devices_and_rows(self):
+        self.assertEqual(sorted(self.labels), ['standin-0', 'standin-1'])
+        # About one battery row per minute over two days
+        self.assertAlmostEqual(self._direct_count('battery', 'standin-0'), 2 * 1440, delta=2 * 1440 * 0.1)
+
+    def test_db_connector_reads_standin(self):
+        self.assertEqual(db_connector.get_aware_tables('standin-1'), ['battery', 'screen'])
+        self.assertEqual(db_connector.get_device_ids_for_label('standin-1'), [self.labels['standin-1']])
+        self.assertEqual(db_connector.get_aware_count('standin-1', 'screen'), self._direct_count('screen', 'standin-1'))
+        rows = db_connector.get_aware_data('standin-0', 'battery', limit=5)
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0]['device_id'], self.labels['standin-0'])
+        self.assertGreater(rows[0]['timestamp'], rows[-1]['timestamp'])
+        device_uids = list(db_connector.discover_devices(['standin-0'])['standin-0']['devices'])
+        days = db_connector.count_rows_by_day('battery', device_uids, 0, self.end_ms + 1)
+        self.assertEqual(sorted(days), [8, 9])
+
+    def test_errors_look_like_mysql_errors(self):
+        database = aware_sqlite.connect(self.path)
+        cursor = database.cursor()
+        with self.assertRaises(db_connector.mysql.connector.Error):
+            cursor.execute("SELECT * FROM missing_transformed")
+        with self.assertRaises(db_connector.mysql.connector.Error):
+            cursor.execute("INSERT INTO aware_device (device_id, label) VALUES (%s, %s)", ('x', 'y'))
+        database.close()
+        with self.assertRaises(db_connector.mysql.connector.Error):
+            aware_sqlite.connect(self.path + '.missing')
+
+    def test_sync_reads_rows_ingested_between_marks(self):
+        user = User.objects.create_user(username='sync', password='pass')
+        profile = Profile.objects.create(user=user, user_type='participant')
+        source = AwareDataSource.objects.create(
+            profile=profile, name='Phone', device_label='standin-0', status='active',
+            device_id=self.labels['standin-0'],
+        )
+        first = AwareDataSource.sync_watermarks([source], 'battery')[0]
+        rows = list(source.iter_changes('battery', since=None, until=first, page_size=500))
+        self.assertEqual(len(rows), self._direct_count('battery', 'standin-0'))
+        ids = [row['_id'] for row in rows]
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(rows[0]['device_id'], self.labels['standin-0'])
+
+        # Late rows with old timestamps count as new: the watermark is _id, not time
+        db = sqlite3.connect(self.path)
+        for device_uid in (1, 1, 2):
+            db.execute("INSERT INTO battery_transformed (timestamp, device_uid) VALUES (?, ?)", (5, device_uid))
+        db.commit()
+        db.close()
+        second = AwareDataSource.sync_watermarks([source], 'battery')[0]
+        self.assertEqual(second, [first[0] + 3, []])
+        changes = list(source.iter_changes('battery', since=first, until=second))
+        self.assertEqual([row['timestamp'] for row in changes], [5, 5])
+        self.assertEqual(list(source.iter_changes('battery', since=second, until=second)), [])
+
+    def test_sync_reads_rows_that_commit_out_of_order(self):
+        user = User.objects.create_user(username='gaps', password='pass')
+        profile = Profile.objects.create(user=user, user_type='participant')
+        source = AwareDataSource.objects.create(
+            profile=profile, name='Phone', device_label='standin-0', status='active',
+            device_id=self.labels['standin-0'],
+        )
+        first = AwareDataSource.sync_watermarks([source], 'battery')[0]
+        # _id first+1 is taken by a transaction that has not committed yet
+        gap = first[0] + 1
+        db = sqlite3.connect(self.path)
+        db.execute("INSERT INTO battery_transformed (_id, timestamp, device_uid) VALUES (?, ?, ?)", (gap + 1, 6, 1))
+        db.commit()
+        second = AwareDataSource.sync_watermarks([source], 'battery')[0]
+        self.assertEqual(second, [gap + 1, [gap]])
+        db.execute("INSERT INTO battery_transformed (_id, timestamp, device_uid) VALUES (?, ?, ?)", (gap, 5, 1))
+        db.commit()
+        db.close()
+        # The row arriving between the mark and the read waits for the next sync
+        changes = list(source.iter_changes('battery', since=first, until=second))
+        self.assertEqual([row['_id'] for row in changes], [gap + 1])
+        third = AwareDataSource.sync_watermarks([source], 'battery')[0]
+        changes = list(source.iter_changes('battery', since=second, until=third))
+        self.assertEqual([row['_id'] for row in changes], [gap])
+        self.assertEqual(list(source.iter_changes('battery', since=third, until=third)), [])
+        # Marks from before gap tracking were a bare _id
+        self.assertEqual(len(list(source.iter_changes('battery', since=first[0], until=third))), 2)
+
+    def test_sql_aggregates_match_pandas(self):
+        user = User.objects.create_user(username='agg', password='pass')
+        profile = Profile.objects.create(user=user, user_type='participant')
+        source = AwareDataSource.objects.create(
+            profile=profile, name='Phone', device_label='standin-1', status='active',
+            device_id=self.labels['standin-1'],
+        )
+        aggregates = ['count', 'mean', 'min', 'max']
+        in_sql = source.aggregate('battery', 6 * 3600000, aggregates)
+        in_pandas = aggregation.aggregate_rows(
+            source.iter_data('battery', page_size=700), 6 * 3600000, aggregates, page_size=300,
+        )
+        self.assertEqual(sum(row['count'] for row in in_sql), self._direct_count('battery', 'standin-1'))
+        self.assertEqual([row['timestamp'] for row in in_sql], [row['timestamp'] for row in in_pandas])
+        for sql_row, pandas_row in zip(in_sql, in_pandas):
+            self.assertEqual(set(sql_row), set(pandas_row))
+            for name, value in sql_row.items():
+                self.assertAlmostEqual(value, pandas_row[name], places=6, msg=name)
+
+    def test_command_links_participants_to_study(self):
+        study = Study.objects.create(title='Load', description='d', config_url='http://example.com')
+        call_command(
+            'build_aware_standin', path=self.path, devices=2, days=0.1, rates='battery=1',
+            link_study=True, stdout=io.StringIO(),
+        )
+        consents = Consent.objects.filter(study=study, is_complete=True, data_source__status='active')
+        self.assertEqual(consents.count(), 2)
+        source = consents.with_real_sources().first().data_source
+        self.assertEqual(source.get_data_types(), ['battery'])
+
+
+class FanOutTest(TestCase):
+    class SlowBackend:
+        pass
+
+    class FastBackend:
+        pass
+
+    def setUp(self):
+        fanout._backend_semaphores.clear()
+        self.addCleanup(fanout._backend_semaphores.clear)
+
+    def test_results_keep_input_order(self):
+        def work(item):
+            time.sleep(0.01 * (5 - item))
+            return item * 10
+
+        results = list(fanout.fan_out(work, range(5), source_of=lambda item: self.FastBackend(), max_workers=5))
+        self.assertEqual(results, [0, 10, 20, 30, 40])
+
+    @override_settings(DATA_SOURCE_CONCURRENCY={'SlowBackend': 2})
+    def test_backend_concurrency_cap(self):
+        lock = threading.Lock()
+        state = {'running': 0, 'peak': 0}
+
+        def work(item):
+            with lock:
+                state['running'] += 1
+                state['peak'] = max(state['peak'], state['running'])
+            time.sleep(0.02)
+            with lock:
+                state['running'] -= 1
+            return item
+
+        results = list(fanout.fan_out(work, range(8), source_of=lambda item: self.SlowBackend(), max_workers=8))
+        self.assertEqual(results, list(range(8)))
+        self.assertEqual(state['peak'], 2)
+
+    def test_single_worker_runs_inline(self):
+        caller = threading.current_thread()
+        threads = list(fanout.fan_out(lambda item: threading.current_thread(), [1, 2], max_workers=1))
+        self.assertEqual(threads, [caller, caller])
+
+    def test_exceptions_propagate(self):
+        def work(item):
+            raise RuntimeError('backend down')
+
+        with self.assertRaises(RuntimeError):
+            list(fanout.fan_out(work, [1, 2, 3], source_of=lambda item: self.FastBackend(), max_workers=3))
+
+    def test_worker_connections_are_closed_after_each_call(self):
+        closed = []
+
+        def work(item):
+            if item == 2:
+                raise RuntimeError('backend down')
+            return item
+
+        with patch.object(fanout.connections, 'close_all', side_effect=lambda: closed.append(threading.current_thread())):
+            with self.assertRaises(RuntimeError):
+                list(fanout.fan_out(work, [1, 2], source_of=lambda item: self.FastBackend(), max_workers=2))
+        self.assertEqual(len(closed), 2)
+        self.assertNotIn(threading.current_thread(), closed)
+
+
 class DataSourcesViewsTest(TestCase):
     def setUp(self):
         # Create a test user and profile
@@ -252,6 +969,35 @@ class DataSourcesViewsTest(TestCase):
         # Verify the source still exists
         self.assertTrue(AwareDataSource.objects.filter(id=self.source.id).exists())
 
+    @patch.object(AwareDataSource, 'count_rows', return_value=250)
+    @patch.object(AwareDataSource, 'get_data_types', return_value=['battery'])
+    def test_view_data_source_fetches_only_current_page(self, mock_types, mock_count):
+        rows = [{'timestamp': i, 'value': i} for i in range(100)]
+        with patch.object(AwareDataSource, 'fetch_data', return_value=rows) as mock_fetch:
+            response = self.client.get(
+                reverse('view_data_source', args=[self.source.id]),
+                {'data_type': 'battery', 'start_date': '2024-01-01', 'end_date': '2024-01-02', 'page': 2},
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['page_obj'].number, 2)
+        self.assertEqual(response.context['page_obj'].paginator.num_pages, 3)
+        mock_fetch.assert_called_once()
+        self.assertEqual(mock_fetch.call_args.kwargs['limit'], 100)
+        self.assertEqual(mock_fetch.call_args.kwargs['offset'], 100)
+        mock_count.assert_called_once()
+
+    @patch.object(AwareDataSource, 'count_rows', return_value=0)
+    @patch.object(AwareDataSource, 'get_data_types', return_value=['battery'])
+    def test_view_data_source_empty_does_not_fetch(self, mock_types, mock_count):
+        with patch.object(AwareDataSource, 'fetch_data') as mock_fetch:
+            response = self.client.get(
+                reverse('view_data_source', args=[self.source.id]),
+                {'data_type': 'battery', 'start_date': '2024-01-01', 'end_date': '2024-01-02'},
+            )
+        self.assertIsNone(response.context['page_obj'])
+        self.assertContains(response, 'No data found')
+        mock_fetch.assert_not_called()
+
         
 
 class DataSourceModelTest(TestCase):
@@ -300,6 +1046,210 @@ class AwareDataSourceTest(TestCase):
             src2.save()
 
 
+class ProcessDataSourcesTaskTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        user = User.objects.create_user(username='taskuser', password='testpass')
+        self.profile = Profile.objects.create(user=user)
+        self.study = Study.objects.create(title='S', description='d', config_url='http://example.com')
+
+    def _source(self, model, consent=True, revoked=False, **kwargs):
+        source = model.objects.create(profile=self.profile, name=model.__name__, **kwargs)
+        if consent:
+            Consent.objects.create(
+                participant=self.profile, study=self.study, data_source=source,
+                source_type=model.__name__, is_complete=True, consent_date=timezone.now(),
+                revocation_date=timezone.now() if revoked else None,
+            )
+        return source
+
+    def test_sources_to_process_selects_pending_consented_sources(self):
+        due = self._source(GooglePortabilityDataSource, donation_id=1)
+        aware = self._source(AwareDataSource, device_label='phone')
+        self._source(GooglePortabilityDataSource, donation_id=2, status='active')
+        self._source(TikTokPortabilityDataSource, donation_id=3, consent=False)
+        self._source(TikTokPortabilityDataSource, donation_id=4, revoked=True)
+        with self.assertNumQueries(1):
+            selected = tasks.sources_to_process()
+        self.assertEqual(selected, [(due.pk, 'GooglePortabilityDataSource'), (aware.pk, 'AwareDataSource')])
+
+    @override_settings(DATA_SOURCE_QUEUES={'AwareDataSource': 'aware'})
+    @patch('data_sources.tasks.process_data_source_batch.apply_async')
+    @patch('data_sources.tasks.process_data_source.apply_async')
+    def test_dispatch_enqueues_one_task_per_source(self, mock_apply, mock_batch):
+        first = self._source(AwareDataSource, device_label='phone-1')
+        second = self._source(AwareDataSource, device_label='phone-2')
+        tasks.process_data_sources()
+        mock_apply.assert_any_call(args=[first.pk], queue='aware')
+        mock_apply.assert_any_call(args=[second.pk], queue='aware')
+        self.assertEqual(mock_apply.call_count, 2)
+        mock_batch.assert_not_called()
+
+    @override_settings(DATA_SOURCE_QUEUES={'GooglePortabilityDataSource': 'portability'},
+                       DATA_SOURCE_POLL_BATCH_SIZES={'GooglePortabilityDataSource': 2,
+                                                     'TikTokPortabilityDataSource': 2})
+    @patch('data_sources.tasks.process_data_source_batch.apply_async')
+    @patch('data_sources.tasks.process_data_source.apply_async')
+    def test_dispatch_batches_portability_sources(self, mock_apply, mock_batch):
+        google = [self._source(GooglePortabilityDataSource, donation_id=n) for n in range(1, 4)]
+        tiktok = self._source(TikTokPortabilityDataSource, donation_id=9)
+        tasks.process_data_sources()
+        mock_apply.assert_not_called()
+        self.assertEqual(mock_batch.call_args_list, [
+            call(args=['GooglePortabilityDataSource', [google[0].pk, google[1].pk]], queue='portability'),
+            call(args=['GooglePortabilityDataSource', [google[2].pk]], queue='portability'),
+            call(args=['TikTokPortabilityDataSource', [tiktok.pk]], queue='celery'),
+        ])
+
+    @patch('data_sources.models.portability_client.get_data', return_value={'data_types': ['posts']})
+    @patch('data_sources.models.portability_client.get_donation_statuses')
+    def test_batch_refreshes_with_one_request(self, mock_statuses, _mock_types):
+        sources = [self._source(TikTokPortabilityDataSource, donation_id=n) for n in (1, 2, 3)]
+        mock_statuses.return_value = {1: 'processed', 2: 'authorized'}
+        # Select the sources, bulk_update the reported ones (three queries
+        # across both tables) and reschedule the rest (two), then store the
+        # data types of the newly processed donation
+        with self.assertNumQueries(7):
+            tasks.process_data_source_batch.apply(args=['TikTokPortabilityDataSource', [s.pk for s in sources]])
+        mock_statuses.assert_called_once_with([1, 2, 3])
+        statuses = dict(TikTokPortabilityDataSource.objects.values_list('donation_id', 'processing_status'))
+        self.assertEqual(statuses, {1: 'processed', 2: 'authorized', 3: 'pending'})
+        processed = TikTokPortabilityDataSource.objects.get(donation_id=1)
+        self.assertIsNone(processed.next_poll_at)
+        self.assertEqual(processed.data_type_status, {'posts': 'available'})
+        self.assertEqual(TikTokPortabilityDataSource.objects.get(donation_id=3).poll_attempts, 1)
+
+    @patch('data_sources.models.portability_client.get_donation_statuses', return_value={})
+    def test_batch_keeps_status_of_unreported_sources(self, _mock):
+        source = self._source(TikTokPortabilityDataSource, donation_id=1)
+        # Updated elsewhere (e.g. by a webhook) after the batch loaded the source
+        stale = TikTokPortabilityDataSource.objects.get(pk=source.pk)
+        TikTokPortabilityDataSource.objects.filter(pk=source.pk).update(
+            status='active', processing_status='processed',
+        )
+        TikTokPortabilityDataSource.poll_many([stale])
+        source.refresh_from_db()
+        self.assertEqual((source.status, source.processing_status), ('active', 'processed'))
+        self.assertEqual(source.poll_attempts, 1)
+
+    @patch('data_sources.models.portability_client.get_donation_statuses', side_effect=Exception('down'))
+    def test_batch_backs_off_when_server_fails(self, _mock):
+        source = self._source(TikTokPortabilityDataSource, donation_id=1)
+        tasks.process_data_source_batch.apply(args=['TikTokPortabilityDataSource', [source.pk]])
+        source.refresh_from_db()
+        self.assertEqual(source.poll_attempts, 1)
+        self.assertIsNone(cache.get(tasks.SOURCE_LOCK_KEY.format(source.pk)))
+
+    @patch('data_sources.tasks.process_data_source.apply_async')
+    def test_dispatch_skips_while_locked(self, mock_apply):
+        self._source(GooglePortabilityDataSource, donation_id=1)
+        cache.add(tasks.DISPATCH_LOCK_KEY, 1, 60)
+        self.assertEqual(tasks.process_data_sources(), "Dispatch already running.")
+        mock_apply.assert_not_called()
+
+    @patch('data_sources.models.portability_client.get_donation_statuses',
+           side_effect=lambda ids: {donation_id: 'processed' for donation_id in ids})
+    def test_process_data_source_polls_one_source(self, mock_get):
+        source = self._source(GooglePortabilityDataSource, donation_id=1)
+        tasks.process_data_source.apply(args=[source.pk])
+        source.refresh_from_db()
+        self.assertEqual(source.status, 'active')
+        self.assertIsNone(source.next_poll_at)
+        self.assertIsNone(cache.get(tasks.SOURCE_LOCK_KEY.format(source.pk)))
+
+    @patch('data_sources.models.portability_client.get_donation_statuses')
+    def test_process_data_source_does_not_overlap(self, mock_get):
+        source = self._source(GooglePortabilityDataSource, donation_id=1)
+        cache.add(tasks.SOURCE_LOCK_KEY.format(source.pk), 1, 60)
+        tasks.process_data_source.apply(args=[source.pk])
+        mock_get.assert_not_called()
+
+    def test_sources_not_due_are_skipped(self):
+        later = self._source(GooglePortabilityDataSource, donation_id=1)
+        finished = self._source(GooglePortabilityDataSource, donation_id=2)
+        GooglePortabilityDataSource.objects.filter(pk=later.pk).update(
+            next_poll_at=timezone.now() + timezone.timedelta(minutes=5))
+        GooglePortabilityDataSource.objects.filter(pk=finished.pk).update(next_poll_at=None)
+        self.assertEqual(tasks.sources_to_process(), [])
+
+    @patch('data_sources.tasks.process_data_source.apply_async')
+    def test_dispatch_leases_sources(self, mock_apply):
+        source = self._source(AwareDataSource, device_label='phone')
+        tasks.process_data_sources()
+        tasks.process_data_sources()
+        self.assertEqual(mock_apply.call_count, 1)
+        source.refresh_from_db()
+        self.assertGreater(source.next_poll_at, timezone.now())
+
+    @override_settings(DATA_SOURCE_POLL_MIN_INTERVAL=60, DATA_SOURCE_POLL_MAX_INTERVAL=300,
+                       DATA_SOURCE_POLL_JITTER=0)
+    @patch('data_sources.models.portability_client.get_donation_statuses',
+           side_effect=lambda ids: {donation_id: 'pending' for donation_id in ids})
+    def test_poll_backs_off_while_waiting(self, mock_get):
+        source = self._source(GooglePortabilityDataSource, donation_id=1)
+        intervals = []
+        for _ in range(4):
+            start = timezone.now()
+            tasks.process_data_source.apply(args=[source.pk])
+            source.refresh_from_db()
+            intervals.append(round((source.next_poll_at - start).total_seconds() / 60))
+        self.assertEqual(intervals, [2, 4, 5, 5])
+        self.assertEqual(source.poll_attempts, 4)
+
+    @override_settings(DATA_SOURCE_POLL_MIN_INTERVAL=60, DATA_SOURCE_POLL_JITTER=0)
+    @patch('data_sources.models.portability_client.get_donation_statuses',
+           side_effect=lambda ids: {donation_id: 'authorized' for donation_id in ids})
+    def test_poll_resets_after_progress(self, mock_get):
+        source = self._source(GooglePortabilityDataSource, donation_id=1)
+        GooglePortabilityDataSource.objects.filter(pk=source.pk).update(poll_attempts=5)
+        start = timezone.now()
+        tasks.process_data_source.apply(args=[source.pk])
+        source.refresh_from_db()
+        self.assertEqual(source.processing_status, 'authorized')
+        self.assertEqual(source.poll_attempts, 0)
+        self.assertEqual(round((source.next_poll_at - start).total_seconds()), 60)
+
+    @patch('data_sources.models.portability_client.get_donation_statuses',
+           side_effect=lambda ids: {donation_id: 'error' for donation_id in ids})
+    def test_poll_stops_in_terminal_state(self, mock_get):
+        source = self._source(GooglePortabilityDataSource, donation_id=1)
+        tasks.process_data_source.apply(args=[source.pk])
+        source.refresh_from_db()
+        self.assertIsNone(source.next_poll_at)
+        self.assertEqual(tasks.sources_to_process(), [])
+
+    def test_poll_now(self):
+        source = self._source(AwareDataSource, device_label='phone')
+        AwareDataSource.objects.filter(pk=source.pk).update(next_poll_at=None, poll_attempts=3)
+        source.poll_now()
+        self.assertEqual(tasks.sources_to_process(), [(source.pk, 'AwareDataSource')])
+
+    def test_completing_consent_polls_source_now(self):
+        source = self._source(GooglePortabilityDataSource, consent=False, donation_id=1)
+        GooglePortabilityDataSource.objects.filter(pk=source.pk).update(
+            next_poll_at=timezone.now() + timezone.timedelta(hours=1), poll_attempts=5)
+        consent = Consent.objects.create(
+            participant=self.profile, study=self.study, source_type='GooglePortabilityDataSource',
+        )
+        link_consent_to_source(consent.id, source, self.profile)
+        self.assertEqual(tasks.sources_to_process(), [(source.pk, 'GooglePortabilityDataSource')])
+
+    @override_settings(DATA_SOURCE_RATE_LIMITS={'GooglePortabilityDataSource': '1/m'})
+    def test_rate_limit_is_per_source_type(self):
+        self.assertEqual(tasks._take_rate_slot('GooglePortabilityDataSource'), 0)
+        self.assertGreater(tasks._take_rate_slot('GooglePortabilityDataSource'), 0)
+        self.assertEqual(tasks._take_rate_slot('AwareDataSource'), 0)
+
+    def test_workers_report_a_process_local_cache(self):
+        locmem = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        with override_settings(CACHES=locmem), self.assertLogs('study_server.celery', 'ERROR'):
+            check_shared_cache()
+        shared = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://'}}
+        with override_settings(CACHES=shared), self.assertNoLogs('study_server.celery', 'ERROR'):
+            check_shared_cache()
+
+
 # Test for JsonUrlDataSource
 class JsonUrlDataSourceTest(TestCase):
     def setUp(self):
@@ -336,6 +1286,8 @@ class JsonUrlDataSourceTest(TestCase):
         # count_rows should call requests and return length
         count = self.source.count_rows('raw_json')
         self.assertEqual(count, 1)
+        # The document is downloaded once and reused for count and pages
+        mock_get.assert_called_once()
 
 
 # Test for GooglePortabilityDataSource
@@ -384,13 +1336,15 @@ class DataSourceTest(TestCase):
 @override_settings(
     PORTABILITY_SERVER_URL='http://test-server',
     PORTABILITY_SERVER_TOKEN='test-token',
+    PORTABILITY_CONNECT_TIMEOUT=5,
+    PORTABILITY_READ_TIMEOUT=30,
 )
 class PortabilityClientTest(TestCase):
     """Unit tests for portability_client — all HTTP calls are patched."""
 
     EXPECTED_HEADERS = {'Authorization': 'Token test-token'}
 
-    @patch('data_sources.models.portability_client.requests.post')
+    @patch('data_sources.models.portability_client.requests.Session.post')
     def test_create_donation_correct_url_headers_payload(self, mock_post):
         mock_response = MagicMock()
         mock_response.json.return_value = {'id': 1, 'token': 'abc', 'status': 'pending'}
@@ -402,12 +1356,12 @@ class PortabilityClientTest(TestCase):
             'http://test-server/api/donations/',
             json={'source_type': 'google_portability'},
             headers=self.EXPECTED_HEADERS,
-            timeout=portability_client.REQUEST_TIMEOUT,
+            timeout=(5, 30),
         )
         mock_response.raise_for_status.assert_called_once()
         self.assertEqual(result, {'id': 1, 'token': 'abc', 'status': 'pending'})
 
-    @patch('data_sources.models.portability_client.requests.post')
+    @patch('data_sources.models.portability_client.requests.Session.post')
     def test_create_donation_with_optional_params(self, mock_post):
         mock_response = MagicMock()
         mock_response.json.return_value = {'id': 2, 'token': 'xyz', 'status': 'pending'}
@@ -428,7 +1382,7 @@ class PortabilityClientTest(TestCase):
         self.assertEqual(sent_payload['requested_data_types'], ['activity', 'posts'])
         self.assertEqual(result, {'id': 2, 'token': 'xyz', 'status': 'pending'})
 
-    @patch('data_sources.models.portability_client.requests.get')
+    @patch('data_sources.models.portability_client.requests.Session.get')
     def test_get_donation_correct_url_and_headers(self, mock_get):
         mock_response = MagicMock()
         mock_response.json.return_value = {'id': 5, 'status': 'processed'}
@@ -439,12 +1393,48 @@ class PortabilityClientTest(TestCase):
         mock_get.assert_called_once_with(
             'http://test-server/api/donations/5/',
             headers=self.EXPECTED_HEADERS,
-            timeout=portability_client.REQUEST_TIMEOUT,
+            timeout=(5, 30),
         )
         mock_response.raise_for_status.assert_called_once()
         self.assertEqual(result, {'id': 5, 'status': 'processed'})
 
-    @patch('data_sources.models.portability_client.requests.get')
+    @patch('data_sources.models.portability_client.requests.Session.get')
+    def test_get_donation_statuses_sends_one_request(self, mock_get):
+        mock_get.return_value.json.return_value = [
+            {'id': 1, 'status': 'processed'}, {'id': 4, 'status': 'authorized'},
+        ]
+
+        result = portability_client.get_donation_statuses([1, 4])
+
+        mock_get.assert_called_once_with(
+            'http://test-server/api/donations/status/',
+            params={'ids': '1,4'},
+            headers=self.EXPECTED_HEADERS,
+            timeout=(5, 30),
+        )
+        self.assertEqual(result, {1: 'processed', 4: 'authorized'})
+
+    @patch('data_sources.models.portability_client.requests.Session.get')
+    def test_get_donation_statuses_falls_back_to_one_request_per_donation(self, mock_get):
+        bulk = MagicMock()
+        bulk.raise_for_status.side_effect = requests.HTTPError('404 Not Found')
+        found = MagicMock()
+        found.json.return_value = {'id': 1, 'status': 'processed'}
+        missing = MagicMock()
+        missing.raise_for_status.side_effect = requests.HTTPError('404 Not Found')
+        mock_get.side_effect = [bulk, found, missing]
+
+        result = portability_client.get_donation_statuses([1, 4])
+
+        self.assertEqual(result, {1: 'processed'})
+        self.assertEqual(
+            [c.args[0] for c in mock_get.call_args_list],
+            ['http://test-server/api/donations/status/',
+             'http://test-server/api/donations/1/',
+             'http://test-server/api/donations/4/'],
+        )
+
+    @patch('data_sources.models.portability_client.requests.Session.get')
     def test_get_data_correct_url_headers_and_params_forwarded(self, mock_get):
         mock_response = MagicMock()
         mock_response.json.return_value = {'data': [{'row': 1}], 'count': 1}
@@ -469,12 +1459,18 @@ class PortabilityClientTest(TestCase):
                 'offset': 10,
             },
             headers=self.EXPECTED_HEADERS,
-            timeout=portability_client.REQUEST_TIMEOUT,
+            timeout=(5, 30),
         )
         mock_response.raise_for_status.assert_called_once()
         self.assertEqual(result, {'data': [{'row': 1}], 'count': 1})
 
-    @patch('data_sources.models.portability_client.requests.delete')
+    @patch('data_sources.models.portability_client.requests.Session.get')
+    def test_get_data_forwards_zero_limit(self, mock_get):
+        mock_get.return_value.json.return_value = {'data': [], 'count': 12}
+        portability_client.get_data(7, data_type='activity', limit=0)
+        self.assertEqual(mock_get.call_args.kwargs['params'], {'data_type': 'activity', 'limit': 0})
+
+    @patch('data_sources.models.portability_client.requests.Session.delete')
     def test_delete_donation_correct_url_and_calls_raise_for_status(self, mock_delete):
         mock_response = MagicMock()
         mock_delete.return_value = mock_response
@@ -484,11 +1480,11 @@ class PortabilityClientTest(TestCase):
         mock_delete.assert_called_once_with(
             'http://test-server/api/donations/3/',
             headers=self.EXPECTED_HEADERS,
-            timeout=portability_client.REQUEST_TIMEOUT,
+            timeout=(5, 30),
         )
         mock_response.raise_for_status.assert_called_once()
 
-    @patch('data_sources.models.portability_client.requests.get')
+    @patch('data_sources.models.portability_client.requests.Session.get')
     def test_get_donation_propagates_http_error(self, mock_get):
         mock_response = MagicMock()
         mock_response.raise_for_status.side_effect = requests.HTTPError('404 Not Found')
@@ -497,7 +1493,7 @@ class PortabilityClientTest(TestCase):
         with self.assertRaises(requests.HTTPError):
             portability_client.get_donation(99)
 
-    @patch('data_sources.models.portability_client.requests.post')
+    @patch('data_sources.models.portability_client.requests.Session.post')
     def test_create_donation_propagates_http_error(self, mock_post):
         mock_response = MagicMock()
         mock_response.raise_for_status.side_effect = requests.HTTPError('500 Server Error')
@@ -507,6 +1503,159 @@ class PortabilityClientTest(TestCase):
             portability_client.create_donation('google_portability')
 
 
+class PortabilityIterDataTest(TestCase):
+    @patch('data_sources.models.portability_client.get_data')
+    def test_next_page_is_prefetched(self, mock_get_data):
+        requested = []
+        second_page_requested = threading.Event()
+
+        def get_data(donation_id, **kwargs):
+            requested.append(kwargs['offset'])
+            if kwargs['offset'] == 2:
+                second_page_requested.set()
+            return {'data': [{'n': kwargs['offset']}] * (2 if kwargs['offset'] < 4 else 1)}
+
+        mock_get_data.side_effect = get_data
+        rows = portability_client.iter_data(3, data_type='activity', page_size=2)
+        next(rows)
+        # The second page is fetched while the first is still being consumed
+        self.assertTrue(second_page_requested.wait(5))
+        self.assertEqual(len(list(rows)), 4)
+        self.assertEqual(requested, [0, 2, 4])
+
+    @patch('data_sources.models.portability_client.get_data')
+    def test_stops_on_empty_page(self, mock_get_data):
+        mock_get_data.side_effect = [{'data': [{'n': 1}, {'n': 2}]}, {'data': []}]
+        self.assertEqual(len(list(portability_client.iter_data(3, page_size=2))), 2)
+        self.assertEqual(mock_get_data.call_count, 2)
+
+
+class _DonationHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    statuses = []
+
+    def do_GET(self):
+        status = self.statuses.pop(0) if self.statuses else 200
+        body = json.dumps({'id': 1, 'status': 'processed'}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_POST = do_GET
+
+    def log_message(self, *args):
+        pass
+
+
+class PortabilitySessionTest(TestCase):
+    """Runs the client against a local keep-alive HTTP server."""
+
+    def setUp(self):
+        _DonationHandler.statuses = []
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _DonationHandler)
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        portability_client.close_session()
+        self.addCleanup(portability_client.close_session)
+        settings_override = override_settings(
+            PORTABILITY_SERVER_URL=f'http://127.0.0.1:{self.server.server_port}',
+            PORTABILITY_RETRY_BACKOFF=0,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_connection_is_reused(self):
+        for _ in range(3):
+            portability_client.get_donation(1)
+        stats = portability_client.pool_stats()
+        self.assertEqual(list(stats.values()), [{'connections': 1, 'requests': 3}])
+
+    def test_status_poll_logs_pool_stats(self):
+        _DonationHandler.statuses = [404]
+        with self.assertLogs('data_sources.models.portability_client', 'DEBUG') as logs:
+            self.assertEqual(portability_client.get_donation_statuses([1]), {1: 'processed'})
+        self.assertIn("{'connections': 1, 'requests': 2}", logs.output[-1])
+
+    def test_idempotent_request_is_retried(self):
+        _DonationHandler.statuses = [503, 502]
+        self.assertEqual(portability_client.get_donation(1)['status'], 'processed')
+        self.assertEqual(_DonationHandler.statuses, [])
+
+    def test_post_is_not_retried(self):
+        _DonationHandler.statuses = [503]
+        with self.assertRaises(requests.HTTPError):
+            portability_client.create_donation('google_portability')
+
+    def test_session_is_rebuilt_after_fork(self):
+        session = portability_client.get_session()
+        self.assertIs(portability_client.get_session(), session)
+        with patch('data_sources.models.portability_client.os.getpid', return_value=-1):
+            self.assertIsNot(portability_client.get_session(), session)
+
+
+@override_settings(PORTABILITY_WEBHOOK_SECRET='hook-secret', PORTABILITY_WEBHOOK_POLL_INTERVAL=1800,
+                   DATA_SOURCE_POLL_JITTER=0)
+class PortabilityWebhookTest(TestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='hookuser', password='testpass')
+        profile = Profile.objects.create(user=user)
+        self.source = TikTokPortabilityDataSource.objects.create(
+            profile=profile, name='TikTok', donation_id=12, processing_status='pending')
+        self.url = reverse('portability_webhook')
+
+    def _post(self, payload, timestamp=None, secret='hook-secret'):
+        body = json.dumps(payload).encode()
+        timestamp = timestamp or int(time.time())
+        return self.client.post(
+            self.url, data=body, content_type='application/json',
+            HTTP_X_PORTABILITY_TIMESTAMP=str(timestamp),
+            HTTP_X_PORTABILITY_SIGNATURE=portability_client.sign_webhook(body, timestamp, secret),
+        )
+
+    def test_status_change_is_applied(self):
+        response = self._post({'donation_id': 12, 'status': 'authorized', 'source_type': 'tiktok_portability'})
+        self.assertEqual(response.status_code, 200)
+        self.source.refresh_from_db()
+        self.assertEqual(self.source.processing_status, 'authorized')
+        self.assertEqual(self.source.status, 'processing')
+        # Polling continues only as a slow fallback
+        self.assertAlmostEqual((self.source.next_poll_at - timezone.now()).total_seconds(), 1800, delta=5)
+
+    @patch('data_sources.models.portability_client.get_data', return_value={'data_types': ['posts']})
+    def test_processed_stops_polling_and_caches_types(self, _mock):
+        self._post({'donation_id': 12, 'status': 'processed'})
+        self.source.refresh_from_db()
+        self.assertEqual(self.source.status, 'active')
+        self.assertIsNone(self.source.next_poll_at)
+        self.assertEqual(self.source.data_type_status, {'posts': 'available'})
+
+    def test_bad_signature_is_rejected(self):
+        response = self._post({'donation_id': 12, 'status': 'processed'}, secret='wrong')
+        self.assertEqual(response.status_code, 403)
+        self.source.refresh_from_db()
+        self.assertEqual(self.source.processing_status, 'pending')
+
+    def test_stale_callback_is_rejected(self):
+        response = self._post({'donation_id': 12, 'status': 'processed'}, timestamp=int(time.time()) - 3600)
+        self.assertEqual(response.status_code, 403)
+
+    @override_settings(PORTABILITY_WEBHOOK_SECRET='')
+    def test_disabled_without_secret(self):
+        response = self._post({'donation_id': 12, 'status': 'processed'}, secret='anything')
+        self.assertEqual(response.status_code, 403)
+
+    def test_unknown_donation_and_bad_payload(self):
+        self.assertEqual(self._post({'donation_id': 99, 'status': 'processed'}).status_code, 404)
+        self.assertEqual(self._post({'status': 'processed'}).status_code, 400)
+
+    def test_get_not_allowed(self):
+        self.assertEqual(self.client.get(self.url).status_code, 405)
+
+
 # ---------------------------------------------------------------------------
 # Shared mixin for Google / TikTok portability model tests
 # ---------------------------------------------------------------------------
@@ -540,9 +1689,13 @@ class PortabilityModelTestMixin:
         token = uuid.uuid4()
         mock_create.return_value = {'id': 1, 'token': str(token)}
         source = self._make_source()
+        self.model_class.objects.filter(pk=source.pk).update(next_poll_at=None, poll_attempts=4)
         url = source.get_setup_url()
         mock_create.assert_called_once()
         self.assertEqual(url, f'http://portability/donate/{token}/')
+        source.refresh_from_db()
+        self.assertEqual(source.poll_attempts, 0)
+        self.assertLessEqual(source.next_poll_at, timezone.now())
 
     # -- get_data_types ------------------------------------------------------
 
@@ -553,9 +1706,37 @@ class PortabilityModelTestMixin:
 
         result = source.get_data_types()
 
-        mock_get_data.assert_called_once_with(42)
+        mock_get_data.assert_called_once_with(42, limit=0)
         self.assertEqual(result, ['activity', 'posts'])
 
+    @patch('data_sources.models.portability_client.get_data')
+    def test_get_data_types_cached_once_processed(self, mock_get_data):
+        mock_get_data.return_value = {'data_types': ['activity']}
+        source = self._make_source(donation_id=42, processing_status='processed')
+
+        self.assertEqual(source.get_data_types(), ['activity'])
+        self.assertEqual(self.model_class.objects.get(pk=source.pk).get_data_types(), ['activity'])
+        mock_get_data.assert_called_once_with(42, limit=0)
+
+    @patch('data_sources.models.portability_client.get_data')
+    def test_get_data_types_not_cached_while_processing(self, mock_get_data):
+        mock_get_data.return_value = {'data_types': ['activity']}
+        source = self._make_source(donation_id=42, processing_status='processing')
+        source.get_data_types()
+        source.get_data_types()
+        self.assertEqual(mock_get_data.call_count, 2)
+        self.assertEqual(source.data_type_status, {})
+
+    @patch('data_sources.models.portability_client.get_data', return_value={'data_types': ['posts']})
+    @patch('data_sources.models.portability_client.get_donation', return_value={'status': 'processed'})
+    def test_poll_refreshes_data_types_on_status_change(self, _mock_donation, mock_get_data):
+        source = self._make_source(donation_id=42, processing_status='processing',
+                                   data_type_status={'stale': 'available'})
+        source._process_data()
+        source.refresh_from_db()
+        self.assertEqual(source.data_type_status, {'posts': 'available'})
+        mock_get_data.assert_called_once_with(42, limit=0)
+
     def test_get_data_types_without_donation_id_returns_empty(self):
         source = self._make_source(donation_id=None)
         self.assertEqual(source.get_data_types(), [])
@@ -586,6 +1767,44 @@ class PortabilityModelTestMixin:
         )
         self.assertEqual(result, rows)
 
+    @patch('data_sources.models.portability_client.get_data')
+    def test_iter_data_walks_every_page(self, mock_get_data):
+        pages = {0: [{'row': 1}, {'row': 2}], 2: [{'row': 3}, {'row': 4}], 4: [{'row': 5}]}
+        mock_get_data.side_effect = lambda donation_id, **kw: {'data': pages[kw['offset']]}
+        source = self._make_source(donation_id=7)
+
+        rows = list(source.iter_data('activity', start_date='2024-01-01', page_size=2))
+
+        self.assertEqual([row['row'] for row in rows], [1, 2, 3, 4, 5])
+        self.assertEqual([c.kwargs['offset'] for c in mock_get_data.call_args_list], [0, 2, 4])
+        self.assertEqual(mock_get_data.call_args.kwargs['start_date'], '2024-01-01')
+
+    @patch('data_sources.models.portability_client.get_data', side_effect=Exception('boom'))
+    def test_iter_data_exception_propagates(self, _mock):
+        source = self._make_source(donation_id=7)
+        with self.assertRaisesMessage(Exception, 'boom'):
+            list(source.iter_data('activity'))
+
+    # -- sync ----------------------------------------------------------------
+
+    @patch('data_sources.models.portability_client.get_data')
+    def test_sync_sends_a_processed_donation_once(self, mock_get_data):
+        mock_get_data.return_value = {'data': [{'row': 1}]}
+        processed = self._make_source(donation_id=7, processing_status='processed')
+        pending = self._make_source(donation_id=8, processing_status='processing')
+        self.assertEqual(self.model_class.sync_watermarks([processed, pending], 'activity'), [7, None])
+
+        self.assertEqual(list(processed.iter_changes('activity', since=None, until=7)), [{'row': 1}])
+        self.assertEqual(list(processed.iter_changes('activity', since=7, until=7)), [])
+        # A new donation is sent in full
+        self.assertEqual(list(processed.iter_changes('activity', since=6, until=7)), [{'row': 1}])
+
+    @patch('data_sources.models.portability_client.get_data', side_effect=Exception('boom'))
+    def test_sync_errors_propagate(self, _mock):
+        source = self._make_source(donation_id=7, processing_status='processed')
+        with self.assertRaises(Exception):
+            list(source.iter_changes('activity', since=None, until=7))
+
     def test_fetch_data_without_donation_id_returns_empty(self):
         source = self._make_source(donation_id=None)
         self.assertEqual(source.fetch_data('activity'), [])
@@ -792,3 +2011,32 @@ class PortabilityViewDeleteTest(TestCase):
             TikTokPortabilityDataSource.objects.filter(id=source.id).exists()
         )
 
+
+class AggregationTest(TestCase):
+    def test_parse_bucket_and_aggregates(self):
+        self.assertEqual(aggregation.parse_bucket('15m'), 900000)
+        self.assertEqual(aggregation.parse_bucket('1d'), 86400000)
+        for value in ('', '0h', '1w', 'h', '1.5h'):
+            with self.assertRaises(ValueError):
+                aggregation.parse_bucket(value)
+        self.assertEqual(aggregation.parse_aggregates(None), ['count', 'mean', 'min', 'max'])
+        self.assertEqual(aggregation.parse_aggregates('max,count,max'), ['max', 'count'])
+        with self.assertRaises(ValueError):
+            aggregation.parse_aggregates('count,median')
+
+    def test_pages_are_merged(self):
+        rows = [{'timestamp': n * 60000, '_id': n, 'level': n, 'label': 'x'} for n in range(130)]
+        rows.append({'timestamp': '1970-01-01T00:10:00Z', 'level': 1000})
+        rows.append({'timestamp': None, 'level': 5})
+        result = aggregation.aggregate_rows(iter(rows), 3600000, ['count', 'mean', 'max', 'sum'], page_size=50)
+        self.assertEqual([row['timestamp'] for row in result], [0, 3600000, 7200000])
+        self.assertEqual([row['count'] for row in result], [61, 60, 10])
+        self.assertEqual(result[0]['level_max'], 1000)
+        self.assertEqual(result[1]['level_sum'], sum(range(60, 120)))
+        self.assertAlmostEqual(result[2]['level_mean'], 124.5)
+        self.assertNotIn('label_mean', result[0])
+        self.assertNotIn('_id_mean', result[0])
+
+    def test_rows_without_timestamps_give_nothing(self):
+        self.assertEqual(aggregation.aggregate_rows(iter([{'value': 1}]), 1000, ['count']), [])
+        self.assertEqual(aggregation.aggregate_rows(iter([]), 1000, ['count']), [])
@@ -14,4 +14,5 @@ urlpatterns = [
 
     path('oauth/start/<int:source_id>/', views.auth_start, name='auth_start'),
     path('oauth/callback/', views.auth_callback, name='auth_callback'),
+    path('portability/webhook/', views.portability_webhook, name='portability_webhook'),
 ]
@@ -1,7 +1,8 @@
 from django.apps import apps
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import Http404
+from django.http import Http404, JsonResponse
 from django.contrib.auth.decorators import login_required
+from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
 from django.core.paginator import Paginator
 from django.contrib import messages
@@ -10,12 +11,18 @@ from urllib.parse import urlencode
 from . import forms
 from .forms import JsonUrlDataSourceForm, AwareDataSourceForm, DataFilterForm
 from .models import DataSource, AwareDataSource, JsonUrlDataSource
+from .models import GooglePortabilityDataSource, TikTokPortabilityDataSource
+from .models import db_connector, portability_client
 from studies.models import Consent
 from datetime import date, datetime, time, timedelta
+import json
+import logging
 import zoneinfo
 
 from urllib.parse import urlencode
 
+logger = logging.getLogger(__name__)
+
 
 def form_has_only_name_field(form):
     fields = list(form.fields.keys())
@@ -45,6 +52,9 @@ def link_consent_to_source(consent_id, data_source, profile):
         source_start, _ = consent.study.get_source_dates(consent.source_type)
         consent.data_start = source_start or consent.consent_date
         consent.save()
+        # Sources are only polled while consented; pick this one up right away
+        if not data_source.is_poll_finished():
+            data_source.poll_now()
 
 
 @login_required
@@ -167,7 +177,51 @@ def delete_data_source(request, source_id):
     return redirect('dashboard')
 
 
+class SourceRows:
+    """A lazily evaluated list of a source's rows for use with Paginator.
+
+    The paginator only asks for the row count and the slice it displays, so
+    only the current page is fetched from the source.
+    """
+
+    def __init__(self, source, data_type, start_date, end_date):
+        self.source = source
+        self.data_type = data_type
+        self.start_date = start_date
+        self.end_date = end_date
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            self._count = self.source.count_rows(
+                data_type=self.data_type,
+                start_date=self.start_date,
+                end_date=self.end_date,
+            )
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            raise TypeError("SourceRows only supports slicing")
+        start = key.start or 0
+        stop = key.stop if key.stop is not None else self.count()
+        if stop <= start:
+            return []
+        rows = self.source.fetch_data(
+            data_type=self.data_type,
+            limit=stop - start,
+            start_date=self.start_date,
+            end_date=self.end_date,
+            offset=start,
+        )
+        return rows if isinstance(rows, list) else []
+
+
 @login_required
+@db_connector.reuse_connection()
 def view_data_source(request, source_id):
     source = get_object_or_404(DataSource, id=source_id, profile=request.user.profile)
     real_instance = source.get_real_instance()
@@ -190,18 +244,14 @@ def view_data_source(request, source_id):
             tz = zoneinfo.ZoneInfo('Europe/Helsinki')
             start_datetime = datetime.combine(start_date, time.min, tzinfo=tz) if start_date else None
             end_datetime = datetime.combine(end_date, time.max, tzinfo=tz) if end_date else None
-            all_data = real_instance.fetch_data(
-                data_type=selected_type, 
-                start_date=start_datetime,
-                end_date=end_datetime
-            )
+            rows = SourceRows(real_instance, selected_type, start_datetime, end_datetime)
+            paginator = Paginator(rows, 100)
+            page_number = request.GET.get('page')
+            page = paginator.get_page(page_number)
 
-            if all_data:
-                headers = all_data[0].keys()
-                
-                paginator = Paginator(all_data, 100)
-                page_number = request.GET.get('page')
-                page_obj = paginator.get_page(page_number)
+            if page.object_list:
+                headers = page.object_list[0].keys()
+                page_obj = page
 
     context = {
         'source': real_instance,
@@ -318,11 +368,58 @@ def auth_callback(request):
         profile=request.user.profile,
         oauth_state=state
     ).first()
-    real_source = source.get_real_instance()
+    real_source = source.get_real_instance() if source else None
 
     if real_source:
         success, message = real_source.handle_auth_callback(request)
+        if success:
+            real_source.poll_now()
 
 
     return redirect('dashboard')
 
+
+
+PORTABILITY_SOURCE_MODELS = {
+    model.PORTABILITY_SOURCE_TYPE: model
+    for model in (GooglePortabilityDataSource, TikTokPortabilityDataSource)
+}
+
+
+@csrf_exempt
+@require_POST
+def portability_webhook(request):
+    """Donation status callback from portability-server.
+
+    The body is JSON {"donation_id": ..., "status": ..., "source_type": ...},
+    signed as described in portability_client.sign_webhook. Polling still runs
+    as a slow fallback in case a callback is lost.
+    """
+    if not portability_client.verify_webhook(
+        request.body,
+        request.headers.get(portability_client.WEBHOOK_TIMESTAMP_HEADER),
+        request.headers.get(portability_client.WEBHOOK_SIGNATURE_HEADER),
+    ):
+        return JsonResponse({'error': 'Invalid signature.'}, status=403)
+    try:
+        payload = json.loads(request.body)
+        donation_id = int(payload['donation_id'])
+        remote_status = payload['status']
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse({'error': 'Expected donation_id and status.'}, status=400)
+
+    model = PORTABILITY_SOURCE_MODELS.get(payload.get('source_type'))
+    candidates = [model] if model else PORTABILITY_SOURCE_MODELS.values()
+    sources = [source for model in candidates for source in model.objects.filter(donation_id=donation_id)]
+    if not sources:
+        return JsonResponse({'error': 'Unknown donation.'}, status=404)
+
+    for source in sources:
+        before = source.poll_state()
+        try:
+            source.apply_remote_status(remote_status)
+        except Exception as e:
+            # The status is saved; data types are filled in by the next poll
+            logger.warning("Failed to refresh data types for donation %s: %s", donation_id, e)
+        source.schedule_next_poll(progressed=source.poll_state() != before)
+    return JsonResponse({'updated': len(sources)})
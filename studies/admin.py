@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.utils.html import format_html
 from django.urls import reverse
-from .models import Study, Consent, StudyParticipant
+from .models import Study, Consent, ExportJob, StudyParticipant
 from .forms import StudyAdminForm
 
 @admin.register(StudyParticipant)
@@ -39,7 +39,9 @@ class ConsentAdmin(admin.ModelAdmin):
     )
 
     def get_queryset(self, request):
-        qs = super().get_queryset(request)
+        qs = super().get_queryset(request).select_related(
+            'participant__user', 'study', 'study_participant',
+        ).with_real_sources()
         if request.user.is_superuser:
             return qs
         
@@ -65,7 +67,7 @@ class ConsentAdmin(admin.ModelAdmin):
     def data_source_status(self, obj):
         if not obj.data_source:
             return "Not linked"
-        source = obj.data_source.get_real_instance()
+        source = obj.data_source
         return f"{source.name} ({source.status})"
 
 
@@ -92,6 +94,11 @@ class ConsentInline(admin.TabularInline):
     can_delete = False
     extra = 0
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(
+            'participant__user', 'study', 'study_participant',
+        ).with_real_sources()
+
     @admin.display(description='Participant')
     def participant_username(self, obj):
         return obj.participant.user.username
@@ -106,7 +113,7 @@ class ConsentInline(admin.TabularInline):
     def data_source_info(self, obj):
         if not obj.data_source:
             return "Not linked"
-        source = obj.data_source.get_real_instance()
+        source = obj.data_source
         status_color = 'green' if source.status == 'active' else 'orange'
         return format_html(
             '<span style="color: {};">{}</span> ({})',
@@ -151,3 +158,17 @@ class StudyAdmin(admin.ModelAdmin):
         if not change:
             obj.researchers.add(request.user.profile)
 
+
+
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'status', 'format', 'requested_by', 'rows_written', 'file_size', 'created_at')
+    list_filter = ('status', 'format')
+    list_select_related = ('requested_by__user',)
+
+    def has_add_permission(self, request):
+        # Jobs are created through the export API
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,156 @@
+"""Participant data coverage: rows per participant, data type and UTC day.
+
+build_study_coverage() asks each consented data source for its daily row
+counts over the last COVERAGE_DAYS days, limited to what the consent covers,
+and stores them as CoverageCell rows; coverage_matrix() turns the stored
+cells into the heatmap shown on the researcher dashboard.
+"""
+import logging
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max, Subquery, Value
+from django.utils import timezone
+
+from .models import Consent, CoverageCell
+from .rows import consent_interval
+
+logger = logging.getLogger(__name__)
+
+
+def _window(today=None):
+    today = today or timezone.now().date()
+    return today - timedelta(days=settings.COVERAGE_DAYS - 1), today
+
+
+def _day_bounds(day):
+    start = datetime.combine(day, time.min, tzinfo=dt_timezone.utc)
+    return start, start + timedelta(days=1) - timedelta(milliseconds=1)
+
+
+def _consent_coverage(source, data_type, start, end, now):
+    """Rows per UTC day of one source between start and end (inclusive).
+
+    Whole days come from daily_coverage(); a day the consent only partly
+    covers is counted again for the covered part.
+    """
+    first_day = start.astimezone(dt_timezone.utc).date()
+    last_day = end.astimezone(dt_timezone.utc).date()
+    coverage = source.daily_coverage(data_type, first_day, last_day)
+    for day in {first_day, last_day}:
+        day_start, day_end = _day_bounds(day)
+        covered_start, covered_end = max(start, day_start), min(end, day_end)
+        # Nothing has a timestamp after now, so a day covered up to now counts as whole
+        if covered_start > day_start or covered_end < min(day_end, now):
+            row_count = source.count_rows(data_type=data_type, start_date=covered_start, end_date=covered_end)
+            coverage.pop(day, None)
+            if row_count:
+                coverage[day] = (row_count, None)
+    return coverage
+
+
+def build_study_coverage(study, today=None):
+    """Recompute the coverage cells of a study. Returns the number of cells stored.
+
+    A (participant, source, data type) whose row count over the window still
+    matches its stored cells keeps them; only the others are counted per day.
+    """
+    first_day, last_day = _window(today)
+    window_start, window_end = _day_bounds(first_day)[0], _day_bounds(last_day)[1]
+    consents = (
+        Consent.objects.filter(
+            study=study,
+            revocation_date__isnull=True,
+            is_complete=True,
+            data_source__isnull=False,
+            study_participant__isnull=False,
+        )
+        .select_related('study_participant')
+        .with_real_sources()
+        .order_by('id')
+    )
+    stored = {}
+    for cell in CoverageCell.objects.filter(study=study, day__gte=first_day, day__lte=last_day):
+        key = (cell.study_participant_id, cell.source_type, cell.data_type)
+        stored.setdefault(key, {})[cell.day] = (cell.row_count, cell.last_timestamp)
+    computed_at = timezone.now()
+    cells = []
+    for consent in consents:
+        source = consent.data_source
+        source_type = type(source).__name__
+        interval = consent_interval(study, consent, window_start, window_end)
+        if interval is None or interval[0] > interval[1]:
+            continue
+        start, end = interval
+        try:
+            for data_type in source.get_data_types():
+                coverage = stored.get((consent.study_participant_id, source_type, data_type), {})
+                row_count = source.count_rows(data_type=data_type, start_date=start, end_date=end)
+                if row_count != sum(day_count for day_count, _ in coverage.values()):
+                    coverage = _consent_coverage(source, data_type, start, end, computed_at)
+                for day, (row_count, last_timestamp) in coverage.items():
+                    cells.append(CoverageCell(
+                        study=study,
+                        study_participant=consent.study_participant,
+                        source_type=source_type,
+                        data_type=data_type,
+                        day=day,
+                        row_count=row_count,
+                        last_timestamp=last_timestamp,
+                        computed_at=computed_at,
+                    ))
+        except Exception as e:
+            # One unreachable backend should not blank the whole study
+            logger.warning("Failed to compute coverage for consent %s: %s", consent.id, e)
+
+    with transaction.atomic():
+        CoverageCell.objects.filter(study=study).delete()
+        CoverageCell.objects.bulk_create(cells, ignore_conflicts=True)
+    return len(cells)
+
+
+def coverage_matrix(study, days=None, today=None, pseudo_ids=None):
+    """Heatmap of the stored cells for the last `days` days (all stored days by default).
+
+    Returns {'days': [...], 'rows': [{'pseudo_id', 'data_type', 'cells': [...]}],
+    'computed_at'}, where each cell is {'day', 'row_count', 'last_timestamp',
+    'level'} and level (0-4) buckets the count relative to the busiest cell.
+    With `pseudo_ids` only those participants' rows are built (e.g. the
+    current dashboard page); levels stay relative to the busiest cell of the
+    whole study so pages are comparable.
+    """
+    first_day, last_day = _window(today)
+    if days:
+        first_day = max(first_day, last_day - timedelta(days=days - 1))
+    day_list = [first_day + timedelta(days=n) for n in range((last_day - first_day).days + 1)]
+    window = CoverageCell.objects.filter(study=study, day__gte=first_day, day__lte=last_day)
+    cells = window
+    study_peak = Value(0)
+    if pseudo_ids is not None:
+        cells = window.filter(study_participant__pseudo_id__in=list(pseudo_ids))
+        # The busiest cell of the whole study, as a subquery of the same query
+        study_peak = Subquery(window.order_by().values('study').annotate(peak=Max('row_count')).values('peak'))
+    cells = cells.annotate(study_peak=study_peak).values_list(
+        'study_participant__pseudo_id', 'data_type', 'day', 'row_count', 'last_timestamp', 'computed_at',
+        'study_peak',
+    )
+    by_row = {}
+    computed_at = None
+    peak = 0
+    for pseudo_id, data_type, day, row_count, last_timestamp, cell_computed_at, study_peak in cells:
+        by_row.setdefault((str(pseudo_id), data_type), {})[day] = (row_count, last_timestamp)
+        peak = max(peak, row_count, study_peak)
+        computed_at = max(computed_at, cell_computed_at) if computed_at else cell_computed_at
+
+    rows = []
+    for (pseudo_id, data_type), counts in sorted(by_row.items()):
+        row_cells = []
+        for day in day_list:
+            row_count, last_timestamp = counts.get(day, (0, None))
+            level = 0 if not row_count else 1 + min(3, (4 * row_count - 1) // peak)
+            row_cells.append({
+                'day': day, 'row_count': row_count, 'last_timestamp': last_timestamp, 'level': level,
+            })
+        rows.append({'pseudo_id': pseudo_id, 'data_type': data_type, 'cells': row_cells})
+    return {'days': day_list, 'rows': rows, 'computed_at': computed_at}
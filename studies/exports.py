@@ -0,0 +1,231 @@
+"""Background study data exports.
+
+An ExportJob is written by a Celery task to EXPORT_ROOT as a zip archive
+with one NDJSON, CSV, Parquet or Arrow file per data type, so large pulls never run inside
+a web request. Before exporting, the job computes a data version from the
+row counts of every consent it covers; a finished job with the same request
+fingerprint and data version is reused instead of exporting again.
+"""
+import hashlib
+import io
+import json
+import logging
+import os
+import zipfile
+from datetime import datetime, time, timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from data_sources.models import db_connector
+from study_server.utils import COLUMNAR_FORMATS, iter_csv, iter_ndjson
+from .models import Consent, ExportJob
+from .rows import annotate_row, consent_interval, consent_sources
+
+logger = logging.getLogger(__name__)
+
+# Progress and the heartbeat are saved after every part and this many rows
+PROGRESS_ROWS = 1000
+
+# Format -> (file extension, writer). Text writers yield str, columnar ones bytes.
+FORMATS = {
+    'json': ('ndjson', iter_ndjson),
+    'csv': ('csv', iter_csv),
+}
+FORMATS.update({name: (extension, write) for name, (write, _, extension) in COLUMNAR_FORMATS.items()})
+
+
+def fingerprint(study, data_types, start_date, end_date, participants, format):
+    """Identify an export request independently of argument order."""
+    request = {
+        'study': study.id,
+        'data_types': sorted(set(data_types)),
+        'start_date': start_date,
+        'end_date': end_date,
+        'participants': sorted(set(participants)),
+        'format': format,
+    }
+    return hashlib.sha256(json.dumps(request, cls=DjangoJSONEncoder, sort_keys=True).encode()).hexdigest()
+
+
+def _date_range(job):
+    """The job's dates as an inclusive datetime range (None for open ends)."""
+    start = datetime.combine(job.start_date, time.min) if job.start_date else None
+    end = datetime.combine(job.end_date, time.max) if job.end_date else None
+    return (
+        timezone.make_aware(start) if start else None,
+        timezone.make_aware(end) if end else None,
+    )
+
+
+def export_consents(job):
+    consents = Consent.objects.filter(
+        study=job.study,
+        is_complete=True,
+        revocation_date__isnull=True,
+        data_source__status='active',
+    )
+    if job.participants:
+        consents = consents.filter(study_participant__pseudo_id__in=job.participants)
+    return consents.select_related('study_participant').with_real_sources().order_by('id')
+
+
+def _job_parts(job, sources):
+    """[(data_type, consent, source, interval)] for every consent that has the data type."""
+    start_date, end_date = _date_range(job)
+    source_types = [(consent, source, set(source.get_data_types())) for consent, source in sources]
+    data_types = job.data_types or sorted(set().union(*(types for _, _, types in source_types)))
+    parts = []
+    for data_type in data_types:
+        for consent, source, types in source_types:
+            if data_type not in types:
+                continue
+            interval = consent_interval(job.study, consent, start_date, end_date)
+            if interval is not None:
+                parts.append((data_type, consent, source, interval))
+    return data_types, parts
+
+
+def data_version(parts):
+    """Hash of what the export would contain: the row count of every part.
+
+    Open-ended intervals end at the current time, so the end itself is left
+    out; new rows show up in the count instead.
+    """
+    digest = hashlib.sha256()
+    for data_type, consent, source, (start, end) in parts:
+        row_count = source.count_rows(data_type=data_type, start_date=start, end_date=end)
+        digest.update(json.dumps(
+            [data_type, consent.id, start, consent.revocation_date, row_count], cls=DjangoJSONEncoder,
+        ).encode())
+    return digest.hexdigest()
+
+
+def _reusable_job(job):
+    previous = (
+        ExportJob.objects.filter(fingerprint=job.fingerprint, data_version=job.data_version, status='complete')
+        .exclude(pk=job.pk)
+        .order_by('-finished_at')
+    )
+    for candidate in previous:
+        if candidate.file_path and os.path.exists(candidate.file_path):
+            return candidate
+    return None
+
+
+def _save_progress(job, parts_done, rows_written):
+    ExportJob.objects.filter(pk=job.pk).update(
+        parts_done=parts_done, rows_written=rows_written, heartbeat_at=timezone.now(),
+    )
+
+
+def _write_archive(job, path, data_types, parts):
+    ext, write = FORMATS[job.format]
+    binary = job.format in COLUMNAR_FORMATS
+    rows_written = 0
+    parts_done = 0
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for data_type in data_types:
+            type_parts = [part for part in parts if part[0] == data_type]
+            if not type_parts:
+                continue
+
+            def rows():
+                nonlocal rows_written, parts_done
+                for _, consent, source, (start, end) in type_parts:
+                    for row in source.iter_data(data_type=data_type, start_date=start, end_date=end):
+                        rows_written += 1
+                        if rows_written % PROGRESS_ROWS == 0:
+                            _save_progress(job, parts_done, rows_written)
+                        yield annotate_row(row, consent, data_type, clean=not binary)
+                    parts_done += 1
+                    _save_progress(job, parts_done, rows_written)
+
+            member_info = zipfile.ZipInfo(f'{data_type}.{ext}', date_time=timezone.localtime().timetuple()[:6])
+            # Parquet and Arrow are compressed already
+            member_info.compress_type = zipfile.ZIP_STORED if binary else zipfile.ZIP_DEFLATED
+            with archive.open(member_info, 'w', force_zip64=True) as member:
+                if binary:
+                    for chunk in write(rows()):
+                        member.write(chunk)
+                else:
+                    with io.TextIOWrapper(member, encoding='utf-8', newline='') as text:
+                        for line in write(rows()):
+                            text.write(line)
+    return rows_written
+
+
+def run_export(job):
+    """Build (or reuse) the artifact of a pending job."""
+    job.status = 'running'
+    job.started_at = job.heartbeat_at = timezone.now()
+    job.save(update_fields=['status', 'started_at', 'heartbeat_at'])
+    try:
+        with db_connector.reuse_connection():
+            sources = consent_sources(export_consents(job))
+            data_types, parts = _job_parts(job, sources)
+            job.parts_total = len(parts)
+            job.data_version = data_version(parts)
+            job.save(update_fields=['parts_total', 'data_version'])
+
+            previous = _reusable_job(job)
+            if previous is not None:
+                job.reused_from = previous
+                job.file_path = previous.file_path
+                job.file_size = previous.file_size
+                job.rows_written = previous.rows_written
+                job.parts_done = job.parts_total
+            else:
+                os.makedirs(settings.EXPORT_ROOT, exist_ok=True)
+                path = os.path.join(settings.EXPORT_ROOT, f'{job.id}.zip')
+                partial = path + '.partial'
+                try:
+                    job.rows_written = _write_archive(job, partial, data_types, parts)
+                    os.replace(partial, path)
+                finally:
+                    if os.path.exists(partial):
+                        os.remove(partial)
+                job.file_path = path
+                job.file_size = os.path.getsize(path)
+                job.parts_done = job.parts_total
+    except Exception as e:
+        logger.exception("Export %s failed", job.id)
+        job.status = 'failed'
+        job.error = str(e)
+        job.finished_at = timezone.now()
+        job.save(update_fields=['status', 'error', 'finished_at'])
+        return job
+
+    job.status = 'complete'
+    job.finished_at = timezone.now()
+    job.save()
+    return job
+
+
+def fail_stale_jobs(now=None):
+    """Mark pending or running jobs without a recent heartbeat as failed.
+
+    Returns the number of jobs marked.
+    """
+    now = now or timezone.now()
+    cutoff = now - timedelta(seconds=settings.EXPORT_STALE_AFTER)
+    return ExportJob.objects.filter(status__in=['pending', 'running'], heartbeat_at__lt=cutoff).update(
+        status='failed', error='Export stopped responding', finished_at=now,
+    )
+
+
+def expire_exports(now=None):
+    """Delete jobs older than EXPORT_RETENTION_DAYS and artifacts no remaining job uses."""
+    now = now or timezone.now()
+    cutoff = now - timedelta(days=settings.EXPORT_RETENTION_DAYS)
+    expired = ExportJob.objects.filter(created_at__lt=cutoff)
+    paths = set(expired.exclude(file_path='').values_list('file_path', flat=True))
+    deleted, _ = expired.delete()
+    still_used = set(ExportJob.objects.filter(file_path__in=paths).values_list('file_path', flat=True))
+    for path in paths - still_used:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+    return deleted
@@ -0,0 +1,149 @@
+"""Replay concurrent data API traffic against a running server and report latency.
+
+Requests alternate between the researcher's study_data_api and the
+participants' my_data_api (see --mix), each authenticated with the user's
+API token. Pair it with build_aware_standin --link-study to load-test
+against a synthetic AWARE database.
+"""
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.authtoken.models import Token
+
+ENDPOINTS = {
+    'study': '/studies/api/data/',
+    'mine': '/accounts/api/data/',
+}
+PERCENTILES = (50, 90, 95, 99)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers (None if empty)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-pct * len(ordered) // 100))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def parse_mix(value):
+    """'study=3,mine=1' -> {'study': 3, 'mine': 1}"""
+    mix = {}
+    for item in filter(None, value.split(',')):
+        name, _, weight = item.partition('=')
+        if name not in ENDPOINTS:
+            raise CommandError(f"Unknown endpoint '{name}'; choose from {', '.join(ENDPOINTS)}")
+        try:
+            mix[name] = float(weight or 1)
+        except ValueError:
+            raise CommandError(f"Invalid weight for '{name}': '{weight}'")
+    if not mix or not any(mix.values()):
+        raise CommandError('--mix must give at least one endpoint a positive weight.')
+    return mix
+
+
+class Command(BaseCommand):
+    help = 'Replay concurrent study_data_api/my_data_api requests and report throughput and latency.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://localhost:8000', help='Server to load.')
+        parser.add_argument('--requests', type=int, default=200, help='Total number of requests.')
+        parser.add_argument('--concurrency', type=int, default=8, help='Requests in flight.')
+        parser.add_argument('--mix', default='study=1,mine=1', help='Endpoint weights, e.g. "study=3,mine=1".')
+        parser.add_argument('--data-types', default='battery,screen,accelerometer,locations',
+                            help='Data types to request, picked at random.')
+        parser.add_argument('--limit', type=int, default=1000,
+                            help='Page size (limit parameter); 0 requests the full export.')
+        parser.add_argument('--researcher', help='Researcher username (default: the first superuser).')
+        parser.add_argument('--participant-prefix', default='standin',
+                            help='Participants whose username starts with this are used for my_data_api.')
+        parser.add_argument('--timeout', type=float, default=120, help='Per-request timeout in seconds.')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed for the request sequence.')
+
+    def _tokens(self, options, mix):
+        tokens = {}
+        if mix.get('study'):
+            researchers = User.objects.filter(username=options['researcher']) if options['researcher'] \
+                else User.objects.filter(is_superuser=True).order_by('id')[:1]
+            tokens['study'] = [Token.objects.get_or_create(user=user)[0].key for user in researchers]
+            if not tokens['study']:
+                raise CommandError('No researcher found for study_data_api; pass --researcher.')
+        if mix.get('mine'):
+            participants = User.objects.filter(
+                username__startswith=options['participant_prefix'], profile__user_type='participant',
+            ).order_by('id')
+            tokens['mine'] = [Token.objects.get_or_create(user=user)[0].key for user in participants]
+            if not tokens['mine']:
+                raise CommandError(
+                    f"No participants named {options['participant_prefix']}*; "
+                    f"run build_aware_standin --link-study or pass --participant-prefix."
+                )
+        return tokens
+
+    def handle(self, *args, **options):
+        mix = parse_mix(options['mix'])
+        tokens = self._tokens(options, mix)
+        data_types = [name for name in options['data_types'].split(',') if name]
+        if options['requests'] < 1 or options['concurrency'] < 1:
+            raise CommandError('--requests and --concurrency must be positive.')
+
+        rng = random.Random(options['seed'])
+        names = list(mix)
+        plan = []
+        for _ in range(options['requests']):
+            endpoint = rng.choices(names, weights=[mix[name] for name in names])[0]
+            params = {'data_type': rng.choice(data_types)}
+            if options['limit']:
+                params['limit'] = options['limit']
+            plan.append((endpoint, rng.choice(tokens[endpoint]), params))
+
+        local = threading.local()
+        base_url = options['base_url'].rstrip('/')
+
+        def send(item):
+            endpoint, token, params = item
+            session = getattr(local, 'session', None)
+            if session is None:
+                session = local.session = requests.Session()
+            started = time.perf_counter()
+            try:
+                response = session.get(
+                    base_url + ENDPOINTS[endpoint], params=params, timeout=options['timeout'],
+                    headers={'Authorization': f'Token {token}'},
+                )
+                ok = response.status_code < 400
+                size = len(response.content)
+            except requests.RequestException:
+                ok, size = False, 0
+            return endpoint, ok, time.perf_counter() - started, size
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as executor:
+            results = list(executor.map(send, plan))
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            f"{len(results)} requests in {elapsed:.2f}s "
+            f"({len(results) / elapsed:.1f} req/s, concurrency {options['concurrency']})"
+        )
+        for endpoint in names:
+            self._report(endpoint, [result for result in results if result[0] == endpoint])
+        self._report('all', results)
+
+    def _report(self, name, results):
+        if not results:
+            return
+        latencies = [seconds * 1000 for _, ok, seconds, _ in results if ok]
+        errors = sum(1 for _, ok, _, _ in results if not ok)
+        megabytes = sum(size for _, _, _, size in results) / 1e6
+        if latencies:
+            spread = ' '.join(f"p{pct}={percentile(latencies, pct):.0f}ms" for pct in PERCENTILES)
+            spread += f" max={max(latencies):.0f}ms"
+        else:
+            spread = 'no successful requests'
+        self.stdout.write(f"{name:6} n={len(results):<6} errors={errors:<4} {megabytes:8.1f} MB  {spread}")
@@ -0,0 +1,37 @@
+# Generated by Django 4.2 on 2026-10-17 22:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('studies', '0023_remove_data_source_list_fields'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CoverageCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source_type', models.CharField(max_length=100)),
+                ('data_type', models.CharField(max_length=100)),
+                ('day', models.DateField()),
+                ('row_count', models.PositiveIntegerField(default=0)),
+                ('last_timestamp', models.DateTimeField(blank=True, null=True)),
+                ('computed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('study', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='coverage_cells', to='studies.study')),
+                ('study_participant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='coverage_cells', to='studies.studyparticipant')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='coveragecell',
+            index=models.Index(fields=['study', 'day'], name='studies_cov_study_i_a5cb55_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='coveragecell',
+            constraint=models.UniqueConstraint(fields=('study_participant', 'source_type', 'data_type', 'day'), name='unique_coverage_cell'),
+        ),
+    ]
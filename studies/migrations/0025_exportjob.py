@@ -0,0 +1,43 @@
+# Generated by Django 4.2 on 2026-10-17 22:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0001_initial'),
+        ('studies', '0024_coveragecell'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('data_types', models.JSONField(blank=True, default=list, help_text='Empty means all data types')),
+                ('start_date', models.DateField(blank=True, null=True)),
+                ('end_date', models.DateField(blank=True, null=True)),
+                ('participants', models.JSONField(blank=True, default=list, help_text='Pseudo IDs; empty means everyone')),
+                ('format', models.CharField(choices=[('json', 'NDJSON'), ('csv', 'CSV')], default='json', max_length=10)),
+                ('fingerprint', models.CharField(db_index=True, max_length=64)),
+                ('data_version', models.CharField(blank=True, max_length=64)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('complete', 'Complete'), ('failed', 'Failed')], default='pending', max_length=20)),
+                ('parts_total', models.PositiveIntegerField(default=0)),
+                ('parts_done', models.PositiveIntegerField(default=0)),
+                ('rows_written', models.PositiveBigIntegerField(default=0)),
+                ('file_path', models.CharField(blank=True, max_length=500)),
+                ('file_size', models.PositiveBigIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('requested_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='export_jobs', to='users.profile')),
+                ('reused_from', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='studies.exportjob')),
+                ('study', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='export_jobs', to='studies.study')),
+            ],
+        ),
+    ]
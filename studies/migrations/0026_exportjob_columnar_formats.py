@@ -0,0 +1,18 @@
+# Generated by Django 4.2 on 2026-10-17 22:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('studies', '0025_exportjob'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='exportjob',
+            name='format',
+            field=models.CharField(choices=[('json', 'NDJSON'), ('csv', 'CSV'), ('parquet', 'Parquet'), ('arrow', 'Arrow IPC stream')], default='json', max_length=10),
+        ),
+    ]
@@ -117,6 +117,18 @@ class StudyParticipant(models.Model):
         return f"{name} in {self.study.title}"
 
 
+class ConsentQuerySet(models.QuerySet):
+    def with_real_sources(self):
+        """Load each consent's data_source as its concrete subclass.
+
+        The polymorphic queryset fetches the sources with one query per
+        subclass, instead of one get_real_instance() query per consent.
+        """
+        return self.prefetch_related(
+            models.Prefetch('data_source', queryset=DataSource.objects.all())
+        )
+
+
 class Consent(models.Model):
     participant = models.ForeignKey(
         Profile,
@@ -151,7 +163,9 @@ class Consent(models.Model):
         help_text="Start of the data collection period. May predate consent_date."
     )
     revocation_date = models.DateTimeField(null=True, blank=True)
-    
+
+    objects = ConsentQuerySet.as_manager()
+
     def __str__(self):
         if self.participant:
             name = self.participant.user.username
@@ -162,3 +176,84 @@ class Consent(models.Model):
         return f"Consent of {name} for {self.study.title}"
 
 
+
+
+class CoverageCell(models.Model):
+    """How much data one participant's source had for a data type on one UTC day.
+
+    Built in the background by studies.coverage so the researcher dashboard
+    never has to ask the data backends.
+    """
+    study = models.ForeignKey(Study, on_delete=models.CASCADE, related_name='coverage_cells')
+    study_participant = models.ForeignKey(
+        StudyParticipant, on_delete=models.CASCADE, related_name='coverage_cells'
+    )
+    source_type = models.CharField(max_length=100)
+    data_type = models.CharField(max_length=100)
+    day = models.DateField()
+    row_count = models.PositiveIntegerField(default=0)
+    last_timestamp = models.DateTimeField(null=True, blank=True)
+    computed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['study_participant', 'source_type', 'data_type', 'day'],
+                name='unique_coverage_cell',
+            ),
+        ]
+        indexes = [models.Index(fields=['study', 'day'])]
+
+    def __str__(self):
+        return f"{self.study_participant.pseudo_id} {self.data_type} {self.day}: {self.row_count}"
+
+
+class ExportJob(models.Model):
+    """A study data export that runs in the background (see studies.exports).
+
+    The artifact is a zip with one file per data type. `fingerprint` identifies
+    the request and `data_version` the data it was built from, so an identical
+    request over unchanged data reuses the existing file. A running job bumps
+    `heartbeat_at` as it goes; a pending or running job without a heartbeat
+    for EXPORT_STALE_AFTER seconds was lost (worker killed or crashed).
+    """
+    FORMAT_CHOICES = (
+        ('json', 'NDJSON'),
+        ('csv', 'CSV'),
+        ('parquet', 'Parquet'),
+        ('arrow', 'Arrow IPC stream'),
+    )
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('complete', 'Complete'),
+        ('failed', 'Failed'),
+    )
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    study = models.ForeignKey(Study, on_delete=models.CASCADE, related_name='export_jobs')
+    requested_by = models.ForeignKey(
+        Profile, on_delete=models.SET_NULL, null=True, blank=True, related_name='export_jobs'
+    )
+    data_types = models.JSONField(default=list, blank=True, help_text="Empty means all data types")
+    start_date = models.DateField(null=True, blank=True)
+    end_date = models.DateField(null=True, blank=True)
+    participants = models.JSONField(default=list, blank=True, help_text="Pseudo IDs; empty means everyone")
+    format = models.CharField(max_length=10, choices=FORMAT_CHOICES, default='json')
+    fingerprint = models.CharField(max_length=64, db_index=True)
+    data_version = models.CharField(max_length=64, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    # Progress, counted in (data type, consent) pairs
+    parts_total = models.PositiveIntegerField(default=0)
+    parts_done = models.PositiveIntegerField(default=0)
+    rows_written = models.PositiveBigIntegerField(default=0)
+    file_path = models.CharField(max_length=500, blank=True)
+    file_size = models.PositiveBigIntegerField(default=0)
+    reused_from = models.ForeignKey('self', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Export {self.id} of {self.study.title} ({self.status})"
@@ -0,0 +1,76 @@
+"""Turning consents into annotated data rows.
+
+Shared by study_data_api and the background exports in studies.exports.
+"""
+import base64
+
+from django.utils import timezone
+
+
+def clean_row(row):
+    for k, v in row.items():
+        if isinstance(v, bytes):
+            try:
+                row[k] = v.decode('utf-8')
+            except Exception:
+                row[k] = base64.b64encode(v).decode('ascii')
+    return row
+
+
+def make_timezone_aware(dt):
+    if dt is not None and timezone.is_naive(dt):
+        return timezone.make_aware(dt)
+    return dt
+
+
+def consent_interval(study, consent, start_date, end_date):
+    """Return the (start, end) window a consent allows, narrowed by the requested dates.
+
+    Returns None when the consent has no start date yet.
+    """
+    consent_start = consent.data_start or consent.consent_date
+    if not consent_start:
+        return None
+
+    consent_end = consent.revocation_date or timezone.now()
+
+    type_start, type_end = study.get_source_dates(consent.source_type)
+
+    effective_start = type_start or consent_start
+    start_candidates = [make_timezone_aware(d) for d in [effective_start, start_date] if d is not None]
+    interval_start = max(start_candidates) if start_candidates else None
+
+    end_candidates = [make_timezone_aware(d) for d in [type_end, consent_end, end_date] if d is not None]
+    interval_end = min(end_candidates) if end_candidates else None
+    return interval_start, interval_end
+
+
+def consent_sources(consents):
+    """Pair each consent that has a data source with the concrete source instance.
+
+    `consents` should come from Consent.objects.with_real_sources(). Data
+    types are prefetched per source type, so that backends which can list
+    many sources at once only do so a single time.
+    """
+    pairs = [
+        (consent, consent.data_source)
+        for consent in consents
+        if consent.data_source
+    ]
+    by_type = {}
+    for _, source in pairs:
+        by_type.setdefault(type(source), []).append(source)
+    for source_class, sources in by_type.items():
+        source_class.prefetch_data_types(sources)
+    return pairs
+
+
+def annotate_row(row, consent, data_type, clean=True):
+    """Tag a row with its data type, source type and pseudonymous participant ID.
+
+    With clean=False bytes are kept as they are, for binary output formats.
+    """
+    row["data_type"] = data_type
+    row["source_type"] = consent.source_type
+    row["participant_id"] = str(consent.study_participant.pseudo_id) if consent.study_participant else None
+    return clean_row(row) if clean else row
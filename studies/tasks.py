@@ -0,0 +1,60 @@
+from celery import shared_task
+from django.core.cache import cache
+from django.conf import settings
+
+from data_sources.models import db_connector
+from . import exports
+from .coverage import build_study_coverage
+from .models import ExportJob, Study
+
+COVERAGE_LOCK_KEY = 'studies:coverage:{}'
+
+
+@shared_task
+def build_coverage():
+    """ Dispatch a coverage rebuild for every study
+    """
+    study_ids = list(Study.objects.order_by('id').values_list('id', flat=True))
+    for study_id in study_ids:
+        build_coverage_for_study.delay(study_id)
+    return f"Dispatched coverage for {len(study_ids)} studies."
+
+
+@shared_task
+def build_coverage_for_study(study_id):
+    """ Rebuild the stored coverage matrix of one study
+    """
+    lock_key = COVERAGE_LOCK_KEY.format(study_id)
+    if not cache.add(lock_key, 1, settings.CELERY_TASK_TIME_LIMIT):
+        return f"Coverage of study {study_id} is already being built."
+    try:
+        study = Study.objects.filter(pk=study_id).first()
+        if study is None:
+            return f"Study {study_id} no longer exists."
+        with db_connector.reuse_connection():
+            cells = build_study_coverage(study)
+    finally:
+        cache.delete(lock_key)
+    return f"Stored {cells} coverage cells for study {study_id}."
+
+
+@shared_task(soft_time_limit=settings.EXPORT_SOFT_TIME_LIMIT)
+def run_export_job(job_id):
+    """ Write the artifact of a study export job
+
+    SoftTimeLimitExceeded is an Exception, so run_export records the job as
+    failed before the hard time limit kills the worker.
+    """
+    job = ExportJob.objects.filter(pk=job_id, status='pending').select_related('study').first()
+    if job is None:
+        return f"Export {job_id} is not pending."
+    job = exports.run_export(job)
+    return f"Export {job_id} {job.status}."
+
+
+@shared_task
+def expire_export_jobs():
+    """ Fail exports that stopped responding, delete old export jobs and their artifacts
+    """
+    exports.fail_stale_jobs()
+    return f"Deleted {exports.expire_exports()} export jobs."
@@ -1,6 +1,12 @@
-from datetime import datetime, timedelta
+import json
+import uuid
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
 from unittest.mock import patch
-from django.test import TestCase
+from celery.exceptions import SoftTimeLimitExceeded
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
 from django.urls import reverse
 from django.contrib.auth.models import User
 from django.utils import timezone
@@ -9,7 +15,22 @@ from django.http import Http404
 from users.models import Profile
 from data_sources.models.aware import AwareDataSource
 from data_sources.models.jsonurl import JsonUrlDataSource
-from .models import Study, Consent, StudyParticipant
+from .models import Study, Consent, StudyParticipant, CoverageCell, ExportJob
+from . import exports, tasks
+from .coverage import build_study_coverage, coverage_matrix
+from .management.commands.load_test_data_api import percentile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from io import StringIO
+from unittest.mock import MagicMock
+import os
+import shutil
+import tempfile
+import zipfile
+import io
+import pyarrow as pa
+import pyarrow.parquet as pq
+from study_server.utils import iter_csv, iter_parquet, encode_sync_token, decode_sync_token
 from .views import get_next_consent
 
 
@@ -687,6 +708,12 @@ class WithdrawFromStudyViewTest(StudyTestMixin, TestCase):
         self.assertIsNone(self.consent2.data_source)
         self.assertFalse(self.consent2.is_complete)
 
+    @override_settings(AWARE_MIRROR_ENABLED=True)
+    @patch('studies.views.purge_aware_mirror.delay')
+    def test_post_purges_aware_mirror(self, mock_purge):
+        self.client.post(reverse('withdraw_from_study', args=[self.study.id]))
+        mock_purge.assert_called_once_with()
+
     def test_post_skips_already_revoked(self):
         revoked_time = timezone.now() - timezone.timedelta(days=1)
         revoked_consent = Consent.objects.create(
@@ -766,6 +793,12 @@ class RevokeConsentViewTest(StudyTestMixin, TestCase):
         self.assertIsNotNone(new_consent)
         self.assertNotEqual(new_consent.pk, self.consent.pk)
 
+    @override_settings(AWARE_MIRROR_ENABLED=True)
+    @patch('studies.views.purge_aware_mirror.delay')
+    def test_post_purges_aware_mirror(self, mock_purge):
+        self.client.post(reverse('revoke_consent', args=[self.consent.id]))
+        mock_purge.assert_called_once_with()
+
     def test_post_redirects_to_dashboard(self):
         url = reverse('revoke_consent', args=[self.consent.id])
         response = self.client.post(url)
@@ -917,6 +950,16 @@ class GetNextConsentHelperTest(StudyTestMixin, TestCase):
 
 class StudyDataApiTest(StudyTestMixin, TestCase):
 
+    def setUp(self):
+        super().setUp()
+        # Keep AWARE device discovery away from a real database
+        for patcher in (
+            patch.object(AwareDataSource, 'prefetch_data_types'),
+            patch('data_sources.models.db_connector.discover_devices', return_value={}),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
     def test_unauthorized_user_403(self):
         # participant (not researcher) should get 403
         url = reverse('study_data_api')
@@ -1156,6 +1199,240 @@ class StudyDataApiTest(StudyTestMixin, TestCase):
         self.assertEqual(kwargs['start_date'].date(), datetime(2024, 1, 1).date())
 
 
+    def _create_active_consent(self):
+        source = AwareDataSource.objects.create(
+            profile=self.profile,
+            name='Streaming Test Source',
+            status='active',
+        )
+        return Consent.objects.create(
+            participant=self.profile,
+            study=self.study,
+            source_type='AwareDataSource',
+            data_source=source,
+            is_complete=True,
+            consent_date=timezone.make_aware(datetime(2024, 1, 1)),
+            study_participant=self.study_participant,
+        )
+
+    @patch.object(AwareDataSource, 'fetch_data', return_value=[{'timestamp': 123, 'value': 42}])
+    @patch.object(AwareDataSource, 'get_data_types', return_value=['battery'])
+    def test_stream_json_matches_buffered_response(self, mock_types, mock_fetch):
+        self._create_active_consent()
+        self.client.login(username='researcher', password='testpass')
+        url = reverse('study_data_api')
+        buffered = self.client.get(url, {'data_type': 'battery'}).json()
+        response = self.client.get(url, {'data_type': 'battery', 'stream': 'true'})
+        self.assertTrue(response.streaming)
+        streamed = json.loads(b''.join(response.streaming_content))
+        self.assertEqual(streamed, buffered)
+
+    @patch.object(AwareDataSource, 'fetch_data', return_value=[{'timestamp': 123, 'value': 42}])
+    @patch.object(AwareDataSource, 'get_data_types', return_value=['battery'])
+    def test_stream_csv(self, mock_types, mock_fetch):
+        self._create_active_consent()
+        self.client.login(username='researcher', password='testpass')
+        response = self.client.get(reverse('study_data_api'), {'data_type': 'battery', 'format': 'csv', 'stream': '1'})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'timestamp,value,data_type,source_type,participant_id')
+        self.assertEqual(len(lines), 2)
+
+    @patch.object(AwareDataSource, 'fetch_data', return_value=[{'timestamp': 123, 'value': 42}])
+    @patch.object(AwareDataSource, 'get_data_types', return_value=['battery'])
+    def test_ndjson_always_streams(self, mock_types, mock_fetch):
+        self._create_active_consent()
+        self.client.login(username='researcher', password='testpass')
+        response = self.client.get(reverse('study_data_api'), {'data_type': 'battery', 'format': 'ndjson'})
+        self.assertTrue(response.streaming)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(rows[0]['value'], 42)
+        self.assertEqual(rows[0]['participant_id'], str(self.study_participant.pseudo_id))
+
+    @patch.object(AwareDataSource, 'fetch_data', return_value=[{'timestamp': 123, 'value': 4.5, 'raw': b'\xff\x00'}])
+    @patch.object(AwareDataSource, 'get_data_types', return_value=['battery'])
+    def test_parquet_keeps_column_types(self, mock_types, mock_fetch):
+        self._create_active_consent()
+        self.client.login(username='researcher', password='testpass')
+        response = self.client.get(reverse('study_data_api'), {'data_type': 'battery', 'format': 'parquet'})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/vnd.apache.parquet')
+        self.assertIn('study_data.parquet', response['Content-Disposition'])
+        table = pq.read_table(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(table.schema.field('timestamp').type, pa.int64())
+        self.assertEqual(table.schema.field('value').type, pa.float64())
+        row = table.to_pylist()[0]
+        self.assertEqual(row['raw'], b'\xff\x00')
+        self.assertEqual(row['participant_id'], str(self.study_participant.pseudo_id))
+
+    @patch.object(AwareDataSource, 'get_data_types', return_value=['battery'])
+    def test_arrow_page_sets_next_cursor(self, mock_types):
+        self._create_active_consent()
+        self.client.login(username='researcher', password='testpass')
+        rows = [{'_id': n, 'timestamp': n} for n in range(3)]
+        with patch.object(AwareDataSource, 'fetch_page', return_value=(rows[:2], 'next')):
+            response = self.client.get(
+                reverse('study_data_api'), {'data_type': 'battery', 'format': 'arrow', 'limit': 2},
+            )
+        self.assertEqual(response['Content-Type'], 'application/vnd.apache.arrow.stream')
+        self.assertTrue(response['X-Next-Cursor'])
+        table = pa.ipc.open_stream(b''.join(response.streaming_content)).read_all()
+        self.assertEqual(table.column('_id').to_pylist(), [0, 1])
+
+    @patch.object(AwareDataSource, 'get_data_types', return_value=['battery'])
+    def test_sync_token_returns_only_new_rows(self, mock_types):
+        consent = self._create_active_consent()
+        self.client.login(username='researcher', password='testpass')
+        url = reverse('study_data_api')
+
+        def changes(data_type, since, until, **kwargs):
+            return iter([{'_id': n} for n in range((since or 0) + 1, until + 1)])
+
+        with patch.object(AwareDataSource, 'sync_watermarks', return_value=[3]), \
+                patch.object(AwareDataSource, 'iter_changes', side_effect=changes):
+            first = self.client.get(url, {'data_type': 'battery', 'sync': '1'})
+        body = first.json()
+        self.assertEqual([row['_id'] for row in body['data']], [1, 2, 3])
+        self.assertEqual(first['X-Sync-Token'], body['sync_token'])
+        self.assertEqual(decode_sync_token(body['sync_token']), ('battery', {consent.id: 3}))
+
+        with patch.object(AwareDataSource, 'sync_watermarks', return_value=[5]), \
+                patch.object(AwareDataSource, 'iter_changes', side_effect=changes) as mock_changes:
+            second = self.client.get(url, {'data_type': 'battery', 'since': body['sync_token'], 'format': 'ndjson'})
+            rows = [json.loads(line) for line in b''.join(second.streaming_content).splitlines()]
+        self.assertEqual([row['_id'] for row in rows], [4, 5])
+        self.assertEqual(mock_changes.call_args.kwargs['since'], 3)
+        self.assertEqual(decode_sync_token(second['X-Sync-Token'])[1], {consent.id: 5})
+
+    @patch.object(AwareDataSource, 'get_data_types', return_value=['battery'])
+    def test_bucket_returns_aggregates_per_participant(self, mock_types):
+        self._create_active_consent()
+        self.client.login(username='researcher', password='testpass')
+        buckets = [{'timestamp': 0, 'count': 60, 'battery_level_mean': 50.5}]
+        with patch.object(AwareDataSource, 'aggregate', return_value=buckets) as mock_aggregate, \
+                patch.object(AwareDataSource, 'fetch_data') as mock_fetch:
+            response = self.client.get(
+                reverse('study_data_api'), {'data_type': 'battery', 'bucket': '1h', 'agg': 'count,mean'},
+            )
+        body = response.json()
+        self.assertEqual((body['bucket'], body['aggregates']), ('1h', ['count', 'mean']))
+        self.assertEqual(body['data'][0]['battery_level_mean'], 50.5)
+        self.assertEqual(body['data'][0]['participant_id'], str(self.study_participant.pseudo_id))
+        self.assertEqual(mock_aggregate.call_args.args[:3], ('battery', 3600000, ['count', 'mean']))
+        mock_fetch.assert_not_called()
+
+    def test_invalid_bucket_requests_return_400(self):
+        self.client.login(username='researcher', password='testpass')
+        url = reverse('study_data_api')
+        for params in (
+            {'data_type': 'battery', 'bucket': '1w'},
+            {'data_type': 'battery', 'bucket': '1h', 'agg': 'median'},
+            {'data_type': 'battery', 'bucket': '1h', 'limit': 10},
+            {'data_type': 'battery', 'bucket': '1h', 'sync': '1'},
+        ):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(url, params).status_code, 400)
+
+    def test_invalid_sync_requests_return_400(self):
+        self.client.login(username='researcher', password='testpass')
+        url = reverse('study_data_api')
+        screen_token = encode_sync_token('screen', {1: 10})
+        for params in (
+            {'data_type': 'battery', 'since': 'garbage'},
+            {'data_type': 'battery', 'since': screen_token},
+            {'data_type': 'battery', 'sync': '1', 'limit': 10},
+        ):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(url, params).status_code, 400)
+
+    @override_settings(DATA_PAGE_SIZE=2)
+    @patch.object(AwareDataSource, 'get_data_types', return_value=['battery'])
+    def test_rows_are_fetched_page_by_page(self, mock_types):
+        self._create_active_consent()
+        pages = [[{'_id': 30, 'timestamp': 3}, {'_id': 20, 'timestamp': 2}], [{'_id': 10, 'timestamp': 1}]]
+        with patch.object(AwareDataSource, 'fetch_data', side_effect=pages) as mock_fetch:
+            self.client.login(username='researcher', password='testpass')
+            response = self.client.get(reverse('study_data_api'), {'data_type': 'battery'})
+        self.assertEqual(response.json()['data_count'], 3)
+        afters = [call.kwargs['after'] for call in mock_fetch.call_args_list]
+        self.assertEqual(afters, [None, (2, 20)])
+
+    @patch.object(AwareDataSource, 'get_data_types', return_value=['battery'])
+    def test_cursor_pagination_walks_all_consents(self, mock_types):
+        self._create_active_consent()
+        other_user = User.objects.create_user(username='other', password='testpass')
+        other_profile = Profile.objects.create(user=other_user, user_type='participant')
+        other_participant = StudyParticipant.objects.create(participant=other_profile, study=self.study)
+        other_source = AwareDataSource.objects.create(profile=other_profile, name='Other', status='active')
+        Consent.objects.create(
+            participant=other_profile,
+            study=self.study,
+            source_type='AwareDataSource',
+            data_source=other_source,
+            is_complete=True,
+            consent_date=timezone.make_aware(datetime(2024, 1, 1)),
+            study_participant=other_participant,
+        )
+        data = {
+            self.profile.id: [{'_id': i, 'timestamp': i} for i in (5, 4, 3)],
+            other_profile.id: [{'_id': i, 'timestamp': i} for i in (2, 1)],
+        }
+
+        def fake_fetch(source, data_type, limit, start_date, end_date, after=None, offset=0):
+            rows = [r for r in data[source.profile_id] if after is None or r['_id'] < after[1]]
+            return [dict(r) for r in rows[:limit]]
+
+        self.client.login(username='researcher', password='testpass')
+        url = reverse('study_data_api')
+        seen = []
+        params = {'data_type': 'battery', 'limit': 2}
+        with patch.object(AwareDataSource, 'fetch_data', autospec=True, side_effect=fake_fetch):
+            for _ in range(5):
+                body = self.client.get(url, params).json()
+                seen.extend(row['_id'] for row in body['data'])
+                self.assertLessEqual(body['data_count'], 2)
+                if not body['next_cursor']:
+                    break
+                params['cursor'] = body['next_cursor']
+        self.assertEqual(seen, [5, 4, 3, 2, 1])
+        self.assertIsNone(body['next_cursor'])
+
+    @patch.object(AwareDataSource, 'get_data_types', return_value=['battery'])
+    def test_parallel_fetch_keeps_consent_order(self, mock_types):
+        participants = []
+        for i in range(4):
+            user = User.objects.create_user(username=f'p{i}', password='testpass')
+            profile = Profile.objects.create(user=user, user_type='participant')
+            participant = StudyParticipant.objects.create(participant=profile, study=self.study)
+            source = AwareDataSource.objects.create(profile=profile, name=f'Source {i}', status='active')
+            Consent.objects.create(
+                participant=profile,
+                study=self.study,
+                source_type='AwareDataSource',
+                data_source=source,
+                is_complete=True,
+                consent_date=timezone.make_aware(datetime(2024, 1, 1)),
+                study_participant=participant,
+            )
+            participants.append(str(participant.pseudo_id))
+
+        def fake_fetch(source, data_type, limit, start_date, end_date, after=None, offset=0):
+            # Later participants answer faster
+            time.sleep(0.01 * (4 - int(source.name.split()[-1])))
+            return [{'_id': 1, 'timestamp': 1}]
+
+        self.client.login(username='researcher', password='testpass')
+        with patch.object(AwareDataSource, 'fetch_data', autospec=True, side_effect=fake_fetch):
+            body = self.client.get(reverse('study_data_api'), {'data_type': 'battery'}).json()
+        self.assertEqual([row['participant_id'] for row in body['data']], participants)
+
+    def test_invalid_cursor_returns_400(self):
+        self.client.login(username='researcher', password='testpass')
+        response = self.client.get(reverse('study_data_api'), {'data_type': 'battery', 'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 400)
+
+
 # ---------------------------------------------------------------------------
 # 13. StudyAdminTest
 # ---------------------------------------------------------------------------
@@ -1232,3 +1509,368 @@ class StudyAdminTest(TestCase):
         response = self.client.get(url)
         # Django admin returns 302 (redirect to admin index) for objects not in queryset
         self.assertNotEqual(response.status_code, 200)
+
+
+# ---------------------------------------------------------------------------
+# 14. CoverageTest
+# ---------------------------------------------------------------------------
+
+@override_settings(COVERAGE_DAYS=3)
+class CoverageTest(StudyTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.today = datetime(2024, 5, 10).date()
+        self.source = AwareDataSource.objects.create(
+            profile=self.profile, name='Phone', status='active', device_id=str(uuid.uuid4()),
+        )
+        self.consent = Consent.objects.create(
+            participant=self.profile, study=self.study, study_participant=self.study_participant,
+            data_source=self.source, source_type='AwareDataSource', is_complete=True,
+            consent_date=timezone.make_aware(datetime(2024, 1, 1)),
+        )
+
+    @patch.object(AwareDataSource, 'get_data_types', return_value=['battery', 'screen'])
+    @patch.object(AwareDataSource, 'count_rows', return_value=5)
+    @patch.object(AwareDataSource, 'daily_coverage')
+    def test_build_stores_cells_for_window(self, mock_coverage, mock_count, mock_types):
+        mock_coverage.side_effect = lambda data_type, first, last: (
+            {last: (5, None)} if data_type == 'battery' else {}
+        )
+        self.assertEqual(build_study_coverage(self.study, today=self.today), 1)
+        mock_coverage.assert_any_call('battery', datetime(2024, 5, 8).date(), self.today)
+        cell = CoverageCell.objects.get()
+        self.assertEqual((cell.data_type, cell.day, cell.row_count), ('battery', self.today, 5))
+
+        # A rebuild replaces the previous cells
+        mock_count.return_value = 6
+        mock_coverage.side_effect = lambda data_type, first, last: {first: (1, None)}
+        self.assertEqual(build_study_coverage(self.study, today=self.today), 2)
+        self.assertEqual(CoverageCell.objects.filter(study=self.study).count(), 2)
+
+    @patch.object(AwareDataSource, 'get_data_types', return_value=['battery'])
+    @patch.object(AwareDataSource, 'count_rows', return_value=5)
+    @patch.object(AwareDataSource, 'daily_coverage', return_value={datetime(2024, 5, 9).date(): (5, None)})
+    def test_build_keeps_unchanged_cells(self, mock_coverage, mock_count, mock_types):
+        build_study_coverage(self.study, today=self.today)
+        mock_coverage.reset_mock()
+        self.assertEqual(build_study_coverage(self.study, today=self.today), 1)
+        mock_coverage.assert_not_called()
+        self.assertEqual(CoverageCell.objects.get().row_count, 5)
+
+    @patch.object(AwareDataSource, 'get_data_types', return_value=['battery'])
+    @patch.object(AwareDataSource, 'count_rows', return_value=2)
+    @patch.object(AwareDataSource, 'daily_coverage')
+    def test_build_is_limited_to_the_consent(self, mock_coverage, mock_count, mock_types):
+        data_start = datetime(2024, 5, 9, 12, tzinfo=dt_timezone.utc)
+        self.consent.data_start = data_start
+        self.consent.save()
+        mock_coverage.return_value = {datetime(2024, 5, 9).date(): (7, None), self.today: (1, None)}
+        build_study_coverage(self.study, today=self.today)
+        mock_coverage.assert_called_once_with('battery', datetime(2024, 5, 9).date(), self.today)
+        # The first day is only partly covered and is counted from data_start
+        mock_count.assert_called_with(
+            data_type='battery', start_date=data_start,
+            end_date=datetime(2024, 5, 10, tzinfo=dt_timezone.utc) - timedelta(milliseconds=1),
+        )
+        counts = dict(CoverageCell.objects.values_list('day', 'row_count'))
+        self.assertEqual(counts, {datetime(2024, 5, 9).date(): 2, self.today: 1})
+
+    @patch.object(AwareDataSource, 'get_data_types', side_effect=Exception('backend down'))
+    def test_build_skips_failing_source(self, mock_types):
+        self.assertEqual(build_study_coverage(self.study, today=self.today), 0)
+
+    def test_matrix_fills_missing_days(self):
+        CoverageCell.objects.create(
+            study=self.study, study_participant=self.study_participant, source_type='AwareDataSource',
+            data_type='battery', day=self.today, row_count=8,
+        )
+        CoverageCell.objects.create(
+            study=self.study, study_participant=self.study_participant, source_type='AwareDataSource',
+            data_type='battery', day=datetime(2024, 5, 9).date(), row_count=1,
+        )
+        matrix = coverage_matrix(self.study, today=self.today)
+        self.assertEqual(len(matrix['days']), 3)
+        self.assertEqual(len(matrix['rows']), 1)
+        row = matrix['rows'][0]
+        self.assertEqual(row['pseudo_id'], str(self.study_participant.pseudo_id))
+        self.assertEqual([cell['row_count'] for cell in row['cells']], [0, 1, 8])
+        self.assertEqual([cell['level'] for cell in row['cells']], [0, 1, 4])
+
+
+# ---------------------------------------------------------------------------
+# 15. ConsentRealSourcesTest
+# ---------------------------------------------------------------------------
+
+class ConsentRealSourcesTest(StudyTestMixin, TestCase):
+
+    def _add_consents(self, count):
+        for n in range(count):
+            if n % 2:
+                source = JsonUrlDataSource.objects.create(
+                    profile=self.profile, name=f'Json {n}', url='https://example.com/data.json',
+                )
+            else:
+                source = AwareDataSource.objects.create(
+                    profile=self.profile, name=f'Phone {n}', device_id=str(uuid.uuid4()),
+                )
+            Consent.objects.create(
+                participant=self.profile, study=self.study, data_source=source,
+                source_type=type(source).__name__, consent_date=timezone.now(),
+            )
+
+    def test_resolves_subclasses_with_one_query_per_type(self):
+        self._add_consents(6)
+        # consents, base data sources, then one query per subclass
+        with self.assertNumQueries(4):
+            sources = [consent.data_source for consent in Consent.objects.with_real_sources()]
+            self.assertEqual(
+                sorted(type(source).__name__ for source in sources),
+                ['AwareDataSource'] * 3 + ['JsonUrlDataSource'] * 3,
+            )
+
+    def test_admin_changelist_queries_do_not_grow_with_consents(self):
+        User.objects.create_superuser(username='admin', password='testpass', email='admin@example.com')
+        self.client.login(username='admin', password='testpass')
+        url = reverse('admin:studies_consent_changelist')
+        self._add_consents(2)
+        with CaptureQueriesContext(connection) as few:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self._add_consents(6)
+        with CaptureQueriesContext(connection) as many:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertEqual(len(many), len(few))
+
+
+# ---------------------------------------------------------------------------
+# 16. LoadTestCommandTest
+# ---------------------------------------------------------------------------
+
+class LoadTestCommandTest(StudyTestMixin, TestCase):
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([7], 95), 7)
+        self.assertIsNone(percentile([], 50))
+
+    @patch('requests.Session.get')
+    def test_replays_mixed_traffic(self, mock_get):
+        mock_get.return_value = MagicMock(status_code=200, content=b'{"data": []}')
+        self.user.username = 'standin-0'
+        self.user.save()
+        out = StringIO()
+        call_command('load_test_data_api', requests=12, concurrency=3, researcher='researcher',
+                     seed=1, stdout=out)
+        self.assertEqual(mock_get.call_count, 12)
+        urls = {args[0] for args, _ in mock_get.call_args_list}
+        self.assertEqual(urls, {'http://localhost:8000/studies/api/data/', 'http://localhost:8000/accounts/api/data/'})
+        _, kwargs = mock_get.call_args
+        self.assertTrue(kwargs['headers']['Authorization'].startswith('Token '))
+        self.assertIn('p95=', out.getvalue())
+        self.assertIn('errors=0', out.getvalue())
+
+    def test_requires_participants_for_my_data(self):
+        with self.assertRaises(CommandError):
+            call_command('load_test_data_api', mix='mine=1', participant_prefix='nobody', stdout=StringIO())
+
+
+# ---------------------------------------------------------------------------
+# 17. ExportJobTest
+# ---------------------------------------------------------------------------
+
+EXPORT_ROWS = [{'timestamp': 1700000000000 + n, '_id': n, 'battery_level': 50 + n} for n in range(3)]
+
+
+@patch.object(AwareDataSource, 'prefetch_data_types')
+@patch.object(AwareDataSource, 'get_data_types', return_value=['battery'])
+@patch.object(AwareDataSource, 'count_rows', return_value=len(EXPORT_ROWS))
+@patch.object(AwareDataSource, 'iter_data', side_effect=lambda **_: iter([dict(r) for r in EXPORT_ROWS]))
+class ExportJobTest(StudyTestMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.export_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.export_root, ignore_errors=True)
+        override = override_settings(EXPORT_ROOT=self.export_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.source = AwareDataSource.objects.create(
+            profile=self.profile, name='Phone', status='active', device_id=str(uuid.uuid4()),
+        )
+        Consent.objects.create(
+            participant=self.profile, study=self.study, study_participant=self.study_participant,
+            data_source=self.source, source_type='AwareDataSource', is_complete=True,
+            consent_date=timezone.now() - timedelta(days=1),
+        )
+        self.client.login(username='researcher', password='testpass')
+
+    def make_job(self, **kwargs):
+        fields = {'data_types': [], 'start_date': None, 'end_date': None, 'participants': [], 'format': 'json'}
+        fields.update(kwargs)
+        fingerprint = exports.fingerprint(self.study, **fields)
+        return ExportJob.objects.create(study=self.study, fingerprint=fingerprint, **fields)
+
+    def test_run_writes_one_file_per_data_type(self, *mocks):
+        job = exports.run_export(self.make_job(format='csv'))
+        self.assertEqual(job.status, 'complete')
+        self.assertEqual((job.rows_written, job.parts_done, job.parts_total), (3, 1, 1))
+        self.assertEqual(job.file_size, os.path.getsize(job.file_path))
+        with zipfile.ZipFile(job.file_path) as archive:
+            self.assertEqual(archive.namelist(), ['battery.csv'])
+            lines = archive.read('battery.csv').decode().splitlines()
+        self.assertEqual(len(lines), 4)
+        self.assertIn('participant_id', lines[0])
+        self.assertFalse(os.path.exists(job.file_path + '.partial'))
+
+    def test_parquet_members_are_stored(self, *mocks):
+        job = exports.run_export(self.make_job(format='parquet'))
+        with zipfile.ZipFile(job.file_path) as archive:
+            info = archive.getinfo('battery.parquet')
+            self.assertEqual(info.compress_type, zipfile.ZIP_STORED)
+            table = pq.read_table(io.BytesIO(archive.read('battery.parquet')))
+        self.assertEqual(table.column('battery_level').to_pylist(), [50, 51, 52])
+
+    def test_csv_header_holds_columns_of_later_rows(self, *mocks):
+        rows = [{'a': 1}, {'a': 2, 'b': 'x'}]
+        self.assertEqual(''.join(iter_csv(iter(rows))).splitlines(), ['a,b', '1,', '2,x'])
+        self.assertEqual(list(iter_csv(iter([]))), [])
+
+    def test_schema_covers_every_row_group(self, *mocks):
+        rows = [{'_id': 1, 'a': 1, 'b': 'x'}, {'_id': 2, 'a': 2, 'b': None}, {'_id': 3, 'a': 2.5, 'b': 4, 'c': None}]
+        parquet = pq.ParquetFile(io.BytesIO(b''.join(iter_parquet(iter(rows), row_group_size=2))))
+        self.assertEqual(parquet.num_row_groups, 2)
+        self.assertEqual(parquet.schema_arrow.field('_id').type, pa.int64())
+        self.assertEqual(parquet.read().to_pylist()[2], {'_id': 3, 'a': 2.5, 'b': '4', 'c': None})
+
+    def test_later_columns_and_conflicting_values_are_kept(self, *mocks):
+        rows = [{'a': 1}, {'a': 1}, {'a': 1.5, 'c': 3}]
+        table = pq.read_table(io.BytesIO(b''.join(iter_parquet(iter(rows), row_group_size=2))))
+        self.assertEqual(table.to_pylist(), [{'a': 1.0, 'c': None}, {'a': 1.0, 'c': None}, {'a': 1.5, 'c': 3}])
+        self.assertEqual(table.schema.field('c').type, pa.int64())
+
+        rows = [{'a': 1}, {'a': 1}, {'a': 'three'}]
+        table = pq.read_table(io.BytesIO(b''.join(iter_parquet(iter(rows), row_group_size=2))))
+        self.assertEqual(table.column('a').to_pylist(), ['1', '1', 'three'])
+
+    @override_settings(COLUMNAR_ROW_GROUP_SIZE=2)
+    def test_export_keeps_columns_of_later_row_groups(self, mock_iter, *mocks):
+        mock_iter.side_effect = lambda **_: iter([{'timestamp': 1}, {'timestamp': 2}, {'timestamp': 3, 'extra': 1}])
+        job = exports.run_export(self.make_job(format='parquet'))
+        self.assertEqual(job.status, 'complete')
+        with zipfile.ZipFile(job.file_path) as archive:
+            table = pq.read_table(io.BytesIO(archive.read('battery.parquet')))
+        self.assertEqual(table.column('extra').to_pylist(), [None, None, 1])
+
+    def test_unchanged_data_reuses_artifact(self, mock_iter, mock_count, *mocks):
+        first = exports.run_export(self.make_job())
+        second = exports.run_export(self.make_job())
+        self.assertEqual(second.reused_from, first)
+        self.assertEqual(second.file_path, first.file_path)
+        self.assertEqual(mock_iter.call_count, 1)
+
+        # New rows change the data version, so the next job exports again
+        mock_count.return_value = len(EXPORT_ROWS) + 1
+        third = exports.run_export(self.make_job())
+        self.assertIsNone(third.reused_from)
+        self.assertNotEqual(third.file_path, first.file_path)
+
+    def test_failure_is_recorded(self, mock_iter, *mocks):
+        mock_iter.side_effect = Exception('backend down')
+        job = exports.run_export(self.make_job())
+        self.assertEqual(job.status, 'failed')
+        self.assertIn('backend down', job.error)
+        self.assertEqual(os.listdir(self.export_root), [])
+
+    @patch('studies.tasks.run_export_job.delay')
+    def test_create_deduplicates_pending_jobs(self, mock_delay, *mocks):
+        url = reverse('study_export_create')
+        response = self.client.post(url, {'data_types': 'battery', 'format': 'csv'})
+        self.assertEqual(response.status_code, 202)
+        job_id = response.json()['id']
+        mock_delay.assert_called_once_with(job_id)
+
+        response = self.client.post(url, {'data_types': 'battery', 'format': 'csv'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['id'], job_id)
+        self.assertEqual(mock_delay.call_count, 1)
+
+    @patch('studies.tasks.run_export_job.delay')
+    def test_create_replaces_jobs_that_stopped_responding(self, mock_delay, *mocks):
+        url = reverse('study_export_create')
+        job_id = self.client.post(url, {'data_types': 'battery'}).json()['id']
+        ExportJob.objects.filter(pk=job_id).update(
+            status='running', heartbeat_at=timezone.now() - timedelta(hours=1),
+        )
+        response = self.client.post(url, {'data_types': 'battery'})
+        self.assertEqual(response.status_code, 202)
+        self.assertNotEqual(response.json()['id'], job_id)
+        stale = ExportJob.objects.get(pk=job_id)
+        self.assertEqual(stale.status, 'failed')
+        self.assertIn('stopped responding', stale.error)
+        status = self.client.get(reverse('study_export_status', args=[job_id])).json()
+        self.assertEqual(status['status'], 'failed')
+
+    def test_progress_keeps_the_job_alive(self, *mocks):
+        job = self.make_job()
+        ExportJob.objects.filter(pk=job.pk).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        job = exports.run_export(ExportJob.objects.get(pk=job.pk))
+        self.assertEqual(job.status, 'complete')
+        self.assertEqual(exports.fail_stale_jobs(), 0)
+
+    def test_soft_time_limit_records_failure(self, mock_iter, *mocks):
+        mock_iter.side_effect = SoftTimeLimitExceeded()
+        job = self.make_job()
+        self.assertEqual(tasks.run_export_job(str(job.id)), f"Export {job.id} failed.")
+        self.assertEqual(ExportJob.objects.get(pk=job.pk).status, 'failed')
+
+    def test_create_validates_input(self, *mocks):
+        url = reverse('study_export_create')
+        self.assertEqual(self.client.post(url, {'format': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.post(url, {'start_date': '2024-13-01'}).status_code, 400)
+        self.assertEqual(self.client.post(url, {'participants': 'not-a-uuid'}).status_code, 400)
+
+    def test_participants_cannot_export(self, *mocks):
+        self.client.login(username='participant', password='testpass')
+        self.assertEqual(self.client.post(reverse('study_export_create')).status_code, 403)
+        job = self.make_job()
+        self.assertEqual(self.client.get(reverse('study_export_status', args=[job.id])).status_code, 403)
+
+    def test_status_and_ranged_download(self, *mocks):
+        job = exports.run_export(self.make_job())
+        status = self.client.get(reverse('study_export_status', args=[job.id])).json()
+        self.assertEqual(status['status'], 'complete')
+        self.assertEqual(status['progress']['rows_written'], 3)
+        self.assertTrue(status['download_url'].endswith(reverse('study_export_download', args=[job.id])))
+
+        url = reverse('study_export_download', args=[job.id])
+        with open(job.file_path, 'rb') as f:
+            content = f.read()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(b''.join(response.streaming_content), content)
+
+        response = self.client.get(url, HTTP_RANGE='bytes=10-')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 10-{len(content) - 1}/{len(content)}')
+        self.assertEqual(b''.join(response.streaming_content), content[10:])
+
+        response = self.client.get(url, HTTP_RANGE=f'bytes={len(content)}-')
+        self.assertEqual(response.status_code, 416)
+
+    def test_download_before_completion_conflicts(self, *mocks):
+        job = self.make_job()
+        self.assertEqual(self.client.get(reverse('study_export_download', args=[job.id])).status_code, 409)
+
+    def test_expire_keeps_artifacts_still_in_use(self, *mocks):
+        first = exports.run_export(self.make_job())
+        second = exports.run_export(self.make_job())
+        ExportJob.objects.filter(pk=first.pk).update(created_at=timezone.now() - timedelta(days=30))
+        self.assertEqual(exports.expire_exports(), 1)
+        self.assertTrue(os.path.exists(second.file_path))
+
+        ExportJob.objects.filter(pk=second.pk).update(created_at=timezone.now() - timedelta(days=30))
+        exports.expire_exports()
+        self.assertFalse(os.path.exists(second.file_path))
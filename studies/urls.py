@@ -9,4 +9,7 @@ urlpatterns = [
     path('revoke/<int:consent_id>/', views.revoke_consent, name='revoke_consent'),
     path('api/data', views.study_data_api, name='study_data_api'),
     path('api/data/', views.study_data_api),
+    path('api/exports/', views.study_export_create, name='study_export_create'),
+    path('api/exports/<uuid:job_id>/', views.study_export_status, name='study_export_status'),
+    path('api/exports/<uuid:job_id>/download/', views.study_export_download, name='study_export_download'),
 ]
@@ -10,15 +10,28 @@ from urllib.parse import urlencode
 from django.http import JsonResponse
 from django.utils import timezone
 from django.apps import apps
-from django.utils import timezone
+from django.conf import settings
 
 from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from rest_framework.authentication import TokenAuthentication, SessionAuthentication
 from rest_framework.permissions import IsAuthenticated
 
-from study_server.utils import data_to_csv_response
-import base64
-from .models import Study, Consent, StudyParticipant
+from study_server.views import ranged_file_response
+from study_server.utils import (
+    data_to_csv_response, stream_csv_response, stream_json_response, stream_ndjson_response,
+    stream_columnar_response, encode_cursor, decode_cursor, encode_sync_token, decode_sync_token,
+    COLUMNAR_FORMATS,
+)
+from data_sources.models import aggregation, db_connector
+from data_sources.tasks import purge_aware_mirror
+from data_sources.fanout import fan_out
+from users.models import Profile
+import itertools
+import os
+import uuid
+from .models import Study, Consent, ExportJob, StudyParticipant
+from .rows import annotate_row, consent_interval, consent_sources
+from . import exports, tasks
 from .forms import ConsentAcceptanceForm, DataSourceSelectionForm
 from . import services
 
@@ -71,6 +84,8 @@ def withdraw_from_study(request, study_id):
             consent.revocation_date = timezone.now()
             consent.is_complete = False
             consent.save()
+        if settings.AWARE_MIRROR_ENABLED:
+            purge_aware_mirror.delay()
         messages.success(request, f"You have successfully withdrawn from the study '{study.title}'.")
         return redirect('dashboard')
     
@@ -92,6 +107,8 @@ def revoke_consent(request, consent_id):
         consent.revocation_date = timezone.now()
         consent.is_complete = False
         consent.save()
+        if settings.AWARE_MIRROR_ENABLED and consent.source_type == 'AwareDataSource':
+            purge_aware_mirror.delay()
         # Create a new empty consent for the same data source type
         Consent.objects.create(
             participant=profile,
@@ -256,26 +273,13 @@ def consent_workflow(request, study_id):
     else:
         return select_data_source_view(request, consent, profile, study)
 
-def _clean_row(row):
-    for k, v in row.items():
-        if isinstance(v, bytes):
-            try:
-                row[k] = v.decode('utf-8')
-            except Exception:
-                row[k] = base64.b64encode(v).decode('ascii')
-    return row
-
 def _parse_date(date_str):
     return datetime.strptime(date_str, "%Y-%m-%d") if date_str else None
 
-def _make_timezone_aware(dt):
-    if dt is not None and timezone.is_naive(dt):
-        return timezone.make_aware(dt)
-    return dt
-
 @api_view(['GET'])
 @authentication_classes([TokenAuthentication, SessionAuthentication])
 @permission_classes([IsAuthenticated])
+@db_connector.reuse_connection()
 def study_data_api(request):
     study = Study.objects.first()
     if study is None:
@@ -292,17 +296,14 @@ def study_data_api(request):
         is_complete=True,
         revocation_date__isnull=True,
         data_source__status='active'
-    ).select_related('data_source', 'study_participant')
-
-    # Collect all available data types across consents
-    all_data_types = set()
-    for consent in active_consents:
-        if not consent.data_source:
-            continue
-        source = consent.data_source.get_real_instance()
-        all_data_types.update(source.get_data_types())
+    ).select_related('study_participant').with_real_sources().order_by('id')
+    sources = consent_sources(active_consents)
 
     if not data_type:
+        # Collect all available data types across consents
+        all_data_types = set()
+        for data_types in fan_out(_get_data_types, sources, source_of=_pair_source):
+            all_data_types.update(data_types)
         return JsonResponse({
             'study': study.title,
             'data_types': sorted(all_data_types),
@@ -311,53 +312,358 @@ def study_data_api(request):
     start_date_param = request.GET.get('start_date')
     end_date_param = request.GET.get('end_date')
     output_format = request.GET.get('format', 'json')
+    stream = request.GET.get('stream', '').lower() in ('1', 'true', 'yes') or output_format == 'ndjson'
+    # Columnar formats keep bytes as binary columns instead of base64 text
+    columnar = output_format in COLUMNAR_FORMATS
 
     start_date = _parse_date(start_date_param)
     end_date = _parse_date(end_date_param)
+    paged = 'limit' in request.GET or 'cursor' in request.GET
+    sync = 'since' in request.GET or request.GET.get('sync', '').lower() in ('1', 'true', 'yes')
+    bucketed = 'bucket' in request.GET
+
+    if bucketed:
+        if paged or sync:
+            return JsonResponse({'error': 'bucket cannot be combined with limit, cursor or sync'}, status=400)
+        try:
+            bucket_ms = aggregation.parse_bucket(request.GET['bucket'])
+            aggregates = aggregation.parse_aggregates(request.GET.get('agg'))
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+
+    if sync:
+        if paged:
+            return JsonResponse({'error': 'since/sync cannot be combined with limit or cursor'}, status=400)
+        since_type, since = data_type, {}
+        if request.GET.get('since'):
+            try:
+                since_type, since = decode_sync_token(request.GET['since'])
+            except ValueError:
+                return JsonResponse({'error': 'Invalid sync token'}, status=400)
+        if since_type != data_type:
+            return JsonResponse({'error': f"The sync token is for data type '{since_type}'"}, status=400)
+
+    if paged:
+        try:
+            limit = int(request.GET.get('limit') or settings.DATA_PAGE_SIZE)
+            cursor = decode_cursor(request.GET.get('cursor'))
+        except ValueError:
+            return JsonResponse({'error': 'Invalid limit or cursor'}, status=400)
+        if limit <= 0:
+            return JsonResponse({'error': 'Invalid limit or cursor'}, status=400)
+        page, next_cursor = _study_page(
+            study, sources, data_type, start_date, end_date, limit, cursor, clean=not columnar
+        )
+        next_token = encode_cursor(next_cursor)
+        if columnar:
+            response = stream_columnar_response(page, output_format, "study_data")
+            if next_token:
+                response['X-Next-Cursor'] = next_token
+            return response
+        if output_format == 'csv':
+            response = data_to_csv_response(page, "study_data.csv")
+            if next_token:
+                response['X-Next-Cursor'] = next_token
+            return response
+        return JsonResponse({
+            'study': study.title,
+            'data_count': len(page),
+            'data_types': [data_type],
+            'data': page,
+            'next_cursor': next_token,
+        })
 
-    all_data = []
-    for consent in active_consents:
-        if not consent.data_source:
-            continue
-        source = consent.data_source.get_real_instance()
-        data_types = source.get_data_types()
+    envelope = {
+        'study': study.title,
+        'data_types': [data_type],
+    }
+    if bucketed:
+        envelope.update(bucket=request.GET['bucket'], aggregates=aggregates)
+        rows = _iter_study_aggregates(study, sources, data_type, start_date, end_date, bucket_ms, aggregates)
+        return _rows_response(rows, output_format, stream, envelope)
+    changes = None
+    if sync:
+        # Marks are read before any rows, so rows ingested meanwhile go to the next sync
+        marks = _sync_marks(sources, data_type)
+        changes = (since, marks)
+        envelope['sync_token'] = encode_sync_token(data_type, marks)
+    rows = _iter_study_rows(study, sources, data_type, start_date, end_date, clean=not columnar, changes=changes)
+    response = _rows_response(rows, output_format, stream, envelope)
+    if sync:
+        response['X-Sync-Token'] = envelope['sync_token']
+    return response
+
+
+def _rows_response(rows, output_format, stream, envelope):
+    if output_format in COLUMNAR_FORMATS:
+        return stream_columnar_response(rows, output_format, "study_data")
+    if stream:
+        if output_format == 'csv':
+            return stream_csv_response(rows, "study_data.csv")
+        if output_format == 'ndjson':
+            return stream_ndjson_response(rows)
+        return stream_json_response(rows, envelope)
+
+    all_data = list(rows)
+    if output_format == 'csv':
+        return data_to_csv_response(all_data, "study_data.csv")
+    else:
+        return JsonResponse({
+            **envelope,
+            'data_count': len(all_data),
+            'data': all_data
+        })
 
-        if data_type not in data_types:
-            continue
 
-        consent_start = consent.data_start or consent.consent_date
-        if not consent_start:
+def _pair_source(pair):
+    return pair[1]
+
+
+def _get_data_types(pair):
+    return pair[1].get_data_types()
+
+
+def _study_page(study, sources, data_type, start_date, end_date, limit, cursor, clean=True):
+    """Collect up to `limit` rows across consents, ordered by consent id.
+
+    The cursor is either {'consent': id, 'source': source_cursor} to resume
+    inside a consent, or {'after': id} to continue with the next consent.
+    Returns (rows, next_cursor).
+    """
+    cursor = cursor or {}
+    resume_id = cursor.get('consent')
+    after_id = cursor.get('after')
+    rows = []
+    for consent, source in sources:
+        if after_id is not None and consent.id <= after_id:
+            continue
+        if resume_id is not None and consent.id < resume_id:
+            continue
+        source_cursor = cursor.get('source') if consent.id == resume_id else None
+        if data_type not in source.get_data_types():
+            continue
+        interval = consent_interval(study, consent, start_date, end_date)
+        if interval is None:
             continue
 
-        consent_end = consent.revocation_date or timezone.now()
+        while len(rows) < limit:
+            page, source_cursor = source.fetch_page(
+                data_type=data_type,
+                limit=limit - len(rows),
+                start_date=interval[0],
+                end_date=interval[1],
+                cursor=source_cursor,
+            )
+            rows.extend(annotate_row(row, consent, data_type, clean) for row in page)
+            if source_cursor is None:
+                break
+        if len(rows) >= limit:
+            if source_cursor is not None:
+                return rows, {'consent': consent.id, 'source': source_cursor}
+            return rows, {'after': consent.id}
+    return rows, None
+
+
+def _iter_study_aggregates(study, sources, data_type, start_date, end_date, bucket_ms, aggregates):
+    """Yield per-bucket aggregates for every consent, computed concurrently (see fan_out)."""
+    def aggregate(pair):
+        consent, source = pair
+        if data_type not in source.get_data_types():
+            return []
+        interval = consent_interval(study, consent, start_date, end_date)
+        if interval is None:
+            return []
+        return source.aggregate(data_type, bucket_ms, aggregates, start_date=interval[0], end_date=interval[1])
+
+    with db_connector.reuse_connection():
+        results = fan_out(aggregate, sources, source_of=_pair_source)
+        for (consent, _), rows in zip(sources, results):
+            for row in rows:
+                yield annotate_row(row, consent, data_type)
+
+
+def _sync_marks(sources, data_type):
+    """{consent id: sync watermark} for every consent whose source has `data_type`."""
+    by_type = {}
+    for consent, source in sources:
+        if data_type in source.get_data_types():
+            by_type.setdefault(type(source), []).append((consent, source))
+    marks = {}
+    for source_class, pairs in by_type.items():
+        watermarks = source_class.sync_watermarks([source for _, source in pairs], data_type)
+        marks.update((consent.id, mark) for (consent, _), mark in zip(pairs, watermarks))
+    return marks
+
+
+def _iter_study_rows(study, sources, data_type, start_date, end_date, clean=True, changes=None):
+    """Yield the rows of one data type for every consent, one source page at a time.
+
+    The first page of each consent is fetched concurrently (see fan_out);
+    rows are still yielded in consent order. With `changes` = (since, until),
+    two {consent id: watermark} maps, only rows that arrived in between are
+    yielded; consents missing from `since` get all of their rows.
+    """
+    def open_slice(pair):
+        consent, source = pair
+        if changes is not None:
+            since, until = changes
+            if consent.id not in until:
+                return None
+        elif data_type not in source.get_data_types():
+            return None
+        interval = consent_interval(study, consent, start_date, end_date)
+        if interval is None:
+            return None
+        if changes is not None:
+            rows = iter(source.iter_changes(
+                data_type,
+                since=since.get(consent.id),
+                until=until[consent.id],
+                start_date=interval[0],
+                end_date=interval[1],
+            ))
+        else:
+            rows = iter(source.iter_data(
+                data_type=data_type,
+                start_date=interval[0],
+                end_date=interval[1]
+            ))
+        first = next(rows, None)
+        if first is None:
+            return None
+        return itertools.chain([first], rows)
+
+    with db_connector.reuse_connection():
+        slices = fan_out(open_slice, sources, source_of=_pair_source)
+        for (consent, _), rows in zip(sources, slices):
+            if rows is None:
+                continue
+            for row in rows:
+                yield annotate_row(row, consent, data_type, clean)
+
+
+def _researcher_study(request):
+    """The deployment's study if the user may read its data, else an error response."""
+    study = Study.objects.first()
+    if study is None:
+        return None, JsonResponse({'error': 'No study configured'}, status=404)
+    if not request.user.is_superuser and not study.researchers.filter(user=request.user).exists():
+        return None, JsonResponse({'error': 'Unauthorized'}, status=403)
+    return study, None
+
+
+def _as_list(value):
+    """Accept either a JSON list or a comma separated string."""
+    if value in (None, ''):
+        return []
+    if isinstance(value, str):
+        return [item.strip() for item in value.split(',') if item.strip()]
+    return [str(item) for item in value]
+
+
+def _export_job_json(request, job):
+    data = {
+        'id': str(job.id),
+        'status': job.status,
+        'format': job.format,
+        'data_types': job.data_types,
+        'start_date': job.start_date,
+        'end_date': job.end_date,
+        'participants': job.participants,
+        'progress': {
+            'parts_done': job.parts_done,
+            'parts_total': job.parts_total,
+            'rows_written': job.rows_written,
+        },
+        'reused': job.reused_from_id is not None,
+        'created_at': job.created_at,
+        'finished_at': job.finished_at,
+        'status_url': request.build_absolute_uri(reverse('study_export_status', args=[job.id])),
+    }
+    if job.status == 'complete':
+        data['file_size'] = job.file_size
+        data['download_url'] = request.build_absolute_uri(reverse('study_export_download', args=[job.id]))
+    if job.status == 'failed':
+        data['error'] = job.error
+    return data
 
-        type_start, type_end = study.get_source_dates(consent.source_type)
 
-        effective_start = type_start or consent_start
-        start_candidates = [_make_timezone_aware(d) for d in [effective_start, start_date] if d is not None]
-        interval_start = max(start_candidates) if start_candidates else None
+@api_view(['POST'])
+@authentication_classes([TokenAuthentication, SessionAuthentication])
+@permission_classes([IsAuthenticated])
+def study_export_create(request):
+    """Start a background export; poll the returned status_url for progress."""
+    study, error = _researcher_study(request)
+    if error:
+        return error
+
+    data_types = _as_list(request.data.get('data_types'))
+    participants = _as_list(request.data.get('participants'))
+    output_format = request.data.get('format') or 'json'
+    if output_format not in exports.FORMATS:
+        return JsonResponse({'error': f"Unsupported format '{output_format}'"}, status=400)
+    try:
+        start_date = _parse_date(request.data.get('start_date'))
+        end_date = _parse_date(request.data.get('end_date'))
+        participants = [str(uuid.UUID(pseudo_id)) for pseudo_id in participants]
+    except ValueError:
+        return JsonResponse({'error': 'Invalid date or participant ID'}, status=400)
+    start_date = start_date.date() if start_date else None
+    end_date = end_date.date() if end_date else None
+
+    fingerprint = exports.fingerprint(study, data_types, start_date, end_date, participants, output_format)
+    # An identical export that is still queued or running answers this request
+    # too, unless it stopped responding
+    exports.fail_stale_jobs()
+    job = ExportJob.objects.filter(
+        fingerprint=fingerprint, status__in=['pending', 'running'],
+    ).order_by('created_at').first()
+    if job is not None:
+        return JsonResponse(_export_job_json(request, job), status=200)
+
+    job = ExportJob.objects.create(
+        study=study,
+        requested_by=Profile.objects.filter(user=request.user).first(),
+        data_types=data_types,
+        start_date=start_date,
+        end_date=end_date,
+        participants=participants,
+        format=output_format,
+        fingerprint=fingerprint,
+    )
+    tasks.run_export_job.delay(str(job.id))
+    return JsonResponse(_export_job_json(request, job), status=202)
 
-        end_candidates = [_make_timezone_aware(d) for d in [type_end, consent_end, end_date] if d is not None]
-        interval_end = min(end_candidates) if end_candidates else None
 
-        data = source.fetch_data(
-            data_type=data_type,
-            start_date=interval_start,
-            end_date=interval_end
-        )
-        for row in data:
-            row["data_type"] = data_type
-            row["source_type"] = consent.source_type
-            row["participant_id"] = str(consent.study_participant.pseudo_id) if consent.study_participant else None
-            all_data.append(_clean_row(row))
+def _researcher_export_job(request, job_id):
+    study, error = _researcher_study(request)
+    if error:
+        return None, error
+    exports.fail_stale_jobs()
+    job = ExportJob.objects.filter(pk=job_id, study=study).first()
+    if job is None:
+        return None, JsonResponse({'error': 'Export not found'}, status=404)
+    return job, None
 
-    if output_format == 'csv':
-        return data_to_csv_response(all_data, "study_data.csv")
-    else:
-        return JsonResponse({
-            'study': study.title,
-            'data_count': len(all_data),
-            'data_types': [data_type],
-            'data': all_data
-        })
-    
\ No newline at end of file
+
+@api_view(['GET'])
+@authentication_classes([TokenAuthentication, SessionAuthentication])
+@permission_classes([IsAuthenticated])
+def study_export_status(request, job_id):
+    job, error = _researcher_export_job(request, job_id)
+    if error:
+        return error
+    return JsonResponse(_export_job_json(request, job))
+
+
+@api_view(['GET'])
+@authentication_classes([TokenAuthentication, SessionAuthentication])
+@permission_classes([IsAuthenticated])
+def study_export_download(request, job_id):
+    """The finished artifact; supports Range requests so large downloads can resume."""
+    job, error = _researcher_export_job(request, job_id)
+    if error:
+        return error
+    if job.status != 'complete' or not job.file_path or not os.path.exists(job.file_path):
+        return JsonResponse({'error': 'Export is not available', 'status': job.status}, status=409)
+    return ranged_file_response(request, job.file_path, f'study_export_{job.id}.zip', 'application/zip')
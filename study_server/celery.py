@@ -1,8 +1,31 @@
+import logging
 import os
 from celery import Celery
+from celery.signals import worker_init
+from django.conf import settings
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'study_server.settings')
 
+logger = logging.getLogger(__name__)
+
+# Cache backends that each worker process keeps to itself
+PROCESS_LOCAL_CACHES = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
 app = Celery('study_server')
 app.config_from_object('django.conf:settings', namespace='CELERY')
-app.autodiscover_tasks()
\ No newline at end of file
+app.autodiscover_tasks()
+
+
+@worker_init.connect
+def check_shared_cache(**kwargs):
+    """Task locks and rate limits use cache.add, which needs a cache shared by all processes."""
+    backend = settings.CACHES['default']['BACKEND']
+    if backend in PROCESS_LOCAL_CACHES:
+        logger.error(
+            "The default cache (%s) is local to each worker process, so task locks and "
+            "rate limits do not hold across processes. Set CACHE_URL to a shared cache.",
+            backend,
+        )
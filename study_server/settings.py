@@ -90,12 +90,16 @@ REST_FRAMEWORK = {
         'rest_framework.authentication.TokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
+    # The data APIs interpret ?format= themselves (json, csv, ...)
+    'URL_FORMAT_OVERRIDE': None,
 }
 
+# Shared by all web and Celery worker processes, whose task locks and rate
+# limits rely on it; defaults to the Redis server Celery needs anyway. A
+# process-local cache (e.g. CACHE_URL=locmemcache:// for tests) only works
+# for a single process.
 CACHES = {
-    'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-    }
+    'default': env.cache('CACHE_URL', default='rediscache://localhost:6379/1'),
 }
 
 WSGI_APPLICATION = 'study_server.wsgi.application'
@@ -136,6 +140,24 @@ AWARE_DB_INSERT_USER = env('AWARE_DB_INSERT_USER', default='user')
 AWARE_DB_INSERT_PASSWORD = env('AWARE_DB_INSERT_PASSWORD', default='password')
 AWARE_DB_RO_USER = env('AWARE_DB_RO_USER', default='user')
 AWARE_DB_RO_PASSWORD = env('AWARE_DB_RO_PASSWORD', default='password')
+# 'mysql', or 'sqlite' to read a local stand-in built with build_aware_standin
+AWARE_DB_ENGINE = env('AWARE_DB_ENGINE', default='mysql')
+AWARE_DB_SQLITE_PATH = env('AWARE_DB_SQLITE_PATH', default=str(BASE_DIR / 'aware_standin.sqlite3'))
+# Read-only connection pool, one per process
+AWARE_DB_POOL_SIZE = env.int('AWARE_DB_POOL_SIZE', default=5)
+AWARE_DB_POOL_TIMEOUT = env.float('AWARE_DB_POOL_TIMEOUT', default=10)
+AWARE_DB_POOL_RECYCLE = env.int('AWARE_DB_POOL_RECYCLE', default=3600)
+# Incremental syncs re-check the _ids missing from this many below the
+# highest one, so rows of transactions that commit out of order are not lost
+AWARE_SYNC_GAP_WINDOW = env.int('AWARE_SYNC_GAP_WINDOW', default=1000)
+# Cached AWARE lookups (seconds). Empty results use the negative TTL.
+AWARE_CACHE_ALIAS = 'default'
+AWARE_CACHE_TTLS = {
+    'device_ids': env.int('AWARE_CACHE_DEVICE_IDS_TTL', default=3600),
+    'device_uid': env.int('AWARE_CACHE_DEVICE_UID_TTL', default=24 * 3600),
+    'tables': env.int('AWARE_CACHE_TABLES_TTL', default=300),
+}
+AWARE_CACHE_NEGATIVE_TTL = env.int('AWARE_CACHE_NEGATIVE_TTL', default=60)
 STUDY_PASSWORD = env('STUDY_PASSWORD', default='')
 
 GOOGLE_OAUTH_CLIENT_ID = env('GOOGLE_OAUTH_CLIENT_ID', default='')
@@ -146,6 +168,35 @@ TIKTOK_CLIENT_SECRET = env('TIKTOK_CLIENT_SECRET', default='')
 # Portability server
 PORTABILITY_SERVER_URL = env('PORTABILITY_SERVER_URL', default='http://localhost:8001')
 PORTABILITY_SERVER_TOKEN = env('PORTABILITY_SERVER_TOKEN', default='')
+PORTABILITY_CONNECT_TIMEOUT = env.float('PORTABILITY_CONNECT_TIMEOUT', default=5)
+PORTABILITY_READ_TIMEOUT = env.float('PORTABILITY_READ_TIMEOUT', default=30)
+# Keep-alive connections per process; enough for the data fetch workers
+PORTABILITY_POOL_SIZE = env.int('PORTABILITY_POOL_SIZE', default=16)
+# Retries for idempotent requests, with jittered exponential backoff (seconds)
+PORTABILITY_RETRIES = env.int('PORTABILITY_RETRIES', default=3)
+PORTABILITY_RETRY_BACKOFF = env.float('PORTABILITY_RETRY_BACKOFF', default=0.5)
+# Shared secret for donation status callbacks; empty disables the webhook
+PORTABILITY_WEBHOOK_SECRET = env('PORTABILITY_WEBHOOK_SECRET', default='')
+# Callbacks older than this many seconds are rejected (replay protection)
+PORTABILITY_WEBHOOK_TOLERANCE = 300
+# Poll interval for portability sources while webhooks deliver status changes
+PORTABILITY_WEBHOOK_POLL_INTERVAL = env.int('PORTABILITY_WEBHOOK_POLL_INTERVAL', default=30 * 60)
+
+
+# Participants per page and study on the researcher dashboard
+RESEARCHER_DASHBOARD_PAGE_SIZE = env.int('RESEARCHER_DASHBOARD_PAGE_SIZE', default=50)
+
+# Number of rows fetched per page when streaming data out of a source
+DATA_PAGE_SIZE = env.int('DATA_PAGE_SIZE', default=5000)
+# Rows per row group (record batch) of Parquet and Arrow output
+COLUMNAR_ROW_GROUP_SIZE = env.int('COLUMNAR_ROW_GROUP_SIZE', default=20000)
+# Parallel fetching across consents in the study data API. Each backend gets
+# its own cap so e.g. the AWARE database (see AWARE_DB_POOL_SIZE) is not swamped.
+DATA_FETCH_MAX_WORKERS = env.int('DATA_FETCH_MAX_WORKERS', default=8)
+DATA_SOURCE_DEFAULT_CONCURRENCY = env.int('DATA_SOURCE_DEFAULT_CONCURRENCY', default=4)
+DATA_SOURCE_CONCURRENCY = {
+    'AwareDataSource': env.int('AWARE_FETCH_CONCURRENCY', default=4),
+}
 
 
 # Processing task automation
@@ -157,14 +208,86 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60
-CELERY_WORKER_CONCURRENCY = 1
+CELERY_TASK_DEFAULT_QUEUE = 'celery'
+CELERY_WORKER_CONCURRENCY = env.int('CELERY_WORKER_CONCURRENCY', default=8)
 CELERY_BEAT_SCHEDULE = {
     'check-google-exports': {
         'task': 'data_sources.tasks.process_data_sources',
-        'schedule': 300,
+        'schedule': env.int('DATA_SOURCE_DISPATCH_INTERVAL', default=60),
     },
 }
 
+# process_data_sources only dispatches; each source is processed by its own
+# task. Route source types to dedicated queues (the workers must consume them,
+# e.g. `celery worker -Q celery,portability`) with
+# DATA_SOURCE_QUEUES=GooglePortabilityDataSource=portability,...
+DATA_SOURCE_QUEUES = env.dict('DATA_SOURCE_QUEUES', default={})
+# Celery-style rates ('30/m'), enforced across all workers through the cache
+DATA_SOURCE_RATE_LIMITS = {
+    'GooglePortabilityDataSource': env('PORTABILITY_RATE_LIMIT', default='60/m'),
+    'TikTokPortabilityDataSource': env('PORTABILITY_RATE_LIMIT', default='60/m'),
+}
+DATA_SOURCE_DISPATCH_LOCK_TIMEOUT = 240
+
+# Local mirror of the AWARE transformed tables (optional). When enabled, a
+# beat task copies new rows of study devices and AWARE sources read from the
+# mirror while it is no older than AWARE_MIRROR_MAX_AGE seconds.
+AWARE_MIRROR_ENABLED = env.bool('AWARE_MIRROR_ENABLED', default=False)
+AWARE_MIRROR_SYNC_INTERVAL = env.int('AWARE_MIRROR_SYNC_INTERVAL', default=5 * 60)
+AWARE_MIRROR_MAX_AGE = env.int('AWARE_MIRROR_MAX_AGE', default=3 * AWARE_MIRROR_SYNC_INTERVAL)
+AWARE_MIRROR_BATCH_SIZE = env.int('AWARE_MIRROR_BATCH_SIZE', default=5000)
+if AWARE_MIRROR_ENABLED:
+    CELERY_BEAT_SCHEDULE['sync-aware-mirror'] = {
+        'task': 'data_sources.tasks.sync_aware_mirror',
+        'schedule': AWARE_MIRROR_SYNC_INTERVAL,
+    }
+
+# Daily row counts per AWARE device and table; count_rows answers whole days
+# from them while they were refreshed within AWARE_ROLLUP_MAX_AGE seconds.
+AWARE_ROLLUP_ENABLED = env.bool('AWARE_ROLLUP_ENABLED', default=True)
+AWARE_ROLLUP_REFRESH_INTERVAL = env.int('AWARE_ROLLUP_REFRESH_INTERVAL', default=10 * 60)
+AWARE_ROLLUP_MAX_AGE = env.int('AWARE_ROLLUP_MAX_AGE', default=3 * AWARE_ROLLUP_REFRESH_INTERVAL)
+if AWARE_ROLLUP_ENABLED:
+    CELERY_BEAT_SCHEDULE['refresh-aware-counts'] = {
+        'task': 'data_sources.tasks.refresh_aware_counts',
+        'schedule': AWARE_ROLLUP_REFRESH_INTERVAL,
+    }
+
+# Background study exports: where artifacts are written and how long they are kept
+EXPORT_ROOT = env('EXPORT_ROOT', default=str(BASE_DIR / 'exports'))
+EXPORT_RETENTION_DAYS = env.int('EXPORT_RETENTION_DAYS', default=7)
+# A pending or running export without a heartbeat for this many seconds is
+# marked failed, so identical requests start a new one. The soft limit lets
+# an export record its failure before CELERY_TASK_TIME_LIMIT kills it.
+EXPORT_STALE_AFTER = env.int('EXPORT_STALE_AFTER', default=15 * 60)
+EXPORT_SOFT_TIME_LIMIT = CELERY_TASK_TIME_LIMIT - 60
+CELERY_BEAT_SCHEDULE['expire-export-jobs'] = {
+    'task': 'studies.tasks.expire_export_jobs',
+    'schedule': 24 * 60 * 60,
+}
+
+# Participant data coverage on the researcher dashboard: days kept, days
+# shown, and how often the stored matrix is rebuilt (seconds)
+COVERAGE_DAYS = env.int('COVERAGE_DAYS', default=30)
+COVERAGE_DISPLAY_DAYS = 14
+CELERY_BEAT_SCHEDULE['build-coverage'] = {
+    'task': 'studies.tasks.build_coverage',
+    'schedule': env.int('COVERAGE_REFRESH_INTERVAL', default=60 * 60),
+}
+# Source types polled in batches (one backend request per batch) and batch sizes
+DATA_SOURCE_POLL_BATCH_SIZES = {
+    'GooglePortabilityDataSource': env.int('PORTABILITY_STATUS_BATCH_SIZE', default=100),
+    'TikTokPortabilityDataSource': env.int('PORTABILITY_STATUS_BATCH_SIZE', default=100),
+}
+# Per-source poll backoff (seconds): polls start at the minimum interval and
+# double while nothing changes, up to the maximum. Finished sources stop.
+DATA_SOURCE_POLL_MIN_INTERVAL = env.int('DATA_SOURCE_POLL_MIN_INTERVAL', default=60)
+DATA_SOURCE_POLL_MAX_INTERVAL = env.int('DATA_SOURCE_POLL_MAX_INTERVAL', default=6 * 60 * 60)
+DATA_SOURCE_POLL_BACKOFF = 2
+DATA_SOURCE_POLL_JITTER = 0.1
+# How long a dispatched source is held back before it can be dispatched again
+DATA_SOURCE_POLL_LEASE = CELERY_TASK_TIME_LIMIT
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
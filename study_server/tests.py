@@ -0,0 +1,263 @@
+"""Query, latency and memory budgets for every page and data API.
+
+Each test seeds one synthetic study at growing participant counts and
+requests every URL at each size, with the data backends stubbed out. A
+page fails its budget when its query count grows with the number of
+participants, exceeds its fixed ceiling, or when its wall time or peak
+memory grows faster than SCALING_EXPONENT_LIMIT. Every named URL of the
+project must be measured or listed in PageBudgetTest.EXEMPT.
+
+Set PERF_REPORT=1 to print the measurements.
+"""
+import math
+import os
+import tempfile
+import time
+import tracemalloc
+import uuid
+from collections import namedtuple
+from unittest.mock import patch
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, URLResolver, get_resolver, resolve, reverse
+from django.utils import timezone
+
+from data_sources.models import AwareDataSource
+from studies.models import Consent, CoverageCell, ExportJob, Study, StudyParticipant
+from users.models import Profile
+
+SIZES = (5, 20, 80)
+# Anything steeper than this between the smallest and largest size counts as not scaling
+SCALING_EXPONENT_LIMIT = 1.5
+# Wall times and allocations below these are dominated by noise
+MIN_SECONDS = 0.05
+MIN_BYTES = 512 * 1024
+REPEAT = 3
+
+ROWS = [{'timestamp': 1700000000000 + n, '_id': n, 'battery_level': 50} for n in range(3)]
+
+Measurement = namedtuple('Measurement', 'status queries seconds peak_bytes')
+
+
+def _external_call(*args, **kwargs):
+    raise AssertionError("Page budget tests must not reach an external backend")
+
+
+def seed_participants(study, count):
+    """Add `count` participants, each with an active AWARE source and two consents."""
+    for _ in range(count):
+        name = f'participant-{uuid.uuid4().hex[:12]}'
+        user = User.objects.create_user(username=name, email=f'{name}@example.com', password='pass')
+        profile = Profile.objects.create(user=user, user_type='participant')
+        study_participant = StudyParticipant.objects.create(participant=profile, study=study)
+        source = AwareDataSource.objects.create(
+            profile=profile, name='Phone', status='active', device_id=str(uuid.uuid4()),
+        )
+        Consent.objects.create(
+            participant=profile, study=study, study_participant=study_participant, data_source=source,
+            source_type='AwareDataSource', is_complete=True, consent_text_accepted=True,
+            consent_date=timezone.now(),
+        )
+        Consent.objects.create(
+            participant=profile, study=study, study_participant=study_participant,
+            source_type='JsonUrlDataSource', is_optional=True, consent_date=timezone.now(),
+        )
+        CoverageCell.objects.create(
+            study=study, study_participant=study_participant, source_type='AwareDataSource',
+            data_type='battery', day=timezone.now().date(), row_count=len(ROWS),
+        )
+
+
+def named_urls(patterns=None, namespace=None):
+    """Names of the project's URL patterns, leaving out Django's own views (admin, auth)."""
+    names = set()
+    for pattern in get_resolver().url_patterns if patterns is None else patterns:
+        if isinstance(pattern, URLResolver):
+            names |= named_urls(pattern.url_patterns, pattern.namespace or namespace)
+        elif isinstance(pattern, URLPattern) and pattern.name and namespace is None:
+            if not pattern.callback.__module__.startswith('django.'):
+                names.add(pattern.name)
+    return names
+
+
+@override_settings(DATA_FETCH_MAX_WORKERS=1)
+class PageBudgetTest(TestCase):
+    # Fixed query ceilings; pages not listed here only have to stay flat
+    QUERY_BUDGETS = {
+        'dashboard': 10,
+        'researcher_dashboard': 8,
+        'participant_detail': 10,
+        'study_data_api': 6,
+        'study_data_api_rows': 6,
+        'study_data_api_page': 6,
+        'admin_consents': 8,
+        'admin_study': 13,
+    }
+    # Named URLs that are not measured, and why
+    EXEMPT = {
+        'join_study': "creates the participant's consents on every request",
+        'delete_data_source': "POST only, deletes the source",
+        'confirm_data_source': "confirms the source with its backend",
+        'auth_start': "redirects to the backend's OAuth provider",
+        'portability_webhook': "POST only, called by the portability server",
+        'study_export_create': "POST only, queues an export job",
+    }
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.report = []
+
+    @classmethod
+    def tearDownClass(cls):
+        if os.environ.get('PERF_REPORT'):
+            print()
+            for name, size, measurement in cls.report:
+                print(f"{name:28} n={size:<4} queries={measurement.queries:<4} "
+                      f"{measurement.seconds * 1000:8.1f} ms {measurement.peak_bytes / 1024:8.0f} KiB")
+        super().tearDownClass()
+
+    def setUp(self):
+        self.study = Study.objects.create(title='Budget Study', config_url='https://example.com/study')
+        researcher_user = User.objects.create_superuser(
+            username='budget-researcher', password='pass', email='researcher@example.com',
+        )
+        self.researcher = Profile.objects.create(user=researcher_user, user_type='researcher')
+        self.study.researchers.add(self.researcher)
+        seed_participants(self.study, 1)
+        self.participant = Consent.objects.filter(study=self.study).first().participant
+        with tempfile.NamedTemporaryFile(suffix='.zip', delete=False) as artifact:
+            artifact.write(b'PK' * 1024)
+        self.addCleanup(os.remove, artifact.name)
+        self.export = ExportJob.objects.create(
+            study=self.study, fingerprint='budget', status='complete', file_path=artifact.name,
+        )
+
+        for target, kwargs in (
+            ('data_sources.models.db_connector.connection', {'side_effect': _external_call}),
+            ('requests.Session.request', {'side_effect': _external_call}),
+            ('studies.services.get_study_page_html', {'return_value': '<h1>Budget Study</h1>'}),
+            ('studies.services.get_consent_template', {'return_value': '<div>{{ consent_form }}</div>'}),
+            ('data_sources.models.aware.AwareDataSource.get_data_types', {'return_value': ['battery']}),
+            ('data_sources.models.aware.AwareDataSource.prefetch_data_types', {}),
+            ('data_sources.models.aware.AwareDataSource.fetch_data', {'return_value': ROWS}),
+            ('data_sources.models.aware.AwareDataSource.fetch_page', {'return_value': (ROWS, None)}),
+            ('data_sources.models.aware.AwareDataSource.iter_data', {'side_effect': lambda **_: iter(ROWS)}),
+        ):
+            patcher = patch(target, **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def pages(self):
+        """(name, user, url, query) for every page, with the URL built for the current seed."""
+        source = AwareDataSource.objects.filter(profile=self.participant).first()
+        optional = Consent.objects.filter(participant=self.participant, is_optional=True).first()
+        return [
+            ('home', None, reverse('home'), {}),
+            ('login', None, reverse('login'), {}),
+            ('terms', None, reverse('terms_of_service'), {}),
+            ('privacy', None, reverse('privacy_statement'), {}),
+            ('signup', None, reverse('signup'), {}),
+            ('signup_researcher', None, reverse('signup_researcher'), {}),
+            ('dashboard', self.participant, reverse('dashboard'), {}),
+            ('my_data_api', self.participant, reverse('my_data_api'), {}),
+            ('my_data_api_page', self.participant, reverse('my_data_api'), {'limit': 10}),
+            ('study_detail', self.participant, reverse('study_detail', args=[self.study.id]), {}),
+            ('select_data_source', self.participant, reverse('select_data_source_type'), {}),
+            ('view_data_source', self.participant, reverse('view_data_source', args=[source.id]), {}),
+            ('instructions', self.participant, reverse('instructions', args=[source.id]), {}),
+            ('add_data_source', self.participant, reverse('add_data_source', args=['JsonUrl']), {}),
+            ('edit_data_source', self.participant, reverse('edit_data_source', args=[source.id]), {}),
+            ('datasource_token_view', None,
+             reverse('datasource_token_view', args=[source.config_token, 'client_get_study_info']), {}),
+            ('auth_callback', self.participant, reverse('auth_callback'), {'state': 'unknown'}),
+            ('consent_workflow', self.participant, reverse('consent_workflow', args=[self.study.id]), {}),
+            ('withdraw_from_study', self.participant, reverse('withdraw_from_study', args=[self.study.id]), {}),
+            ('revoke_consent', self.participant, reverse('revoke_consent', args=[optional.id]), {}),
+            ('download_static_file', self.participant,
+             reverse('download_static_file', args=['aware/aware_join.jpg']), {}),
+            ('manage_token', self.researcher, reverse('manage_token'), {}),
+            ('researcher_dashboard', self.researcher, reverse('researcher_dashboard'), {}),
+            ('participant_detail', self.researcher,
+             reverse('participant_detail', args=[self.study.id, self.participant.id]), {}),
+            ('study_data_api', self.researcher, reverse('study_data_api'), {}),
+            ('study_data_api_rows', self.researcher, reverse('study_data_api'), {'data_type': 'battery'}),
+            ('study_data_api_page', self.researcher, reverse('study_data_api'),
+             {'data_type': 'battery', 'limit': 10}),
+            ('study_export_status', self.researcher, reverse('study_export_status', args=[self.export.id]), {}),
+            ('study_export_download', self.researcher,
+             reverse('study_export_download', args=[self.export.id]), {}),
+            ('admin_consents', self.researcher, reverse('admin:studies_consent_changelist'), {}),
+            ('admin_study', self.researcher, reverse('admin:studies_study_change', args=[self.study.id]), {}),
+        ]
+
+    def login(self, user):
+        if user is None:
+            self.client.logout()
+        else:
+            self.client.force_login(user.user)
+
+    def request(self, url, query):
+        response = self.client.get(url, query)
+        if getattr(response, 'streaming', False):
+            b''.join(response.streaming_content)
+        return response
+
+    def measure(self, user, url, query):
+        self.login(user)
+        # Warm up caches (content types, templates) so only the page itself is measured
+        self.request(url, query)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.request(url, query)
+        # Read now: the next request resets the connection's query log
+        query_count = len(queries)
+        seconds = math.inf
+        for _ in range(REPEAT):
+            started = time.perf_counter()
+            self.request(url, query)
+            seconds = min(seconds, time.perf_counter() - started)
+        tracemalloc.start()
+        try:
+            self.request(url, query)
+            _, peak_bytes = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        return Measurement(response.status_code, query_count, seconds, peak_bytes)
+
+    def measure_all(self, size):
+        seed_participants(self.study, size - Consent.objects.filter(study=self.study, is_optional=False).count())
+        results = {}
+        for name, user, url, query in self.pages():
+            results[name] = self.measure(user, url, query)
+            self.report.append((name, size, results[name]))
+        return results
+
+    def assertScales(self, name, metric, small, large, floor):
+        if large < floor:
+            return
+        exponent = math.log(max(large, 1) / max(small, 1)) / math.log(SIZES[-1] / SIZES[0])
+        self.assertLessEqual(
+            exponent, SCALING_EXPONENT_LIMIT,
+            f"{name}: {metric} grows with exponent {exponent:.2f} ({small} -> {large})",
+        )
+
+    def test_every_named_url_is_measured(self):
+        measured = {resolve(url).url_name for _, _, url, _ in self.pages()}
+        self.assertEqual(named_urls() - measured - set(self.EXEMPT), set())
+        self.assertEqual(measured & set(self.EXEMPT), set())
+
+    def test_pages_stay_within_budget(self):
+        results = [self.measure_all(size) for size in SIZES]
+        small, large = results[0], results[-1]
+        for name, measured in large.items():
+            with self.subTest(page=name):
+                self.assertLess(measured.status, 500)
+                queries = [result[name].queries for result in results]
+                self.assertEqual(len(set(queries)), 1, f"{name}: queries grow with participants ({queries})")
+                if name in self.QUERY_BUDGETS:
+                    self.assertLessEqual(measured.queries, self.QUERY_BUDGETS[name])
+                self.assertScales(name, 'wall time', small[name].seconds, measured.seconds, MIN_SECONDS)
+                self.assertScales(name, 'peak memory', small[name].peak_bytes, measured.peak_bytes, MIN_BYTES)
@@ -1,5 +1,21 @@
 import csv
-from django.http import HttpResponse
+import json
+import pickle
+import tempfile
+from decimal import Decimal
+import pyarrow as pa
+import pyarrow.parquet as pq
+from django.conf import settings
+from django.core import signing
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, StreamingHttpResponse
+
+STREAM_CHUNK_SIZE = 64 * 1024
+# Rows buffered by _Spool stay in memory up to this size, then go to a temporary file
+SPOOL_MEMORY_SIZE = 8 * 1024 * 1024
+CURSOR_SALT = 'study_server.cursor'
+SYNC_SALT = 'study_server.sync'
+
 
 def data_to_csv_response(data, filename):
     if not data:
@@ -8,8 +24,301 @@ def data_to_csv_response(data, filename):
     response = HttpResponse(content_type='text/csv')
     response['Content-Disposition'] = f'attachment; filename="{filename}"'
 
-    writer = csv.DictWriter(response, fieldnames=data[0].keys())
+    writer = csv.DictWriter(response, fieldnames=list(dict.fromkeys(key for row in data for key in row)))
     writer.writeheader()
     writer.writerows(data)
 
-    return response
\ No newline at end of file
+    return response
+
+
+class _Echo:
+    """File-like object that hands back whatever is written to it."""
+    def write(self, value):
+        return value
+
+
+def _chunked(pieces):
+    """Join small string pieces into chunks of roughly STREAM_CHUNK_SIZE."""
+    buffer = []
+    size = 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= STREAM_CHUNK_SIZE:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+class _Spool:
+    """Rows buffered in a temporary file so that they can be read more than once.
+
+    Lets a writer see every column before its first byte goes out. Only one
+    iteration may be in progress at a time.
+    """
+
+    def __init__(self, rows):
+        self._file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_SIZE)
+        self.columns = {}
+        for row in rows:
+            pickle.dump(row, self._file, protocol=pickle.HIGHEST_PROTOCOL)
+            for name in row:
+                self.columns.setdefault(name, None)
+
+    def __iter__(self):
+        self._file.seek(0)
+        while True:
+            try:
+                yield pickle.load(self._file)
+            except EOFError:
+                return
+
+    def close(self):
+        self._file.close()
+
+
+def iter_csv(rows):
+    """Yield CSV lines for an iterable of dicts.
+
+    The rows are spooled first, so that the header holds every column of
+    every row; rows without a column leave it empty.
+    """
+    spool = _Spool(rows)
+    try:
+        if not spool.columns:
+            return
+        writer = csv.DictWriter(_Echo(), fieldnames=list(spool.columns))
+        yield writer.writeheader()
+        for row in spool:
+            yield writer.writerow(row)
+    finally:
+        spool.close()
+
+
+def iter_ndjson(rows):
+    """Yield one JSON document per row."""
+    for row in rows:
+        yield json.dumps(row, cls=DjangoJSONEncoder) + '\n'
+
+
+def iter_json(rows, envelope):
+    """Yield a JSON object containing `envelope`, the rows as "data" and a trailing "data_count"."""
+    head = json.dumps(envelope, cls=DjangoJSONEncoder)
+    yield head[:-1] + (', ' if envelope else '') + '"data": ['
+    count = 0
+    for row in rows:
+        yield (', ' if count else '') + json.dumps(row, cls=DjangoJSONEncoder)
+        count += 1
+    yield f'], "data_count": {count}}}'
+
+
+class _Drain:
+    """Binary sink for pyarrow writers; take() hands back what was written since the last call."""
+    closed = False
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _row_groups(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _as_text(value):
+    if value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, cls=DjangoJSONEncoder)
+    return str(value)
+
+
+def _values(batch, name):
+    """One column of a batch. Decimals become floats, as their precision varies per row."""
+    values = [row.get(name) for row in batch]
+    return [float(value) if isinstance(value, Decimal) else value for value in values]
+
+
+def _column_type(values):
+    """Arrow type of one column of a row group; null if all values are None.
+
+    Columns mixing incompatible types (e.g. numbers and strings) become strings.
+    """
+    try:
+        return pa.array(values).type
+    except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError):
+        return pa.string()
+
+
+def _merge_types(first, second):
+    """A type that holds the values of both types: numbers widen to floats, anything else to strings."""
+    if first is None or pa.types.is_null(first):
+        return second
+    if pa.types.is_null(second) or first == second:
+        return first
+    numeric = (pa.types.is_integer, pa.types.is_floating)
+    if any(check(first) for check in numeric) and any(check(second) for check in numeric):
+        return pa.float64()
+    return pa.string()
+
+
+def _schema(rows, columns, row_group_size):
+    """Schema that every row group of `rows` fits into. All-null columns become strings."""
+    types = {}
+    for batch in _row_groups(rows, row_group_size):
+        for name in dict.fromkeys(key for row in batch for key in row):
+            types[name] = _merge_types(types.get(name), _column_type(_values(batch, name)))
+    return pa.schema([
+        (name, pa.string() if pa.types.is_null(types[name]) else types[name])
+        for name in columns
+    ])
+
+
+def _convert_column(field, values):
+    """Arrow array of `field`'s type. Raises ValueError rather than drop or coerce values."""
+    if pa.types.is_string(field.type):
+        values = [_as_text(value) for value in values]
+    try:
+        return pa.array(values, type=field.type)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, OverflowError) as e:
+        raise ValueError(f"Column '{field.name}' holds values that do not fit its type {field.type}: {e}") from e
+
+
+def _record_batch(batch, schema):
+    """Arrow record batch of a list of dicts; columns a row lacks are null."""
+    columns = [_convert_column(field, _values(batch, field.name)) for field in schema]
+    return pa.RecordBatch.from_arrays(columns, schema=schema)
+
+
+def _iter_columnar(rows, open_writer, row_group_size):
+    row_group_size = row_group_size or settings.COLUMNAR_ROW_GROUP_SIZE
+    # A Parquet/Arrow schema cannot change once the first row group is out,
+    # so all rows are read (and spooled) before anything is written
+    spool = _Spool(rows)
+    try:
+        schema = _schema(spool, spool.columns, row_group_size)
+        sink = _Drain()
+        writer = open_writer(sink, schema)
+        for batch in _row_groups(spool, row_group_size):
+            writer.write_batch(_record_batch(batch, schema))
+            yield sink.take()
+        writer.close()
+        yield sink.take()
+    finally:
+        spool.close()
+
+
+def iter_parquet(rows, row_group_size=None):
+    """Yield a zstd compressed Parquet file in pieces, one row group at a time.
+
+    The rows are spooled first, so that the schema covers every column and
+    value: a column that holds numbers and text is written as text. Peak
+    memory is one row group plus SPOOL_MEMORY_SIZE.
+    """
+    def open_writer(sink, schema):
+        return pq.ParquetWriter(sink, schema, compression='zstd')
+    return _iter_columnar(rows, open_writer, row_group_size)
+
+
+def iter_arrow(rows, row_group_size=None):
+    """Yield an Arrow IPC stream in pieces, one record batch at a time (see iter_parquet)."""
+    def open_writer(sink, schema):
+        return pa.ipc.new_stream(sink, schema, options=pa.ipc.IpcWriteOptions(compression='zstd'))
+    return _iter_columnar(rows, open_writer, row_group_size)
+
+
+COLUMNAR_FORMATS = {
+    'parquet': (iter_parquet, 'application/vnd.apache.parquet', 'parquet'),
+    'arrow': (iter_arrow, 'application/vnd.apache.arrow.stream', 'arrows'),
+}
+
+
+def stream_columnar_response(rows, output_format, filename):
+    """Stream rows as one of COLUMNAR_FORMATS; `filename` is given without extension."""
+    write, content_type, extension = COLUMNAR_FORMATS[output_format]
+    response = StreamingHttpResponse(write(rows), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{extension}"'
+    return response
+
+
+def stream_csv_response(rows, filename):
+    response = StreamingHttpResponse(_chunked(iter_csv(rows)), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def stream_ndjson_response(rows):
+    return StreamingHttpResponse(_chunked(iter_ndjson(rows)), content_type='application/x-ndjson')
+
+
+def stream_json_response(rows, envelope):
+    return StreamingHttpResponse(_chunked(iter_json(rows, envelope)), content_type='application/json')
+
+
+def encode_cursor(cursor):
+    """Turn a JSON-serializable pagination cursor into an opaque, tamper-proof token."""
+    if cursor is None:
+        return None
+    return signing.dumps(cursor, salt=CURSOR_SALT, compress=True)
+
+
+def decode_cursor(token):
+    """Inverse of encode_cursor. Raises ValueError for invalid tokens."""
+    if not token:
+        return None
+    try:
+        return signing.loads(token, salt=CURSOR_SALT)
+    except signing.BadSignature as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def encode_sync_token(data_type, marks):
+    """Sign the {consent id: watermark} map of a sync into an opaque token.
+
+    Many consents share a watermark (e.g. an AWARE table's highest _id), so
+    consents are grouped by watermark to keep tokens short. Consents without
+    a watermark are left out: the next sync returns all of their rows.
+    """
+    groups = {}
+    for consent_id, mark in sorted(marks.items()):
+        if mark is not None:
+            groups.setdefault(json.dumps(mark), []).append(consent_id)
+    payload = {'t': data_type, 'm': [[json.loads(mark), ids] for mark, ids in groups.items()]}
+    return signing.dumps(payload, salt=SYNC_SALT, compress=True)
+
+
+def decode_sync_token(token):
+    """Inverse of encode_sync_token: (data_type, {consent id: watermark}). Raises ValueError."""
+    try:
+        payload = signing.loads(token, salt=SYNC_SALT)
+        return payload['t'], {consent_id: mark for mark, ids in payload['m'] for consent_id in ids}
+    except (signing.BadSignature, KeyError, TypeError, ValueError) as e:
+        raise ValueError("Invalid sync token") from e
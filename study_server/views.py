@@ -1,8 +1,66 @@
-from django.http import FileResponse
+from django.http import FileResponse, HttpResponse
 from django.conf import settings
 from django.contrib import messages
 from django.shortcuts import redirect
 import os
+import re
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class _RangeFile:
+    """Read at most `length` bytes of an open file, for a partial response."""
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def ranged_file_response(request, path, filename, content_type='application/octet-stream'):
+    """Serve a file as an attachment, honouring a single-range `Range` header.
+
+    Lets clients resume large downloads. Multi-range requests get the whole file.
+    """
+    size = os.path.getsize(path)
+    match = RANGE_RE.match(request.headers.get('Range', '').strip())
+    partial = bool(match and (match.group(1) or match.group(2)))
+    start, end = 0, size - 1
+    if partial:
+        if match.group(1):
+            start = int(match.group(1))
+            if match.group(2):
+                end = min(int(match.group(2)), size - 1)
+        else:
+            # Suffix range: the last N bytes
+            start = max(0, size - int(match.group(2)))
+        if start >= size or start > end:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    file = open(path, 'rb')
+    if partial:
+        file.seek(start)
+        response = FileResponse(_RangeFile(file, end - start + 1), content_type=content_type, status=206)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    else:
+        response = FileResponse(file, content_type=content_type)
+    response['Content-Length'] = str(end - start + 1)
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
 
 def download_static_file(request, file_path):
     """Generic view for downloading files from STATIC_ROOT"""
@@ -17,7 +75,4 @@ def download_static_file(request, file_path):
         messages.error(request, "File not found.")
         return redirect('dashboard')
     
-    filename = os.path.basename(full_path)
-    response = FileResponse(open(full_path, 'rb'), content_type='application/octet-stream')
-    response['Content-Disposition'] = f'attachment; filename="{filename}"'
-    return response
\ No newline at end of file
+    return ranged_file_response(request, full_path, os.path.basename(full_path))
\ No newline at end of file
@@ -1,9 +1,13 @@
+from unittest.mock import patch
 from django.test import TestCase, Client
 from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
 from django.urls import reverse
 from users.models import Profile
 from rest_framework.authtoken.models import Token
-from studies.models import Study, Consent
+from studies.models import Study, Consent, StudyParticipant, CoverageCell
+from data_sources.models import AwareDataSource
 from django.utils import timezone
 from django.contrib.auth.models import User
 from django.urls import path
@@ -375,6 +379,107 @@ class ResearcherDashboardExtendedTest(TestCase):
         self.assertEqual(len(response.context['studies_data']), 1)
         self.assertEqual(len(response.context['studies_data'][0]['participants']), 1)
 
+    def test_researcher_dashboard_renders_stored_coverage(self):
+        researcher_user = User.objects.create_user(username='covres', password='pass')
+        researcher_profile = Profile.objects.create(user=researcher_user, user_type='researcher')
+        study = Study.objects.create(title='Coverage Study', config_url='test')
+        study.researchers.add(researcher_profile)
+        part_user = User.objects.create_user(username='covpart', password='pass')
+        part_profile = Profile.objects.create(user=part_user, user_type='participant')
+        study_participant = StudyParticipant.objects.create(participant=part_profile, study=study)
+        Consent.objects.create(participant=part_profile, study=study, consent_date=timezone.now(),
+                               source_type='AwareDataSource', is_complete=True)
+        CoverageCell.objects.create(
+            study=study, study_participant=study_participant, source_type='AwareDataSource',
+            data_type='battery', day=timezone.now().date(), row_count=12,
+        )
+
+        self.client.login(username='covres', password='pass')
+        with patch('data_sources.models.db_connector.connection') as mock_connection:
+            response = self.client.get(reverse('researcher_dashboard'))
+        mock_connection.assert_not_called()
+        coverage = response.context['studies_data'][0]['coverage']
+        self.assertEqual(coverage['rows'][0]['data_type'], 'battery')
+        self.assertEqual(coverage['rows'][0]['cells'][-1]['row_count'], 12)
+        self.assertContains(response, 'coverage-level-4')
+
+
+class ResearcherDashboardQueryTest(TestCase):
+    def setUp(self):
+        self.researcher_user = User.objects.create_user(username='qres', password='pass')
+        researcher_profile = Profile.objects.create(user=self.researcher_user, user_type='researcher')
+        self.study = Study.objects.create(title='Query Study', config_url='test')
+        self.study.researchers.add(researcher_profile)
+        self.client.login(username='qres', password='pass')
+
+    def _add_participants(self, count):
+        for n in range(Profile.objects.count(), Profile.objects.count() + count):
+            user = User.objects.create_user(username=f'qpart{n}', email=f'qpart{n}@example.com', password='pass')
+            profile = Profile.objects.create(user=user, user_type='participant')
+            StudyParticipant.objects.create(participant=profile, study=self.study)
+            Consent.objects.create(participant=profile, study=self.study, consent_date=timezone.now(),
+                                   source_type='SomeSource', is_complete=True)
+            Consent.objects.create(participant=profile, study=self.study, consent_date=timezone.now(),
+                                   source_type='OtherSource', is_optional=True, is_complete=True)
+
+    def _count_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('researcher_dashboard'))
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    @override_settings(RESEARCHER_DASHBOARD_PAGE_SIZE=5)
+    def test_query_count_does_not_grow_with_participants(self):
+        self._add_participants(2)
+        few = self._count_queries()
+        self._add_participants(20)
+        self.assertEqual(self._count_queries(), few)
+        # session, user, profile, studies; then per study: consent totals,
+        # participant count, participant page, coverage cells
+        self.assertEqual(few, 8)
+
+    @override_settings(RESEARCHER_DASHBOARD_PAGE_SIZE=5)
+    def test_pagination(self):
+        self._add_participants(7)
+        response = self.client.get(reverse('researcher_dashboard'), {f'page_{self.study.id}': 2})
+        study_data = response.context['studies_data'][0]
+        self.assertEqual(study_data['participant_count'], 7)
+        self.assertEqual(len(study_data['participants']), 2)
+        participant = study_data['participants'][0]
+        # No data source, so the required consent is not complete
+        self.assertEqual((participant['required_complete'], participant['required_total']), (0, 1))
+        self.assertEqual((participant['optional_complete'], participant['optional_total']), (1, 1))
+        self.assertEqual(participant['status'], 'Incomplete')
+        self.assertIsNotNone(participant['pseudo_id'])
+
+    @override_settings(RESEARCHER_DASHBOARD_PAGE_SIZE=5)
+    def test_coverage_follows_the_participant_page(self):
+        self._add_participants(7)
+        for n, study_participant in enumerate(StudyParticipant.objects.filter(study=self.study).order_by('pk')):
+            CoverageCell.objects.create(
+                study=self.study, study_participant=study_participant, source_type='SomeSource',
+                data_type='battery', day=timezone.now().date(), row_count=100 if n == 0 else 10,
+            )
+        response = self.client.get(reverse('researcher_dashboard'), {f'page_{self.study.id}': 2})
+        study_data = response.context['studies_data'][0]
+        page_ids = {str(participant['pseudo_id']) for participant in study_data['participants']}
+        rows = study_data['coverage']['rows']
+        self.assertEqual({row['pseudo_id'] for row in rows}, page_ids)
+        # Levels stay relative to the busiest participant of the whole study
+        self.assertEqual([row['cells'][-1]['level'] for row in rows], [1, 1])
+
+    def test_search_by_email_and_pseudo_id(self):
+        self._add_participants(3)
+        target = StudyParticipant.objects.filter(study=self.study).order_by('id').last()
+        response = self.client.get(reverse('researcher_dashboard'), {'q': target.participant.user.email})
+        participants = response.context['studies_data'][0]['participants']
+        self.assertEqual([p['id'] for p in participants], [target.participant_id])
+        response = self.client.get(reverse('researcher_dashboard'), {'q': str(target.pseudo_id)})
+        participants = response.context['studies_data'][0]['participants']
+        self.assertEqual([p['id'] for p in participants], [target.participant_id])
+        response = self.client.get(reverse('researcher_dashboard'), {'q': 'nobody'})
+        self.assertContains(response, 'No participants match')
+
 
 class ParticipantDetailTest(TestCase):
     def setUp(self):
@@ -416,6 +521,26 @@ class ParticipantDetailTest(TestCase):
         response = self.client.get(self.url)
         self.assertEqual(response.status_code, 200)
 
+    def test_participant_detail_queries_do_not_grow_with_consents(self):
+        self.client.login(username='detres', password='pass')
+
+        def add_sourced_consents(count):
+            for n in range(count):
+                source = AwareDataSource.objects.create(
+                    profile=self.part_profile, name='Phone', device_id=str(uuid.uuid4()),
+                )
+                Consent.objects.create(participant=self.part_profile, study=self.study, data_source=source,
+                                       consent_date=timezone.now(), source_type='AwareDataSource')
+
+        add_sourced_consents(1)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(self.url)
+        add_sourced_consents(5)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get(self.url)
+        self.assertEqual(len(many), len(few))
+        self.assertEqual(response.context['consent_info'][-1]['data_source']['type'], 'AWARE Mobile Data')
+
     def test_participant_detail_allows_superuser(self):
         su = User.objects.create_superuser(username='super', password='pass')
         Profile.objects.create(user=su, user_type='researcher')
@@ -485,3 +610,46 @@ class MyDataApiTest(TestCase):
         data = response.json()
         self.assertEqual(data['data_count'], 0)
         self.assertEqual(data['data'], [])
+
+    def test_my_data_api_cursor_pagination(self):
+        from data_sources.models import JsonUrlDataSource
+        JsonUrlDataSource.objects.create(
+            profile=self.profile, name='Json', url='https://example.com/data.json', status='active'
+        )
+        rows = [{'value': i} for i in range(5)]
+
+        def fake_fetch(source, data_type, limit, start_date, end_date, offset=0):
+            return [dict(r) for r in rows[offset:offset + limit]]
+
+        params = {'limit': 2}
+        seen = []
+        with patch('data_sources.models.JsonUrlDataSource.fetch_data', autospec=True, side_effect=fake_fetch):
+            for _ in range(5):
+                body = self.client.get(
+                    reverse('my_data_api'), params, HTTP_AUTHORIZATION=f'Token {self.token.key}'
+                ).json()
+                seen.extend(row['value'] for row in body['data'])
+                if not body['next_cursor']:
+                    break
+                params['cursor'] = body['next_cursor']
+        self.assertEqual(seen, [0, 1, 2, 3, 4])
+
+    @patch.object(AwareDataSource, 'get_data_types', return_value=['battery'])
+    @patch.object(AwareDataSource, 'fetch_page', return_value=([{'_id': 1}], None))
+    def test_my_data_api_paged_parses_dates(self, mock_page, _mock_types):
+        AwareDataSource.objects.create(profile=self.profile, name='Phone', status='active')
+        response = self.client.get(
+            reverse('my_data_api'), {'limit': 10, 'start_date': '2024-05-01', 'end_date': '2024-05-31'},
+            HTTP_AUTHORIZATION=f'Token {self.token.key}',
+        )
+        self.assertEqual(response.status_code, 200)
+        start_date = mock_page.call_args.kwargs['start_date']
+        self.assertEqual(start_date, timezone.make_aware(timezone.datetime(2024, 5, 1)))
+        self.assertEqual(mock_page.call_args.kwargs['end_date'].day, 31)
+
+    def test_my_data_api_invalid_date_returns_400(self):
+        response = self.client.get(
+            reverse('my_data_api'), {'limit': 10, 'start_date': '05/01/2024'},
+            HTTP_AUTHORIZATION=f'Token {self.token.key}',
+        )
+        self.assertEqual(response.status_code, 400)
@@ -1,10 +1,16 @@
+import uuid
+from datetime import datetime
+
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.http import JsonResponse
 from django.shortcuts import get_object_or_404
+from django.core.paginator import Paginator
+from django.db.models import Count, OuterRef, Q, Subquery
 from django.contrib.auth.models import Group
 from django.apps import apps
+from django.conf import settings
 from django.contrib.auth import login
 from django.contrib.auth.forms import AuthenticationForm
 from rest_framework.decorators import api_view, authentication_classes, permission_classes
@@ -12,12 +18,15 @@ from rest_framework.authentication import TokenAuthentication, SessionAuthentica
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.authtoken.models import Token
 
-from study_server.utils import data_to_csv_response
+from study_server.utils import data_to_csv_response, encode_cursor, decode_cursor
 from users.models import Profile
 from studies.models import Study, Consent, StudyParticipant
+from studies.coverage import coverage_matrix
+from studies.rows import make_timezone_aware
 from .forms import CustomUserCreationForm
 from studies.views import study_detail
 from data_sources.models import get_display_type_from_source_type
+from data_sources.models import db_connector
 
 
 
@@ -157,14 +166,14 @@ def get_active_studies_data(profile, request):
             participant=profile,
             study=study,
             revocation_date__isnull=True
-        )
+        ).with_real_sources()
         for consent in consents:
             consent_data = {
                 'consent': consent,
                 'type_name': get_display_type_from_source_type(consent.source_type),
             }
             if consent.data_source:
-                source = consent.data_source.get_real_instance()
+                source = consent.data_source
                 consent_data['source'] = source
             
 
@@ -219,62 +228,90 @@ def dashboard(request):
     return render(request, 'dashboard.html', context)
 
 
+def _dashboard_participants(study, query=''):
+    """One row per participant with active consents, counted in a single query."""
+    consents = Consent.objects.filter(
+        study=study, revocation_date__isnull=True, participant__isnull=False,
+    )
+    if query:
+        search = Q(participant__user__email__icontains=query) | Q(participant__user__username__icontains=query)
+        try:
+            search |= Q(participant__study_participations__study=study,
+                        participant__study_participations__pseudo_id=uuid.UUID(query))
+        except ValueError:
+            pass
+        consents = consents.filter(search)
+    required = Q(is_optional=False)
+    optional = Q(is_optional=True)
+    return (
+        consents.values('participant', 'participant__user__email')
+        .annotate(
+            required_total=Count('id', filter=required, distinct=True),
+            required_complete=Count(
+                'id', filter=required & Q(is_complete=True, data_source__status='active'), distinct=True,
+            ),
+            optional_total=Count('id', filter=optional, distinct=True),
+            optional_complete=Count('id', filter=optional & Q(is_complete=True), distinct=True),
+            pseudo_id=Subquery(
+                StudyParticipant.objects.filter(participant=OuterRef('participant'), study=study)
+                .values('pseudo_id')[:1]
+            ),
+        )
+        .order_by('participant')
+    )
+
+
 @login_required
 def researcher_dashboard(request):
     if request.user.profile.user_type != 'researcher':
         messages.error(request, "Access denied: Researcher dashboard is only for researchers.")
         return redirect('dashboard')
 
+    query = request.GET.get('q', '').strip()
     studies = request.user.profile.studies.all()
     studies_data = []
 
     for study in studies:
-        all_consents = Consent.objects.filter(study=study, revocation_date__isnull=True)
-        withdrawn = Consent.objects.filter(study=study, revocation_date__isnull=False).count()
+        totals = Consent.objects.filter(study=study).aggregate(
+            total_consents=Count('id', filter=Q(revocation_date__isnull=True)),
+            withdrawn=Count('id', filter=Q(revocation_date__isnull=False)),
+        )
+        # Each study pages on its own so paging one table leaves the others alone
+        page_param = f'page_{study.id}'
+        paginator = Paginator(_dashboard_participants(study, query), settings.RESEARCHER_DASHBOARD_PAGE_SIZE)
+        page = paginator.get_page(request.GET.get(page_param))
 
         participants = []
-        participant_profiles = all_consents.values_list('participant', flat=True).distinct()
-        for profile_id in participant_profiles:
-            profile = Profile.objects.get(id=profile_id)
-            participant_consents = all_consents.filter(participant=profile)
-
-            study_participation = StudyParticipant.objects.filter(
-                participant=profile, study=study
-            ).first()
-
-            required_consents = participant_consents.filter(is_optional=False)
-            optional_consents = participant_consents.filter(is_optional=True)
-
-            required_consents_complete = required_consents.filter(
-                is_complete=True,
-                data_source__status='active'
-            )
-            required_complete = required_consents_complete.count()
-            required_total = required_consents.count()
-            optional_complete = optional_consents.filter(is_complete=True).count()
-            optional_total = optional_consents.count()
-
-            status = 'Complete' if required_complete == required_total else 'Incomplete'
-
+        for row in page:
+            required_complete = row['required_complete']
+            required_total = row['required_total']
             participants.append({
-                'id': profile.id,
-                'email': profile.user.email,
+                'id': row['participant'],
+                'email': row['participant__user__email'],
                 'required_complete': required_complete,
                 'required_total': required_total,
-                'optional_complete': optional_complete,
-                'optional_total': optional_total,
-                'status': status,
-                'pseudo_id': study_participation.pseudo_id if study_participation else None,
+                'optional_complete': row['optional_complete'],
+                'optional_total': row['optional_total'],
+                'status': 'Complete' if required_complete == required_total else 'Incomplete',
+                'pseudo_id': row['pseudo_id'],
             })
-            
+
         studies_data.append({
             'study': study,
             'participants': participants,
-            'total_consents': all_consents.count(),
-            'withdrawn': withdrawn,
+            'page': page,
+            'page_param': page_param,
+            'participant_count': paginator.count,
+            'total_consents': totals['total_consents'],
+            'withdrawn': totals['withdrawn'],
+            # Precomputed by studies.tasks.build_coverage; no backend calls here
+            'coverage': coverage_matrix(
+                study, days=settings.COVERAGE_DISPLAY_DAYS,
+                pseudo_ids=[row['pseudo_id'] for row in participants if row['pseudo_id']],
+            ),
         })
 
-    context = {'studies_data': studies_data}
+    context = {'studies_data': studies_data, 'query': query}
     return render(request, 'researcher_dashboard.html', context)
 
 
@@ -294,7 +331,7 @@ def participant_detail(request, study_id, participant_id):
         participant=participant, study=study
     ).first()
 
-    consents = Consent.objects.filter(study=study, participant=participant)
+    consents = Consent.objects.filter(study=study, participant=participant).with_real_sources()
 
     consent_info = []
     for consent in consents:
@@ -306,7 +343,7 @@ def participant_detail(request, study_id, participant_id):
             'consent_date': consent.consent_date,
         }
         if consent.data_source:
-            source = consent.data_source.get_real_instance()
+            source = consent.data_source
             info['data_source'] = {
                 'name': source.name,
                 'status': source.status,
@@ -327,14 +364,91 @@ def participant_detail(request, study_id, participant_id):
 
     return render(request, 'users/participant_detail.html', context)
 
+def _parse_date(date_str):
+    """'2024-05-01' -> aware datetime at midnight, None if empty. Raises ValueError."""
+    return make_timezone_aware(datetime.strptime(date_str, "%Y-%m-%d")) if date_str else None
+
+
+def _my_data_page(sources, data_type, start_date, end_date, limit, cursor):
+    """Collect up to `limit` rows, walking sources by id and their data types by name.
+
+    The cursor is either {'source': id, 'data_type': name, 'page': source_cursor}
+    to resume inside one data type, or {'after': [id, name]} to continue with
+    the next one. Returns (rows, data_types, next_cursor).
+    """
+    cursor = cursor or {}
+    resume = (cursor['source'], cursor['data_type']) if 'source' in cursor else None
+    after = tuple(cursor['after']) if 'after' in cursor else None
+    rows = []
+    seen_types = set()
+    for source in sources:
+        real_source = source.get_real_instance()
+        data_types = sorted(real_source.get_data_types())
+        if data_type:
+            data_types = [data_type] if data_type in data_types else []
+        for dt in data_types:
+            position = (source.id, dt)
+            if after is not None and position <= after:
+                continue
+            if resume is not None and position < resume:
+                continue
+            page_cursor = cursor.get('page') if position == resume else None
+            while len(rows) < limit:
+                page, page_cursor = real_source.fetch_page(
+                    data_type=dt,
+                    limit=limit - len(rows),
+                    start_date=start_date,
+                    end_date=end_date,
+                    cursor=page_cursor,
+                )
+                rows.extend(page)
+                seen_types.add(dt)
+                if page_cursor is None:
+                    break
+            if len(rows) >= limit:
+                if page_cursor is not None:
+                    return rows, seen_types, {'source': source.id, 'data_type': dt, 'page': page_cursor}
+                return rows, seen_types, {'after': [source.id, dt]}
+    return rows, seen_types, None
+
+
 @api_view(['GET'])
 @authentication_classes([TokenAuthentication, SessionAuthentication])
 @permission_classes([IsAuthenticated])
+@db_connector.reuse_connection()
 def my_data_api(request):
     data_type = request.GET.get('data_type')
-    start_date = request.GET.get('start_date')
-    end_date = request.GET.get('end_date')
     output_format = request.GET.get('format', 'json')
+    try:
+        start_date = _parse_date(request.GET.get('start_date'))
+        end_date = _parse_date(request.GET.get('end_date'))
+    except ValueError:
+        return JsonResponse({'error': 'Invalid start_date or end_date, use YYYY-MM-DD'}, status=400)
+
+    if 'limit' in request.GET or 'cursor' in request.GET:
+        try:
+            limit = int(request.GET.get('limit') or settings.DATA_PAGE_SIZE)
+            cursor = decode_cursor(request.GET.get('cursor'))
+        except ValueError:
+            return JsonResponse({'error': 'Invalid limit or cursor'}, status=400)
+        if limit <= 0:
+            return JsonResponse({'error': 'Invalid limit or cursor'}, status=400)
+        sources = request.user.profile.data_sources.order_by('id')
+        page, page_types, next_cursor = _my_data_page(
+            sources, data_type, start_date, end_date, limit, cursor
+        )
+        next_token = encode_cursor(next_cursor)
+        if output_format == 'csv':
+            response = data_to_csv_response(page, "study_data.csv")
+            if next_token:
+                response['X-Next-Cursor'] = next_token
+            return response
+        return JsonResponse({
+            'data_count': len(page),
+            'data_types': sorted(page_types),
+            'data': page,
+            'next_cursor': next_token,
+        })
 
     all_data = []
     all_data_types = set()